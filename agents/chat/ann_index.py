@@ -0,0 +1,243 @@
+"""Inverted-file (IVF) approximate nearest-neighbour index for large corpora."""
+import time
+
+import numpy as np
+
+from .metadata import filter_mask
+from .vector_index import DenseVectorIndex, _atomic_save
+
+
+def _top_rows(scores, k):
+    """Indices of the ``k`` largest values along the last axis, unordered."""
+    k = min(k, scores.shape[-1])
+    return np.argpartition(-scores, k - 1, axis=-1)[..., :k]
+
+
+def _assign(vectors, centroids, block_rows=DenseVectorIndex.BLOCK_ROWS):
+    """Index of the most similar centroid for every row, computed in blocks."""
+    labels = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), block_rows):
+        block = np.asarray(vectors[start:start + block_rows], dtype=np.float32)
+        labels[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return labels
+
+
+def train_centroids(vectors, nlist, iterations=20, sample_size=None, seed=0):
+    """
+    Spherical k-means over (a sample of) unit-length vectors.
+
+    Args:
+        vectors: ``(n, dim)`` embeddings
+        nlist: Number of clusters
+        iterations: Lloyd iterations
+        sample_size: Rows used for training (default 64 per cluster)
+        seed: Random seed, so rebuilds are reproducible
+
+    Returns:
+        np.ndarray: ``(nlist, dim)`` float32 unit-length centroids
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or nlist * 64
+    if len(vectors) > sample_size:
+        rows = np.sort(rng.choice(len(vectors), sample_size, replace=False))
+        sample = np.asarray(vectors[rows], dtype=np.float32)
+    else:
+        sample = np.asarray(vectors, dtype=np.float32)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _assign(sample, centroids)
+        order = np.argsort(labels, kind='stable')
+        counts = np.bincount(labels, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        sums[filled] = np.add.reduceat(sample[order], starts, axis=0)
+        # Re-seed empty clusters on random training points
+        empty = np.flatnonzero(counts == 0)
+        sums[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(DenseVectorIndex):
+    """
+    Approximate cosine-similarity search with an inverted file.
+
+    Vectors are clustered with spherical k-means and stored on disk sorted
+    by cluster, so each inverted list is one contiguous slice of the
+    memory-mapped float16 matrix. A query is compared with the ``nlist``
+    centroids and only the ``nprobe`` closest lists are scanned: raising
+    ``nprobe`` trades latency for recall, and ``nprobe == nlist`` is exact.
+    Added chunks live in the exact in-memory overlay of DenseVectorIndex
+    until the index is rebuilt.
+    """
+
+    def __init__(self, matrix, doc_ids, centroids, offsets, nprobe=8):
+        """
+        Initialize the index.
+
+        Args:
+            matrix: ``(n, dim)`` float16 array sorted by inverted list
+            doc_ids: ``(n,)`` int64 chunk ids, one per matrix row
+            centroids: ``(nlist, dim)`` float32 cluster centroids
+            offsets: ``(nlist + 1,)`` start row of every inverted list
+            nprobe: Inverted lists scanned per query
+        """
+        super().__init__(matrix, doc_ids)
+        self.centroids = np.asarray(centroids, dtype=np.float32)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.nprobe = nprobe
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @staticmethod
+    def default_nlist(count):
+        """About 4 * sqrt(n) lists, the usual starting point for IVF."""
+        return int(min(max(1, 4 * np.sqrt(count)), max(1, count // 39)))
+
+    @staticmethod
+    def _ivf_paths(path):
+        matrix_path = DenseVectorIndex._paths(path)[0]
+        return matrix_path.with_suffix('.centroids.npy'), matrix_path.with_suffix('.offsets.npy')
+
+    @classmethod
+    def build(cls, path, doc_ids, vectors, manifest, nlist=0, nprobe=8, iterations=20):
+        """
+        Cluster the vectors, write the index to disk and open it memory-mapped.
+
+        Args:
+            path: Destination ``.npy`` file for the matrix
+            doc_ids: Chunk id for each row of ``vectors``
+            vectors: ``(n, dim)`` unit-length embeddings
+            manifest: JSON-serialisable description used to validate reloads
+            nlist: Number of inverted lists (0 = ``default_nlist``)
+            nprobe: Inverted lists scanned per query
+            iterations: k-means iterations
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        if len(vectors) == 0:
+            raise ValueError("cannot build an IVF index without vectors")
+        centroids = train_centroids(vectors, nlist or cls.default_nlist(len(vectors)), iterations)
+        labels = _assign(vectors, centroids)
+        order = np.argsort(labels, kind='stable')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=len(centroids)))])
+
+        centroids_path, offsets_path = cls._ivf_paths(path)
+        centroids_path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_save(centroids_path, centroids)
+        _atomic_save(offsets_path, offsets.astype(np.int64))
+        # The manifest is written last, so a half-written index never validates
+        super().build(path, doc_ids[order], vectors[order], manifest)
+        return cls.load(path, manifest, nprobe)
+
+    @classmethod
+    def load(cls, path, manifest=None, nprobe=8):
+        """
+        Open an index written by ``build``.
+
+        Returns:
+            IVFIndex, or None if missing or if ``manifest`` does not match
+        """
+        base = DenseVectorIndex.load(path, manifest)
+        if base is None:
+            return None
+        centroids_path, offsets_path = cls._ivf_paths(path)
+        try:
+            centroids = np.load(centroids_path)
+            offsets = np.load(offsets_path)
+        except (OSError, ValueError):
+            return None
+        if len(offsets) != len(centroids) + 1 or offsets[-1] != len(base.doc_ids):
+            return None
+        return cls(base.matrix, base.doc_ids, centroids, offsets, nprobe)
+
+    def search(self, query_vector, k=4, nprobe=None, allowed=None):
+        """
+        Find approximately the most similar chunks to a query embedding.
+
+        Args:
+            query_vector: Unit-length query embedding
+            k: Number of results
+            nprobe: Override of ``self.nprobe`` for this query
+            allowed: Optional filter bitmap over chunk ids
+
+        Returns:
+            list: ``(doc_id, score)`` pairs, best first
+        """
+        if k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        probes = _top_rows(self.centroids @ query, nprobe or self.nprobe)
+        rows = np.concatenate(
+            [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes] + [np.zeros(0, dtype=np.int64)]
+        )
+        rows.sort()  # Sequential page access on the memory-mapped matrix
+        scores = np.asarray(self.matrix[rows], dtype=np.float32) @ query
+        if self._deleted_mask is not None:
+            scores[self._deleted_mask[rows]] = -np.inf
+        doc_ids = self.doc_ids[rows]
+        if allowed is not None:
+            scores[~filter_mask(allowed, doc_ids)] = -np.inf
+
+        extra_ids, extra_vectors = self._overlay(allowed)
+        if len(extra_ids):
+            doc_ids = np.concatenate([doc_ids, extra_ids])
+            scores = np.concatenate([scores, extra_vectors @ query])
+        if len(scores) == 0:
+            return []
+        top = _top_rows(scores, k)
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(doc_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def search_many(self, query_vectors, k=4, nprobe=None, allowed=None):
+        """Search a batch of query embeddings; each query reads its own candidate rows."""
+        return [self.search(query, k, nprobe=nprobe, allowed=allowed) for query in query_vectors]
+
+    def exact_search(self, query_vector, k=4, allowed=None):
+        """Brute-force search over every live row, the ground truth for ``search``."""
+        return DenseVectorIndex.search(self, query_vector, k, allowed)
+
+
+def recall_report(index, queries, k=10, nprobes=None):
+    """
+    Measure recall@k and latency of an IVF index against exact search.
+
+    Args:
+        index: IVFIndex to evaluate
+        queries: ``(q, dim)`` query embeddings (indexed vectors work well)
+        k: Cut-off for recall
+        nprobes: ``nprobe`` values to try (default: powers of two up to nlist)
+
+    Returns:
+        dict: Exact-search latency and, per ``nprobe``, recall and latency
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    if nprobes is None:
+        nprobes = [1 << i for i in range(int(np.log2(index.nlist)) + 1)]
+        if nprobes[-1] != index.nlist:
+            nprobes.append(index.nlist)
+
+    start = time.perf_counter()
+    truth = [{doc_id for doc_id, _ in index.exact_search(q, k)} for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    report = {"k": k, "queries": len(queries), "nlist": index.nlist,
+              "exact_ms": round(exact_ms, 3), "nprobe": []}
+    for nprobe in nprobes:
+        found = 0
+        start = time.perf_counter()
+        for q, expected in zip(queries, truth):
+            found += len(expected & {doc_id for doc_id, _ in index.search(q, k, nprobe)})
+        elapsed_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        report["nprobe"].append({
+            "nprobe": min(nprobe, index.nlist),
+            "recall": round(found / max(sum(len(t) for t in truth), 1), 4),
+            "ms": round(elapsed_ms, 3),
+        })
+    return report
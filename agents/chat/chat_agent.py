@@ -1,8 +1,11 @@
 """Chat agent for soybean farming advice."""
 from langchain_groq import ChatGroq
+from .context_packer import ContextPacker
 from .memory_manager import MemoryManager
 from .rag_retriever import RAGRetriever
+from .sharding import ShardedRetriever, sharding_enabled
 from ..reasoning.react_agent import ReACTReasoning
+from config import Config
 import os
 
 
@@ -17,7 +20,9 @@ class ChatAgent:
             temperature=0.3  # Lower temperature for more focused, consistent responses
         )
         self.memory_manager = MemoryManager(max_memory=4)
-        self.rag_retriever = RAGRetriever()
+        self.rag_retriever = ShardedRetriever() if sharding_enabled() else RAGRetriever()
+        self.context_packer = ContextPacker(max_tokens=Config.CONTEXT_MAX_TOKENS)
+        self.last_context_report = {}
         self.react_reasoning = ReACTReasoning()
         
         # System identity
@@ -40,15 +45,10 @@ class ChatAgent:
         if not context_docs:
             context = "No specific knowledge found. Provide general soybean farming advice."
         else:
-            # Format context without source markers - just the raw information
-            context_parts = []
-            for doc in context_docs:
-                content = doc["page_content"]
-                # Truncate very long content
-                if len(content) > 500:
-                    content = content[:500] + "..."
-                context_parts.append(content)
-            context = "\n\n".join(context_parts)
+            # Keep the sentences that best answer the question, within the prompt token budget
+            context, self.last_context_report = self.context_packer.pack(
+                user_message, [doc["page_content"] for doc in context_docs]
+            )
         
         # Get recent conversation history
         memory = self.memory_manager.get_recent_memory()
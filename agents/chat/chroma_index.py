@@ -0,0 +1,256 @@
+"""Dense index backed by a persistent Chroma collection."""
+import hashlib
+
+from .metadata import filter_mask
+
+try:
+    import chromadb
+    from chromadb.config import Settings
+    CHROMADB_AVAILABLE = True
+except ImportError:
+    CHROMADB_AVAILABLE = False
+
+# Chunks are embedded and written this many at a time (capped by the server's own limit)
+DEFAULT_BATCH_SIZE = 5000
+# Record ids read per call at startup; Chroma pages by offset, so few large pages are much faster
+ID_PAGE_SIZE = 100000
+# Results fetched per requested result when a metadata filter hides part of the collection
+FILTER_OVERFETCH = 4
+
+
+def content_id(text):
+    """Stable Chroma id of a chunk: the same text always maps to the same record."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def corpus_collection_name(prefix, corpus):
+    """
+    Collection name for one corpus, e.g. ``soybean_knowledge_3f2a9c01b7de``.
+
+    ``sync`` deletes every record its corpus does not hold, so corpora
+    sharing a server must not share a collection.
+    """
+    return f"{prefix}_{hashlib.sha256(str(corpus).encode('utf-8')).hexdigest()[:12]}"
+
+
+def _scalar_metadata(metadata):
+    """Chroma metadata values must be scalars, so multi-valued fields are joined."""
+    return {field: value if isinstance(value, str) else ",".join(value) for field, value in metadata.items()}
+
+
+class ChromaVectorIndex:
+    """
+    Cosine search over chunk embeddings stored in a Chroma collection.
+
+    Records are keyed by a hash of the chunk text, so reopening a persisted
+    collection only embeds chunks it has not seen, writes are idempotent
+    upserts, and the workers serving one corpus can share a collection
+    (other corpora get their own, see ``corpus_collection_name``). Chunk ids are
+    mapped to records in memory; filtering uses the retriever's metadata
+    bitmap, with the Chroma metadata kept for inspection by other tools.
+    """
+
+    def __init__(self, collection, chunk, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Initialize the index.
+
+        Args:
+            collection: Chroma collection using cosine space
+            chunk: Callable returning ``(text, metadata)`` for a live chunk id
+            batch_size: Records per upsert or delete call
+        """
+        self.collection = collection
+        self.chunk = chunk
+        self.batch_size = batch_size
+        self._content_ids = {}  # chunk id -> record id
+        self._doc_ids = {}  # record id -> chunk ids with that text
+
+    def __len__(self):
+        return len(self._content_ids)
+
+    @classmethod
+    def open(cls, chunk, model, path=None, host=None, port=8000,
+             collection_name="soybean_knowledge", batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Connect to a Chroma server, or open a local persistent store.
+
+        A collection written with another embedding model (or not using
+        cosine distance) is dropped and recreated. Recent chromadb releases
+        move ``hnsw:space`` out of the returned metadata into the collection
+        configuration, so only a distance that is present and different
+        counts as a mismatch; a collection carrying our ``embedding_model``
+        key was created by this method with cosine distance.
+
+        Args:
+            chunk: Callable returning ``(text, metadata)`` for a live chunk id
+            model: Embedding model name recorded on the collection
+            path: Local store directory, used when ``host`` is empty
+            host: Chroma server host
+            port: Chroma server port
+            collection_name: Collection holding the chunks
+            batch_size: Records per write
+
+        Raises:
+            ImportError: If chromadb is not installed
+        """
+        if not CHROMADB_AVAILABLE:
+            raise ImportError("chromadb is not installed")
+        settings = Settings(anonymized_telemetry=False)
+        if host:
+            client = chromadb.HttpClient(host=host, port=port, settings=settings)
+        else:
+            client = chromadb.PersistentClient(path=str(path), settings=settings)
+        metadata = {"hnsw:space": "cosine", "embedding_model": model}
+        collection = client.get_or_create_collection(collection_name, embedding_function=None, metadata=metadata)
+        stored = collection.metadata or {}
+        if stored.get("embedding_model") != model or stored.get("hnsw:space", "cosine") != "cosine":
+            print(f"🗄️  Recreating Chroma collection {collection_name} for {model}")
+            client.delete_collection(collection_name)
+            collection = client.create_collection(collection_name, embedding_function=None, metadata=metadata)
+        return cls(collection, chunk, batch_size=min(batch_size, client.get_max_batch_size()))
+
+    def _stored_ids(self):
+        """Every record id in the collection, read page by page."""
+        ids, offset = set(), 0
+        while True:
+            page = self.collection.get(include=[], limit=ID_PAGE_SIZE, offset=offset)["ids"]
+            ids.update(page)
+            if len(page) < ID_PAGE_SIZE:
+                return ids
+            offset += len(page)
+
+    def _upsert(self, record_ids, texts, metadatas, vectors):
+        for start in range(0, len(record_ids), self.batch_size):
+            end = start + self.batch_size
+            self.collection.upsert(
+                ids=record_ids[start:end], embeddings=vectors[start:end],
+                documents=texts[start:end], metadatas=metadatas[start:end]
+            )
+
+    def _delete(self, record_ids):
+        for start in range(0, len(record_ids), self.batch_size):
+            self.collection.delete(ids=record_ids[start:start + self.batch_size])
+
+    def _track(self, doc_id, record_id):
+        self._content_ids[doc_id] = record_id
+        self._doc_ids.setdefault(record_id, []).append(doc_id)
+
+    def sync(self, doc_ids, encode):
+        """
+        Make the collection hold exactly the given chunks.
+
+        Only chunks missing from the collection are embedded; records of
+        chunks that no longer exist are deleted.
+
+        Args:
+            doc_ids: Live chunk ids
+            encode: Callable embedding a list of texts into unit-length vectors
+
+        Returns:
+            tuple: (records written, records deleted)
+        """
+        self._content_ids, self._doc_ids = {}, {}
+        for doc_id in doc_ids:
+            self._track(doc_id, content_id(self.chunk(doc_id)[0]))
+        stored = self._stored_ids()
+        missing = [record_id for record_id in self._doc_ids if record_id not in stored]
+        stale = [record_id for record_id in stored if record_id not in self._doc_ids]
+
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            chunks = [self.chunk(self._doc_ids[record_id][0]) for record_id in batch]
+            texts = [text for text, _ in chunks]
+            self._upsert(batch, texts, [_scalar_metadata(metadata) for _, metadata in chunks], encode(texts))
+        self._delete(stale)
+        return len(missing), len(stale)
+
+    def add(self, doc_ids, vectors):
+        """Upsert chunk embeddings."""
+        record_ids, texts, metadatas, new_vectors = [], [], [], []
+        for doc_id, vector in zip(doc_ids, vectors):
+            text, metadata = self.chunk(doc_id)
+            record_id = content_id(text)
+            if record_id not in self._doc_ids:
+                record_ids.append(record_id)
+                texts.append(text)
+                metadatas.append(_scalar_metadata(metadata))
+                new_vectors.append(vector)
+            self._track(doc_id, record_id)
+        if record_ids:
+            self._upsert(record_ids, texts, metadatas, new_vectors)
+
+    def remove(self, doc_ids):
+        """Delete chunks; a record is deleted once no live chunk has its text."""
+        gone = []
+        for doc_id in doc_ids:
+            record_id = self._content_ids.pop(doc_id, None)
+            if record_id is None:
+                continue
+            owners = self._doc_ids[record_id]
+            owners.remove(doc_id)
+            if not owners:
+                del self._doc_ids[record_id]
+                gone.append(record_id)
+        self._delete(gone)
+
+    def search(self, query_vector, k=4, allowed=None):
+        """
+        Find the chunks most similar to a query embedding.
+
+        Args:
+            query_vector: Unit-length query embedding
+            k: Number of results
+            allowed: Optional filter bitmap over chunk ids
+
+        Returns:
+            list: ``(doc_id, score)`` pairs, best first
+        """
+        total = self.collection.count()
+        if k <= 0 or not total:
+            return []
+        query = [[float(x) for x in query_vector]]
+        fetch = k if allowed is None else k * FILTER_OVERFETCH
+        while True:
+            fetch = min(fetch, total)
+            result = self.collection.query(query_embeddings=query, n_results=fetch, include=["distances"])
+            hits = self._hits(result["ids"][0], result["distances"][0], allowed)
+            # Records this process does not know (another worker's, or filtered out) take slots; ask for more
+            if len(hits) >= k or fetch >= total:
+                return hits[:k]
+            fetch *= FILTER_OVERFETCH
+
+    def search_many(self, query_vectors, k=4, allowed=None):
+        """
+        Search a batch of query embeddings with one Chroma query.
+
+        Queries left short of ``k`` hits by the filter are searched again
+        on their own with a deeper fetch.
+
+        Returns:
+            list: One ``search`` result per query
+        """
+        total = self.collection.count()
+        if k <= 0 or not total or not len(query_vectors):
+            return [[] for _ in query_vectors]
+        fetch = min(k if allowed is None else k * FILTER_OVERFETCH, total)
+        result = self.collection.query(
+            query_embeddings=[[float(x) for x in query_vector] for query_vector in query_vectors],
+            n_results=fetch, include=["distances"]
+        )
+        results = []
+        for query_vector, record_ids, distances in zip(query_vectors, result["ids"], result["distances"]):
+            hits = self._hits(record_ids, distances, allowed)
+            if len(hits) < k and fetch < total:
+                hits = self.search(query_vector, k, allowed)
+            results.append(hits[:k])
+        return results
+
+    def _hits(self, record_ids, distances, allowed=None):
+        """Chunk ids and cosine similarities of the records a query returned."""
+        hits = []
+        for record_id, distance in zip(record_ids, distances):
+            doc_ids = self._doc_ids.get(record_id, [])
+            if allowed is not None and doc_ids:
+                doc_ids = [doc_id for doc_id, keep in zip(doc_ids, filter_mask(allowed, doc_ids)) if keep]
+            hits.extend((doc_id, 1.0 - float(distance)) for doc_id in doc_ids)
+        return hits
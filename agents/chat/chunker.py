@@ -0,0 +1,87 @@
+"""Token-sized chunking of extracted knowledge text."""
+import re
+
+# Words and individual punctuation marks: a close, dependency-free stand-in for LLM tokens
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+SENTENCE_END = frozenset(".!?")
+
+
+def count_tokens(text):
+    """Approximate token count of a text."""
+    return sum(1 for _ in TOKEN_PATTERN.finditer(text))
+
+
+class TokenChunker:
+    """
+    Turns a document's paragraphs into chunks of roughly equal token size.
+
+    Short paragraphs are packed together up to ``max_tokens``; paragraphs
+    longer than that (typically whole PDF pages with no blank lines) are
+    cut into overlapping windows that prefer to end on a sentence.
+    """
+
+    def __init__(self, max_tokens=200, overlap=40):
+        """
+        Initialize the chunker.
+
+        Args:
+            max_tokens: Upper bound on tokens per chunk
+            overlap: Tokens repeated between consecutive windows of a long paragraph
+        """
+        self.max_tokens = max(1, max_tokens)
+        self.overlap = min(max(0, overlap), self.max_tokens // 2)
+
+    def chunk(self, paragraphs):
+        """
+        Chunk one document.
+
+        Args:
+            paragraphs: Paragraphs in document order
+
+        Returns:
+            list: Chunk texts in document order
+        """
+        chunks = []
+        buffer, buffer_tokens = [], 0
+        for paragraph in paragraphs:
+            tokens = count_tokens(paragraph)
+            if tokens > self.max_tokens:
+                if buffer:
+                    chunks.append("\n\n".join(buffer))
+                    buffer, buffer_tokens = [], 0
+                chunks.extend(self._windows(paragraph))
+                continue
+            if buffer and buffer_tokens + tokens > self.max_tokens:
+                chunks.append("\n\n".join(buffer))
+                buffer, buffer_tokens = [], 0
+            buffer.append(paragraph)
+            buffer_tokens += tokens
+        if buffer:
+            chunks.append("\n\n".join(buffer))
+        return chunks
+
+    def _windows(self, text):
+        """Split a long paragraph into overlapping token windows."""
+        spans = [match.span() for match in TOKEN_PATTERN.finditer(text)]
+        windows = []
+        start = 0
+        while start < len(spans):
+            end = min(start + self.max_tokens, len(spans))
+            if end < len(spans):
+                # Pull the cut back to a sentence end within the last quarter of the window
+                earliest = start + (self.max_tokens * 3) // 4
+                for i in range(end - 1, earliest - 1, -1):
+                    if text[spans[i][0]:spans[i][1]] in SENTENCE_END:
+                        end = i + 1
+                        break
+            windows.append(text[spans[start][0]:spans[end - 1][1]])
+            if end == len(spans):
+                break
+            # Start the next window on a sentence start, allowing up to twice the overlap
+            next_start = end - self.overlap
+            for i in range(next_start, max(start + 1, end - 2 * self.overlap) - 1, -1):
+                if i > 0 and text[spans[i - 1][0]:spans[i - 1][1]] in SENTENCE_END:
+                    next_start = i
+                    break
+            start = max(next_start, start + 1)
+        return windows
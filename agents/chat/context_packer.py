@@ -0,0 +1,149 @@
+"""Token-budgeted packing of retrieved chunks into the chat prompt."""
+import math
+import re
+
+from .chunker import TOKEN_PATTERN, count_tokens
+from .lexical_index import tokenize
+
+# A sentence ends at . ! or ? (but not "e.g." or "i.e.") followed by something that can start one
+SENTENCE_BREAK = re.compile(r"(?<!e\.g\.)(?<!i\.e\.)(?<=[.!?])\s+(?=[\"'(\[]?[A-Z0-9])")
+GAP_MARKER = "..."
+
+
+def split_sentences(text):
+    """Split a chunk into sentences; line breaks always end a sentence."""
+    sentences = []
+    for line in text.splitlines():
+        sentences.extend(part.strip() for part in SENTENCE_BREAK.split(line.strip()) if part.strip())
+    return sentences
+
+
+def _truncate(sentence, max_tokens):
+    """Cut a sentence after ``max_tokens`` tokens."""
+    spans = [match.span() for match in TOKEN_PATTERN.finditer(sentence)]
+    if len(spans) <= max_tokens:
+        return sentence
+    return sentence[:spans[max_tokens - 1][1]]
+
+
+class ContextPacker:
+    """
+    Fills a token budget with the retrieved sentences that best match the query.
+
+    A sentence scores a baseline plus the IDF-weighted query terms it
+    contains plus those its whole chunk contains, divided by
+    ``1 + rank_decay * rank`` of the chunk. The IDF is taken over the
+    retrieved sentences, so a term found everywhere counts for little; the
+    chunk part keeps sentences such as "Apply it at 2 l/ha" that answer the
+    question without repeating its words. The baseline, worth the query's
+    full term weight, lets chunks retrieved without any query term (dense
+    hits such as "chlorosis" for "yellowing") compete for the budget by
+    their rank, so term overlap only reorders and trims. The chosen
+    sentences are put back in their chunk's order, with a gap marker where
+    sentences were dropped.
+    """
+
+    def __init__(self, max_tokens=400, rank_decay=1.0):
+        """
+        Initialize the packer.
+
+        Args:
+            max_tokens: Token budget for the packed context (0 = no limit)
+            rank_decay: Score discount per retrieval rank of a sentence's chunk
+        """
+        self.max_tokens = max(0, max_tokens)
+        self.rank_decay = rank_decay
+        self.stats = {"calls": 0, "tokens_in": 0, "tokens_used": 0, "tokens_saved": 0}
+
+    def pack(self, query, chunks):
+        """
+        Pack retrieved chunks into prompt context.
+
+        Args:
+            query: The user's question
+            chunks: Chunk texts, best match first
+
+        Returns:
+            tuple: (context text, report dict with ``tokens_in``, ``tokens_used``,
+            ``tokens_saved``, ``sentences_kept`` and ``sentences_total``)
+        """
+        sentences = []  # (chunk rank, position, text, tokens, terms)
+        for rank, chunk in enumerate(chunks):
+            for position, sentence in enumerate(split_sentences(chunk)):
+                sentences.append((rank, position, sentence, count_tokens(sentence), set(tokenize(sentence))))
+        tokens_in = sum(count_tokens(chunk) for chunk in chunks)
+
+        chosen, used = self._select(query, sentences)
+        context = self._assemble(sentences, chosen)
+        report = {
+            "tokens_in": tokens_in,
+            "tokens_used": used,
+            "tokens_saved": max(0, tokens_in - used),
+            "sentences_kept": len(chosen),
+            "sentences_total": len(sentences),
+        }
+        self.stats["calls"] += 1
+        for key in ("tokens_in", "tokens_used", "tokens_saved"):
+            self.stats[key] += report[key]
+        return context, report
+
+    def _select(self, query, sentences):
+        """Greedily pick sentence indexes by score until the budget is spent."""
+        if not self.max_tokens:
+            return {i: sentence[2] for i, sentence in enumerate(sentences)}, sum(s[3] for s in sentences)
+
+        query_terms = set(tokenize(query))
+        frequency = {term: sum(1 for s in sentences if term in s[4]) for term in query_terms}
+        weights = {
+            term: math.log(1 + len(sentences) / count)
+            for term, count in frequency.items() if count
+        }
+
+        chunk_terms = {}
+        for rank, _, _, _, terms in sentences:
+            chunk_terms.setdefault(rank, set()).update(terms)
+
+        def relevance(terms):
+            return sum(weight for term, weight in weights.items() if term in terms)
+
+        # The retriever already judged every chunk relevant; its rank is the baseline
+        baseline = sum(weights.values()) or 1.0
+        chunk_relevance = {rank: relevance(terms) for rank, terms in chunk_terms.items()}
+        scores = [
+            -(baseline + relevance(terms) + chunk_relevance[rank]) / (1 + self.rank_decay * rank)
+            for rank, _, _, _, terms in sentences
+        ]
+        ranked = sorted(range(len(sentences)), key=lambda i: (scores[i], sentences[i][0], sentences[i][1]))
+        chosen, used, seen = {}, 0, set()
+        for index in ranked:
+            _, _, text, tokens, _ = sentences[index]
+            key = " ".join(text.lower().split())
+            if key in seen or used + tokens > self.max_tokens:
+                continue
+            seen.add(key)
+            chosen[index] = text
+            used += tokens
+        if not chosen and sentences:
+            # Not even one sentence fits: keep the start of the best one
+            best = ranked[0]
+            chosen[best] = _truncate(sentences[best][2], self.max_tokens)
+            used = count_tokens(chosen[best])
+        return chosen, used
+
+    @staticmethod
+    def _assemble(sentences, chosen):
+        """Rebuild the chosen sentences into per-chunk passages in retrieval order."""
+        passages, current, last = [], [], None
+        for index in sorted(chosen):
+            rank, position = sentences[index][:2]
+            if last is None or rank != last[0]:
+                if current:
+                    passages.append(" ".join(current))
+                current = [GAP_MARKER] if position > 0 else []
+            elif position != last[1] + 1:
+                current.append(GAP_MARKER)
+            current.append(chosen[index])
+            last = (rank, position)
+        if current:
+            passages.append(" ".join(current))
+        return "\n\n".join(passages)
@@ -0,0 +1,129 @@
+"""Exact and near-duplicate detection for knowledge chunks."""
+import hashlib
+import re
+from functools import lru_cache
+
+import numpy as np
+
+WORD_PATTERN = re.compile(r"\w+")
+NUM_PERM = 64
+
+# Multiply-shift hash family: (a * x + b) mod 2**64 with odd a, keeping the high 32 bits
+_rng = np.random.default_rng(20240601)
+_PERM_A = _rng.integers(0, 1 << 63, size=(NUM_PERM, 1), dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+_PERM_B = _rng.integers(0, 1 << 63, size=(NUM_PERM, 1), dtype=np.uint64)
+_SHIFT = np.uint64(32)
+
+
+def _normalize(text):
+    return " ".join(WORD_PATTERN.findall(text.lower()))
+
+
+def _shingle_hashes(words, shingle_size=3):
+    """
+    Hashes of the overlapping word shingles of a text.
+
+    Word hashes come from the built-in string hash and are combined in
+    NumPy. Signatures are only compared within one process, so the hash's
+    per-process randomisation does not matter.
+    """
+    word_hashes = np.fromiter((hash(w) for w in words), dtype=np.int64, count=len(words)).view(np.uint64)
+    count = max(len(words) - shingle_size + 1, 1)
+    combined = np.zeros(count, dtype=np.uint64)
+    for offset in range(min(shingle_size, len(words))):
+        combined = combined * np.uint64(1000003) + word_hashes[offset:offset + count]
+    return combined
+
+
+@lru_cache(maxsize=4096)
+def _signature(text, min_words):
+    """(exact digest, MinHash signature or None) of a text."""
+    normalized = _normalize(text)
+    digest = hashlib.sha1(normalized.encode('utf-8')).digest()
+    words = normalized.split()
+    if len(words) < min_words:
+        return digest, None
+    shingles = _shingle_hashes(words)
+    return digest, ((_PERM_A * shingles + _PERM_B) >> _SHIFT).min(axis=1)
+
+
+class NearDuplicateFilter:
+    """
+    Finds chunks that repeat text already indexed.
+
+    Exact duplicates are caught by a hash of the normalised text. Near
+    duplicates are found with MinHash signatures over word shingles and
+    locality-sensitive hashing: signatures are cut into bands and only
+    chunks sharing a band are compared. A chunk counts as a near duplicate
+    when its estimated shingle Jaccard similarity reaches ``threshold``.
+    """
+
+    def __init__(self, threshold=0.8, bands=16, min_words=8):
+        """
+        Initialize the filter.
+
+        Args:
+            threshold: Jaccard similarity at which two chunks are duplicates
+            bands: LSH bands; must divide the 64-value signature
+            min_words: Shorter texts are only checked for exact duplicates
+        """
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.min_words = min_words
+        self._exact = {}
+        self._buckets = {}
+        self._signatures = {}
+
+    def __len__(self):
+        return len(self._signatures)
+
+    def _signature(self, text):
+        return _signature(text, self.min_words)
+
+    def _band_keys(self, minhash):
+        return [(band, minhash[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def matches(self, text):
+        """
+        Ids of indexed chunks that duplicate ``text``.
+
+        Returns:
+            set: Matching chunk ids (empty if the text is new)
+        """
+        digest, minhash = self._signature(text)
+        found = set(self._exact.get(digest, ()))
+        if minhash is None:
+            return found
+        candidates = set()
+        for key in self._band_keys(minhash):
+            candidates.update(self._buckets.get(key, ()))
+        for doc_id in candidates - found:
+            if np.mean(self._signatures[doc_id][1] == minhash) >= self.threshold:
+                found.add(doc_id)
+        return found
+
+    def add(self, doc_id, text):
+        """Register an indexed chunk."""
+        digest, minhash = self._signature(text)
+        self._signatures[doc_id] = (digest, minhash)
+        self._exact.setdefault(digest, set()).add(doc_id)
+        if minhash is not None:
+            for key in self._band_keys(minhash):
+                self._buckets.setdefault(key, set()).add(doc_id)
+
+    def discard(self, doc_id):
+        """Forget a chunk that was removed from the index."""
+        signature = self._signatures.pop(doc_id, None)
+        if signature is None:
+            return
+        digest, minhash = signature
+        self._exact[digest].discard(doc_id)
+        if not self._exact[digest]:
+            del self._exact[digest]
+        if minhash is not None:
+            for key in self._band_keys(minhash):
+                self._buckets[key].discard(doc_id)
+                if not self._buckets[key]:
+                    del self._buckets[key]
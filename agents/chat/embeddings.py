@@ -0,0 +1,197 @@
+"""Sentence embeddings for dense knowledge retrieval."""
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+try:
+    from sentence_transformers import SentenceTransformer
+    SENTENCE_TRANSFORMERS_AVAILABLE = True
+except ImportError:
+    SentenceTransformer = None
+    SENTENCE_TRANSFORMERS_AVAILABLE = False
+
+
+def text_hash(text):
+    """SHA-256 digest identifying a chunk's text."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+class EmbeddingCache:
+    """
+    Disk-backed store of chunk embeddings keyed by (model name, text hash).
+
+    Backed by SQLite in WAL mode, so every gunicorn worker on a node can
+    read and fill the same file.
+    """
+
+    def __init__(self, path):
+        """
+        Open or create the cache.
+
+        Args:
+            path: SQLite database file
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(self.path), timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model_name, hashes):
+        """
+        Look up cached vectors.
+
+        Returns:
+            dict: ``{text_hash: float32 vector}`` for the hashes that were found
+        """
+        found = {}
+        with self._lock:
+            # Stay well below SQLite's bound-parameter limit
+            for start in range(0, len(hashes), 500):
+                batch = hashes[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(batch))})",
+                    [model_name, *batch]
+                ).fetchall()
+                for digest, blob in rows:
+                    found[bytes(digest)] = np.frombuffer(blob, dtype=np.float32)
+        return found
+
+    def put_many(self, model_name, items):
+        """Store ``(text_hash, vector)`` pairs."""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(model_name, digest, np.asarray(vector, dtype=np.float32).tobytes())
+                 for digest, vector in items]
+            )
+            self._conn.commit()
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class SentenceEmbedder:
+    """
+    Encodes text into unit-length float32 vectors with a sentence-transformers model.
+
+    Chunk embeddings are read from and written to an optional
+    EmbeddingCache, so re-indexing only runs the encoder on new text.
+    Query embeddings are kept in an in-memory LRU, so repeated questions
+    skip the encoder entirely.
+    """
+
+    def __init__(self, model_name, cache=None, query_cache_size=1024):
+        """
+        Initialize the embedder. The model is loaded on first use.
+
+        Args:
+            model_name: sentence-transformers model name, e.g. Config.EMBEDDING_MODEL
+            cache: Optional EmbeddingCache for chunk embeddings
+            query_cache_size: Number of query embeddings kept in memory
+        """
+        self.model_name = model_name
+        self.cache = cache
+        self.query_cache_size = query_cache_size
+        self._model = None
+        self._query_cache = OrderedDict()
+        self._query_lock = threading.Lock()
+        self.stats = {"chunk_hits": 0, "chunk_misses": 0, "query_hits": 0, "query_misses": 0}
+
+    @property
+    def model(self):
+        if self._model is None:
+            if not SENTENCE_TRANSFORMERS_AVAILABLE:
+                raise ImportError("sentence-transformers is not installed")
+            self._model = SentenceTransformer(self.model_name)
+        return self._model
+
+    @property
+    def dimension(self):
+        """Length of the embedding vectors."""
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts, batch_size=64):
+        """
+        Embed a list of texts, running the model only on uncached ones.
+
+        Returns:
+            np.ndarray: ``(len(texts), dimension)`` float32 matrix of unit vectors
+        """
+        texts = list(texts)
+        if not texts or self.cache is None:
+            return self._encode(texts, batch_size)
+
+        hashes = [text_hash(text) for text in texts]
+        cached = self.cache.get_many(self.model_name, list(set(hashes)))
+        missing = list(dict.fromkeys(
+            (digest, text) for digest, text in zip(hashes, texts) if digest not in cached
+        ))
+        self.stats["chunk_hits"] += len(texts) - len(missing)
+        self.stats["chunk_misses"] += len(missing)
+        if missing:
+            fresh = self._encode([text for _, text in missing], batch_size)
+            new_items = [(digest, vector) for (digest, _), vector in zip(missing, fresh)]
+            self.cache.put_many(self.model_name, new_items)
+            cached.update(new_items)
+        return np.vstack([cached[digest] for digest in hashes]).astype(np.float32, copy=False)
+
+    def encode_query(self, query):
+        """Embed a single query, served from the in-memory LRU when seen before."""
+        return self.encode_queries([query])[0]
+
+    def encode_queries(self, queries, batch_size=64):
+        """
+        Embed a batch of queries; those not in the in-memory LRU go through the model together.
+
+        Returns:
+            np.ndarray: ``(len(queries), dimension)`` float32 matrix of unit vectors
+        """
+        keys = [" ".join(query.split()) for query in queries]
+        found = {}
+        with self._query_lock:
+            for key in keys:
+                vector = self._query_cache.get(key)
+                if vector is not None:
+                    self._query_cache.move_to_end(key)
+                    self.stats["query_hits"] += 1
+                    found[key] = vector
+
+        missing = list(dict.fromkeys(key for key in keys if key not in found))
+        if missing:
+            fresh = self._encode(missing, batch_size)
+            with self._query_lock:
+                for key, vector in zip(missing, fresh):
+                    self.stats["query_misses"] += 1
+                    found[key] = vector
+                    self._query_cache[key] = vector
+                while len(self._query_cache) > self.query_cache_size:
+                    self._query_cache.popitem(last=False)
+        if not keys:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        return np.vstack([found[key] for key in keys])
+
+    def _encode(self, texts, batch_size=64):
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        vectors = self.model.encode(
+            list(texts),
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False
+        )
+        return np.asarray(vectors, dtype=np.float32)
@@ -0,0 +1,31 @@
+"""Rank fusion for combining lexical and dense retrieval results."""
+import heapq
+
+# Damping constant from the original RRF paper; keeps one list's top hit from dominating
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K, limit=None):
+    """
+    Fuse ranked result lists with reciprocal rank fusion.
+
+    Each document scores ``sum(1 / (k + rank))`` over the lists it appears
+    in, so only ranks matter and BM25 and cosine scores need no calibration.
+
+    Args:
+        rankings: Iterable of ``[(doc_id, score), ...]`` lists, best first
+        k: RRF damping constant
+        limit: Number of fused results to return (all if None)
+
+    Returns:
+        list: ``(doc_id, fused_score)`` pairs, best first
+    """
+    fused = {}
+    for ranking in rankings:
+        for rank, (doc_id, _) in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+
+    key = lambda item: (item[1], -item[0])
+    if limit is None:
+        return sorted(fused.items(), key=key, reverse=True)
+    return heapq.nlargest(limit, fused.items(), key=key)
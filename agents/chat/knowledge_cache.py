@@ -0,0 +1,202 @@
+"""On-disk cache of paragraphs extracted from knowledge files."""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+# Bump when extraction, paragraph splitting or the entry layout changes so stale entries are ignored
+CACHE_VERSION = 3
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class KnowledgeCache:
+    """
+    Stores extracted paragraphs per source file, keyed by path, size,
+    modification time and content hash.
+
+    A matching size and mtime is trusted without reading the file. When
+    they differ, the content hash decides, so a touched but unchanged file
+    is still served from the cache.
+
+    Each entry is JSON lines: a header with the fingerprint, then one
+    paragraph per line. Entries are written as paragraphs stream past and
+    can be checked from their header alone, so neither side needs a whole
+    document in memory.
+    """
+
+    def __init__(self, cache_dir):
+        """
+        Initialize the cache.
+
+        Args:
+            cache_dir: Directory holding one entry per source file
+        """
+        self.cache_dir = Path(cache_dir)
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_path(self, path):
+        key = hashlib.sha1(str(Path(path).resolve()).encode('utf-8')).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def _read_header(self, path):
+        try:
+            with open(self._entry_path(path), 'r', encoding='utf-8') as f:
+                header = json.loads(f.readline())
+        except (OSError, ValueError):
+            return None
+        if not isinstance(header, dict) or header.get("version") != CACHE_VERSION:
+            return None
+        return header
+
+    def _read_paragraphs(self, path):
+        with open(self._entry_path(path), 'r', encoding='utf-8') as f:
+            f.readline()
+            return [json.loads(line) for line in f]
+
+    def _write_entry(self, path, header, paragraphs):
+        """Yield ``paragraphs`` while writing them; the entry replaces the old one only once all were written."""
+        entry_path = self._entry_path(path)
+        tmp_path = entry_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        f = None
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            f = open(tmp_path, 'w', encoding='utf-8')
+            f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        except OSError as e:
+            f = self._abandon(f, path, e)
+        try:
+            for paragraph in paragraphs:
+                if f is not None:
+                    try:
+                        f.write(json.dumps(paragraph, ensure_ascii=False) + "\n")
+                    except OSError as e:
+                        f = self._abandon(f, path, e)
+                yield paragraph
+            if f is not None:
+                f.close()
+                # Atomic so concurrent workers never read a half-written entry
+                os.replace(tmp_path, entry_path)
+        except OSError as e:
+            self._abandon(f, path, e)
+        finally:
+            if f is not None and not f.closed:
+                f.close()
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _abandon(f, path, error):
+        """Stop writing an entry after a failed write; the paragraphs still flow to the caller."""
+        print(f"   ⚠️  Could not write knowledge cache for {Path(path).name}: {error}")
+        if f is not None:
+            try:
+                f.close()
+            except OSError:
+                pass
+
+    def _current(self, path, header, refresh=True):
+        """True if an entry's header matches the file; a touched but unchanged file gets a fresh header."""
+        stat = os.stat(path)
+        if header["size"] != stat.st_size:
+            return False
+        if header["mtime_ns"] == stat.st_mtime_ns:
+            return True
+        if header["sha256"] != file_digest(path):
+            return False
+        if refresh:
+            # Same content with a new mtime: refresh the fingerprint
+            header = dict(header, mtime_ns=stat.st_mtime_ns)
+            for _ in self._write_entry(path, header, self._read_paragraphs(path)):
+                pass
+        return True
+
+    def contains(self, path):
+        """True if the cache holds current paragraphs for a file, checked without reading them."""
+        header = self._read_header(path)
+        return header is not None and self._current(path, header)
+
+    def get(self, path):
+        """
+        Return cached paragraphs for a file, or None if it changed.
+
+        Args:
+            path: Source file path
+        """
+        header = self._read_header(path)
+        if header is None or not self._current(path, header):
+            self.misses += 1
+            return None
+        try:
+            paragraphs = self._read_paragraphs(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return paragraphs
+
+    def put(self, path, paragraphs):
+        """Store the paragraphs extracted from a file."""
+        for _ in self.store(path, paragraphs):
+            pass
+
+    def store(self, path, paragraphs):
+        """
+        Yield paragraphs as they are extracted while writing them to the cache.
+
+        The file is fingerprinted before the first paragraph, so a write
+        during extraction shows up as a change. The entry is only kept if
+        the stream is read to the end without an error.
+        """
+        stat = os.stat(path)
+        header = {
+            "version": CACHE_VERSION,
+            "path": str(Path(path).resolve()),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": file_digest(path),
+        }
+        return self._write_entry(path, header, paragraphs)
+
+    def prune(self, live_paths, directory):
+        """
+        Delete entries of files under ``directory`` that are no longer present.
+
+        The cache folder is shared by every corpus, so entries of files
+        elsewhere are kept; entries of an older cache version are useless to
+        every reader and are deleted too.
+
+        Args:
+            live_paths: Knowledge files currently under ``directory``
+            directory: Folder that was just loaded
+        """
+        if not self.cache_dir.exists():
+            return
+        directory = Path(directory).resolve()
+        keep = {self._entry_path(path).name for path in live_paths}
+        for entry_path in self.cache_dir.glob('*.json'):
+            if entry_path.name in keep:
+                continue
+            try:
+                with open(entry_path, 'r', encoding='utf-8') as f:
+                    header = json.loads(f.readline())
+                current = isinstance(header, dict) and header.get("version") == CACHE_VERSION
+                if current and not Path(header["path"]).is_relative_to(directory):
+                    continue
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+            try:
+                entry_path.unlink()
+            except OSError:
+                pass
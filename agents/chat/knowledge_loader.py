@@ -0,0 +1,473 @@
+"""Knowledge file ingestion, spread across a process pool."""
+import os
+import re
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from itertools import groupby
+
+KNOWLEDGE_EXTENSIONS = ('.txt', '.md', '.pdf')
+# A paragraph longer than this is cut at the next page end, bounding extraction memory
+MAX_PARAGRAPH_CHARS = 20000
+# Page numbers on header and footer lines: "Page 3 of 80", "p. 3", "- 3 -", or a number at either end
+PAGE_NUMBER = re.compile(
+    r"\b(?:page|pg|p)\.?\s*\d+(?:\s*(?:of|/)\s*\d+)?\b|^\W*\d+(?:\s*(?:of|/)\s*\d+)?\W*$|^\d+\b|\b\d+$"
+)
+# Finished page ranges held per worker while an earlier range is still running
+TASK_LOOKAHEAD = 8
+
+
+def split_paragraphs(text, min_length=0):
+    """Split extracted text on blank lines."""
+    return [p.strip() for p in text.split('\n\n') if p.strip() and len(p) > min_length]
+
+
+def extract_text_file(file_path):
+    """Split a text or markdown file into paragraphs."""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    return split_paragraphs(content)
+
+
+def pdf_page_count(pdf_path):
+    """Number of pages in a PDF."""
+    import PyPDF2
+    with open(pdf_path, 'rb') as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def iter_pdf_pages(pdf_path, start=0, end=None, skipped=None):
+    """
+    Yield the text of each page in a range, one page at a time.
+
+    Pages that fail to extract are skipped; their numbers are appended to
+    ``skipped`` when a list is given.
+    """
+    import PyPDF2
+    with open(pdf_path, 'rb') as f:
+        pages = PyPDF2.PdfReader(f).pages
+        for i in range(start, len(pages) if end is None else end):
+            try:
+                text = pages[i].extract_text()
+            except Exception:
+                if skipped is not None:
+                    skipped.append(i)
+                continue
+            yield text or ""
+
+
+def iter_paragraphs(page_texts, min_length=0, max_chars=MAX_PARAGRAPH_CHARS):
+    """
+    Split a stream of page texts into paragraphs as the pages arrive.
+
+    Gives the same paragraphs as ``split_paragraphs`` on the pages joined
+    with newlines, except that a paragraph running past ``max_chars`` is
+    cut at a page end. Only the unfinished paragraph is carried between
+    pages, so memory does not grow with the document.
+    """
+    carry = ""
+    for text in page_texts:
+        parts = (carry + text + "\n").split('\n\n')
+        carry = parts.pop()
+        if len(carry) > max_chars:
+            parts.append(carry)
+            carry = ""
+        for p in parts:
+            if p.strip() and len(p) > min_length:
+                yield p.strip()
+    if carry.strip() and len(carry) > min_length:
+        yield carry.strip()
+
+
+def _edge_key(line):
+    """A header or footer line with its page number folded, so "Page 3 of 80" matches "Page 4 of 80"."""
+    return PAGE_NUMBER.sub("#", line.strip().lower())
+
+
+def strip_page_edges(page_texts, edge_lines=2, min_share=0.5, min_pages=4, warmup=10, max_length=100):
+    """
+    Remove running headers and footers from a stream of PDF page texts.
+
+    Only the outer ``edge_lines`` lines at the top and bottom of a page,
+    up to ``max_length`` characters, are candidates. A candidate is
+    boilerplate when it sits at an edge of at least ``min_pages`` pages
+    and of at least ``min_share`` of the pages seen so far; lines are
+    dropped from each edge inwards until one is not. Lines in the body of
+    a page are never touched, however often they repeat.
+
+    The first ``warmup`` pages are held until enough pages were seen to
+    judge them; after that each page is judged as it arrives.
+    """
+    counts = Counter()
+    held = []
+    seen = 0
+    for text in page_texts:
+        lines = text.splitlines(keepends=True)
+        filled = [i for i, line in enumerate(lines) if line.strip()]
+        sides = [filled[:edge_lines], filled[::-1][:edge_lines]]
+        keys = {i: _edge_key(lines[i]) for side in sides for i in side if len(lines[i].strip()) <= max_length}
+        seen += 1
+        counts.update(set(keys.values()))
+        held.append((lines, sides, keys))
+        if seen < warmup:
+            continue
+        for page in held:
+            yield _strip_edges(*page, counts, max(min_pages, min_share * seen))
+        held = []
+    for page in held:
+        yield _strip_edges(*page, counts, max(min_pages, min_share * seen))
+
+
+def _strip_edges(lines, sides, keys, counts, threshold):
+    dropped = set()
+    for side in sides:
+        for i in side:
+            if i not in keys or counts[keys[i]] < threshold:
+                break
+            dropped.add(i)
+    return "".join(line for i, line in enumerate(lines) if i not in dropped)
+
+
+def stream_pdf_paragraphs(pdf_path, min_length=50, skipped=None):
+    """Yield a PDF's paragraphs page by page, skipping unreadable pages and stripping headers and footers."""
+    return iter_paragraphs(strip_page_edges(iter_pdf_pages(pdf_path, skipped=skipped)), min_length)
+
+
+def extract_pdf_pages(pdf_path, start=0, end=None):
+    """
+    Extract the text of a range of PDF pages.
+
+    Runs inside pool workers, so it only takes picklable arguments.
+
+    Returns:
+        tuple: (list of page texts, skipped page numbers, seconds spent)
+    """
+    started = time.perf_counter()
+    skipped = []
+    texts = list(iter_pdf_pages(pdf_path, start, end, skipped))
+    return texts, skipped, time.perf_counter() - started
+
+
+class KnowledgeLoader:
+    """
+    Loads paragraphs from a knowledge directory.
+
+    PDFs that miss the cache are extracted in a process pool: small PDFs
+    are one task each, large ones are split into page ranges. Workers take
+    the next range as soon as they finish one, and ranges are split into
+    paragraphs in page order on the fly with only a bounded number held.
+    The paragraphs are handed on as a stream that writes the cache entry
+    as it goes, so memory stays bounded however long the PDF is. The
+    output is the same for any number of workers.
+    """
+
+    def __init__(self, cache, workers=0, pages_per_task=25):
+        """
+        Initialize the loader.
+
+        Args:
+            cache: KnowledgeCache for extracted paragraphs
+            workers: Pool size; 0 uses every CPU, 1 extracts in-process
+            pages_per_task: Page range size when splitting large PDFs
+        """
+        self.cache = cache
+        self.workers = workers or os.cpu_count() or 1
+        self.pages_per_task = max(1, pages_per_task)
+        self.report = []
+        self.fingerprints = {}
+
+    def load(self, directory, include=None):
+        """
+        Load every text, markdown and PDF file under a directory.
+
+        Args:
+            directory: Knowledge folder
+            include: Optional predicate on a file path; other files are skipped
+
+        Yields:
+            tuple: ``(file_path, paragraphs)`` in deterministic file order. The
+            paragraphs of a PDF extracted now are a stream (see ``_extract_pdfs``)
+            that must be read before the next pair; ``report`` is complete once
+            every pair has been read.
+        """
+        self.report = []
+        self.fingerprints = {}
+        all_text_files = sorted(path for ext in ['.txt', '.md'] for path in directory.rglob(f'*{ext}'))
+        all_pdf_files = sorted(directory.rglob('*.pdf'))
+        text_files = [path for path in all_text_files if include is None or include(path)]
+        pdf_files = [path for path in all_pdf_files if include is None or include(path)]
+
+        for file_path in text_files:
+            yield file_path, self._load_text_file(file_path)
+
+        # Only the headers of cached entries are read here; paragraphs are read as each file's turn comes
+        pending = [pdf_path for pdf_path in pdf_files if not self.cache.contains(pdf_path)]
+        extracted = iter(())
+        if pending:
+            try:
+                import PyPDF2  # noqa: F401
+            except ImportError:
+                print(f"   ⚠️  Found {len(pending)} PDF files but PyPDF2 not installed")
+                print(f"   💡 Install with: pip install pypdf2")
+                pending = []
+            else:
+                extracted = self._extract_pdfs(pending)
+        upcoming = next(extracted, None)
+        pending = set(pending)
+        for pdf_path in pdf_files:
+            if pdf_path in pending:
+                # Files that failed to plan have no stream
+                if upcoming is not None and upcoming[0] == pdf_path:
+                    yield upcoming
+                    upcoming = next(extracted, None)
+                continue
+            fingerprint = self._stat(pdf_path)
+            paragraphs = self.cache.get(pdf_path)
+            if paragraphs is None:
+                # Changed since the cache was checked
+                paragraphs = self.load_file(pdf_path)
+                if paragraphs is not None:
+                    yield pdf_path, paragraphs
+                continue
+            self._fingerprint(pdf_path, fingerprint)
+            self._record(pdf_path, "pdf", len(paragraphs), 0.0, cached=True)
+            yield pdf_path, paragraphs
+
+        # Skipped files are still live; only entries of deleted files are pruned
+        self.cache.prune(all_text_files + all_pdf_files, directory)
+        if self.cache.hits:
+            print(f"   📦 Reused cached text for {self.cache.hits} unchanged files")
+
+        self.report.sort(key=lambda entry: entry["file"])
+
+    def load_file(self, file_path):
+        """
+        Load a single knowledge file, using the cache when it is unchanged.
+
+        Returns:
+            iterable: Paragraphs, or None if the file could not be read. A PDF
+            extracted now is a stream that raises ValueError at its end when
+            no page could be read.
+        """
+        fingerprint = self._stat(file_path)
+        if file_path.suffix.lower() != '.pdf':
+            try:
+                paragraphs = extract_text_file(file_path)
+            except Exception as e:
+                print(f"   ❌ Error loading {file_path.name}: {e}")
+                return None
+            self.cache.put(file_path, paragraphs)
+            self._fingerprint(file_path, fingerprint)
+            return paragraphs
+
+        paragraphs = self.cache.get(file_path)
+        if paragraphs is not None:
+            self._fingerprint(file_path, fingerprint)
+            return paragraphs
+        extracted = self._extract_pdfs([file_path])
+        first = next(extracted, None)
+        if first is None:
+            return None
+        return self._finishing(first[1], extracted)
+
+    @staticmethod
+    def _finishing(paragraphs, extracted):
+        """Yield one PDF's stream, then run its extraction to the end so the pool shuts down."""
+        yield from paragraphs
+        for _ in extracted:
+            pass
+
+    def replace_file(self, file_path, staged):
+        """
+        Extract a new copy of a knowledge file, then move it into place.
+
+        The copy only replaces ``file_path`` once it has been extracted, so
+        a corrupt upload never overwrites a good file.
+
+        Args:
+            file_path: Knowledge file to replace; its suffix picks the extractor
+            staged: New copy, on the same filesystem
+
+        Returns:
+            list: Paragraphs, or None (leaving ``staged`` in place) if the copy could not be extracted
+        """
+        try:
+            if file_path.suffix.lower() == '.pdf':
+                skipped = []
+                paragraphs = list(stream_pdf_paragraphs(staged, skipped=skipped))
+                if skipped and len(skipped) == pdf_page_count(staged):
+                    raise ValueError("no readable pages")
+            else:
+                paragraphs = extract_text_file(staged)
+        except Exception as e:
+            print(f"   ❌ Error loading {file_path.name}: {e}")
+            return None
+        os.replace(staged, file_path)
+        fingerprint = self._stat(file_path)
+        self.cache.put(file_path, paragraphs)
+        self._fingerprint(file_path, fingerprint)
+        return paragraphs
+
+    @staticmethod
+    def _stat(file_path):
+        # Taken before reading, so a write during extraction is seen as a change later
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _fingerprint(self, file_path, fingerprint):
+        # Only files that were loaded are recorded, so the watcher retries failed ones
+        if fingerprint is not None:
+            self.fingerprints[str(file_path)] = fingerprint
+
+    def _load_text_file(self, file_path):
+        # Text files are cheap to read, so they stay in-process
+        fingerprint = self._stat(file_path)
+        paragraphs = self.cache.get(file_path)
+        if paragraphs is not None:
+            self._fingerprint(file_path, fingerprint)
+            self._record(file_path, "text", len(paragraphs), 0.0, cached=True)
+            return paragraphs
+
+        started = time.perf_counter()
+        try:
+            paragraphs = extract_text_file(file_path)
+        except Exception as e:
+            print(f"   ❌ Error loading {file_path.name}: {e}")
+            return []
+        self.cache.put(file_path, paragraphs)
+        self._fingerprint(file_path, fingerprint)
+        self._record(file_path, "text", len(paragraphs), time.perf_counter() - started)
+        print(f"   📄 Loaded: {file_path.name}")
+        return paragraphs
+
+    def _plan_tasks(self, pdf_paths):
+        """Split PDFs into (path, start, end) tasks, with each PDF's page count and fingerprint."""
+        tasks = []
+        page_counts = {}
+        fingerprints = {}
+        for pdf_path in pdf_paths:
+            fingerprints[pdf_path] = self._stat(pdf_path)
+            try:
+                page_count = pdf_page_count(pdf_path)
+            except Exception as e:
+                print(f"   ❌ Error loading PDF {pdf_path.name}: {e}")
+                continue
+            page_counts[pdf_path] = page_count
+            for start in range(0, max(page_count, 1), self.pages_per_task):
+                tasks.append((pdf_path, start, min(start + self.pages_per_task, page_count)))
+        return tasks, page_counts, fingerprints
+
+    def _run_tasks(self, tasks):
+        """
+        Yield each task's outcome in task order.
+
+        Workers pick up the next task as soon as any task finishes, so a
+        slow page range does not leave the rest of the pool idle. At most
+        two tasks per worker run at once, and finished outcomes waiting on
+        an earlier task are held for at most ``TASK_LOOKAHEAD`` tasks per
+        worker, which keeps memory bounded.
+        """
+        if self.workers <= 1 or len(tasks) <= 1:
+            for task in tasks:
+                try:
+                    yield extract_pdf_pages(*task)
+                except Exception as e:
+                    yield e
+            return
+
+        workers = min(self.workers, len(tasks))
+        running, finished = {}, {}
+        submitted = collected = 0
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            while collected < len(tasks):
+                while (submitted < len(tasks) and len(running) < 2 * workers
+                       and submitted - collected < TASK_LOOKAHEAD * workers):
+                    running[pool.submit(extract_pdf_pages, *tasks[submitted])] = submitted
+                    submitted += 1
+                if collected not in finished:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        index = running.pop(future)
+                        try:
+                            finished[index] = future.result()
+                        except Exception as e:
+                            finished[index] = e
+                    continue
+                yield finished.pop(collected)
+                collected += 1
+
+    def _extract_pdfs(self, pdf_paths):
+        """
+        Extract PDFs that missed the cache.
+
+        Yields:
+            tuple: ``(pdf_path, paragraphs)`` for each PDF that could be opened,
+            in order. The paragraphs are a stream: pages are split as their
+            ranges finish and written to the cache on the way through. It
+            must be read to the end before the next PDF is taken, and raises
+            ValueError there if no page of the PDF could be read.
+        """
+        tasks, page_counts, fingerprints = self._plan_tasks(pdf_paths)
+        started = time.perf_counter()
+
+        extracted = 0
+        outcomes = zip(tasks, self._run_tasks(tasks))
+        for pdf_path, group in groupby(outcomes, key=lambda item: item[0][0]):
+            stats = {"seconds": 0.0, "skipped": 0, "ranges": 0, "failed": [], "paragraphs": 0}
+            yield pdf_path, self._paragraph_stream(pdf_path, group, stats, page_counts[pdf_path],
+                                                   fingerprints[pdf_path])
+            if not stats["failed"] or len(stats["failed"]) < stats["ranges"]:
+                extracted += 1
+
+        print(f"   ⏱️  Extracted {extracted} PDFs in {time.perf_counter() - started:.2f}s "
+              f"using {min(self.workers, max(len(tasks), 1))} worker(s)")
+
+    def _paragraph_stream(self, pdf_path, task_outcomes, stats, page_count, fingerprint):
+        """Paragraphs of one PDF's task outcomes, cached, fingerprinted and reported once all were read."""
+        paragraphs = iter_paragraphs(strip_page_edges(self._page_stream(task_outcomes, stats)), min_length=50)
+        for paragraph in self.cache.store(pdf_path, self._checked(pdf_path, paragraphs, stats)):
+            stats["paragraphs"] += 1
+            yield paragraph
+        if stats["skipped"]:
+            print(f"   ⚠️  Skipped {stats['skipped']} unreadable pages in {pdf_path.name}")
+        self._fingerprint(pdf_path, fingerprint)
+        self._record(pdf_path, "pdf", stats["paragraphs"], stats["seconds"], pages=page_count,
+                     skipped_pages=stats["skipped"])
+        print(f"   📄 Loaded PDF: {pdf_path.name} ({page_count} pages, {stats['seconds']:.2f}s)")
+
+    @staticmethod
+    def _checked(pdf_path, paragraphs, stats):
+        """Pass paragraphs through, raising ValueError at the end if every page range failed."""
+        yield from paragraphs
+        if stats["failed"] and len(stats["failed"]) == stats["ranges"]:
+            print(f"   ❌ Error loading PDF {pdf_path.name}: {stats['failed'][0]}")
+            raise ValueError(f"Could not extract knowledge from {pdf_path.name}: {stats['failed'][0]}")
+
+    @staticmethod
+    def _page_stream(task_outcomes, stats):
+        """Yield page texts from one file's task outcomes, tallying timings and skipped pages."""
+        for (_, start, end), outcome in task_outcomes:
+            stats["ranges"] += 1
+            if isinstance(outcome, Exception):
+                # A range that failed as a whole counts as skipped pages
+                stats["failed"].append(outcome)
+                stats["skipped"] += end - start
+                continue
+            texts, skipped, elapsed = outcome
+            stats["seconds"] += elapsed
+            stats["skipped"] += len(skipped)
+            yield from texts
+
+    def _record(self, file_path, kind, paragraphs, seconds, pages=None, cached=False, skipped_pages=0):
+        self.report.append({
+            "file": str(file_path),
+            "kind": kind,
+            "pages": pages,
+            "skipped_pages": skipped_pages,
+            "paragraphs": paragraphs,
+            "seconds": round(seconds, 4),
+            "cached": cached,
+        })
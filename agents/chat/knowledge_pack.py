@@ -0,0 +1,327 @@
+"""Versioned, prebuilt knowledge packs loaded with memory-mapping."""
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+import numpy as np
+
+from .lexical_index import PackedBM25Index
+from .metadata import MetadataIndex
+from .text_store import TextStore
+
+PACK_FORMAT = 6
+MANIFEST_NAME = "manifest.json"
+# Fallback pointer file where symlinks are not available (e.g. Windows without developer mode)
+POINTER_NAME = "CURRENT"
+
+
+def pack_version(texts):
+    """Sortable version id: build time plus a digest of the chunk texts."""
+    digest = hashlib.sha256()
+    for text in texts:
+        digest.update(text.encode('utf-8'))
+        digest.update(b"\0")
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{digest.hexdigest()[:12]}"
+
+
+def write_pack(packs_dir, version, texts, sources, lexical_index, doc_ids,
+               metadata_index=None, fingerprints=None, digests=None, settings=None, write_embeddings=None):
+    """
+    Write a knowledge pack into ``packs_dir/version``.
+
+    Files go to a temporary folder first and the finished folder is renamed
+    into place, so a reader never sees a half-written pack.
+
+    Args:
+        packs_dir: Folder holding all pack versions
+        version: Version id, e.g. from ``pack_version``
+        texts: Chunk texts; chunk ids in the pack are their positions
+        sources: Source name of each chunk
+        lexical_index: BM25Index over the chunks under their original ids
+        doc_ids: Original id of each chunk, used to renumber the postings
+        metadata_index: MetadataIndex over the chunks under their original ids
+        fingerprints: ``{path: (size, mtime_ns)}`` of the source files
+        digests: ``{path: sha256}`` of the source files and metadata sidecars
+        settings: JSON-serialisable build settings recorded in the manifest
+        write_embeddings: Optional callable taking the temporary folder; it
+            writes the dense index and returns a description for the manifest
+
+    Returns:
+        Path: The finished pack folder
+    """
+    packs_dir = Path(packs_dir)
+    packs_dir.mkdir(parents=True, exist_ok=True)
+    final_dir = packs_dir / version
+    tmp_dir = packs_dir / f".{version}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir()
+    try:
+        # Chunk text: one UTF-8 blob plus byte offsets
+        encoded = [text.encode('utf-8') for text in texts]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(blob) for blob in encoded], out=offsets[1:])
+        with open(tmp_dir / "chunks.bin", 'wb') as f:
+            for blob in encoded:
+                f.write(blob)
+        np.save(tmp_dir / "chunks.offsets.npy", offsets)
+
+        source_names = list(dict.fromkeys(sources))
+        source_ids = {name: i for i, name in enumerate(source_names)}
+        np.save(tmp_dir / "chunks.sources.npy", np.array([source_ids[s] for s in sources], dtype=np.int32))
+
+        lexical_index.save(tmp_dir, doc_ids)
+        (metadata_index or MetadataIndex()).save(tmp_dir, doc_ids)
+        embeddings = write_embeddings(tmp_dir) if write_embeddings is not None else None
+
+        manifest = {
+            "format": PACK_FORMAT,
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "chunks": len(texts),
+            "sources": source_names,
+            "fingerprints": {path: list(fp) for path, fp in (fingerprints or {}).items()},
+            "digests": digests or {},
+            "settings": settings or {},
+            "lexical": {"k1": lexical_index.k1, "b": lexical_index.b},
+            "embeddings": embeddings,
+        }
+        with open(tmp_dir / MANIFEST_NAME, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_dir, final_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return final_dir
+
+
+def activate_pack(packs_dir, version, link_name="current"):
+    """
+    Point ``packs_dir/link_name`` at a pack version.
+
+    The link is created under a temporary name and renamed over the old
+    one, so readers see either the old or the new version, never neither.
+    Where symlinks are not permitted, a ``CURRENT`` pointer file is
+    replaced atomically instead.
+    """
+    packs_dir = Path(packs_dir)
+    link = packs_dir / link_name
+    tmp_link = packs_dir / f".{link_name}.{os.getpid()}.tmp"
+    try:
+        if tmp_link.is_symlink() or tmp_link.exists():
+            tmp_link.unlink()
+        os.symlink(version, tmp_link, target_is_directory=True)
+        os.replace(tmp_link, link)
+    except OSError:
+        tmp_pointer = packs_dir / f".{POINTER_NAME}.{os.getpid()}.tmp"
+        tmp_pointer.write_text(version, encoding='utf-8')
+        os.replace(tmp_pointer, packs_dir / POINTER_NAME)
+
+
+def resolve_pack(path):
+    """
+    Find the pack folder a path refers to.
+
+    Accepts a pack folder, a symlink to one, or a ``current`` path whose
+    folder holds a ``CURRENT`` pointer file.
+
+    Returns:
+        Path, or None if no pack is there
+    """
+    path = Path(path)
+    if (path / MANIFEST_NAME).is_file():
+        return path.resolve()
+    pointer = path.parent / POINTER_NAME
+    if pointer.is_file():
+        candidate = path.parent / pointer.read_text(encoding='utf-8').strip()
+        if (candidate / MANIFEST_NAME).is_file():
+            return candidate.resolve()
+    return None
+
+
+def prune_packs(packs_dir, keep=3):
+    """Delete all but the ``keep`` newest pack versions, never the active one."""
+    packs_dir = Path(packs_dir)
+    active = resolve_pack(packs_dir / "current")
+    versions = sorted(
+        (p for p in packs_dir.iterdir() if p.is_dir() and not p.is_symlink() and (p / MANIFEST_NAME).is_file()),
+        # Build order; names only sort to the second
+        key=lambda p: ((p / MANIFEST_NAME).stat().st_mtime_ns, p.name)
+    )
+    removed = []
+    for pack_dir in versions[:-keep] if keep > 0 else versions:
+        if active is not None and pack_dir.resolve() == active:
+            continue
+        shutil.rmtree(pack_dir, ignore_errors=True)
+        removed.append(pack_dir.name)
+    return removed
+
+
+class PackSequence:
+    """
+    List-like per-chunk pack data plus the changes made while serving.
+
+    Items of the pack are read on access, so nothing is copied into the
+    process; assigned and appended items are kept in memory. Supports what
+    RAGRetriever does with its chunk lists: ``len``, iteration, integer
+    indexing, item assignment and ``append``.
+    """
+
+    def __init__(self, size, read):
+        """
+        Initialize the sequence.
+
+        Args:
+            size: Number of items in the pack
+            read: Callable returning the pack item at an index
+        """
+        self._size = size
+        self._read = read
+        self._changed = {}
+        self._extra = []
+
+    def __len__(self):
+        return self._size + len(self._extra)
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index >= self._size:
+            return self._extra[index - self._size]
+        if index in self._changed:
+            return self._changed[index]
+        return self._read(index)
+
+    def __setitem__(self, index, value):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index >= self._size:
+            self._extra[index - self._size] = value
+        else:
+            self._changed[index] = value
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, value):
+        self._extra.append(value)
+
+
+class KnowledgePack:
+    """
+    A knowledge pack opened for serving.
+
+    Every file is memory-mapped read-only and read through offsets, so
+    opening a pack costs a manifest read and the pages are shared by all
+    processes on the node through the OS page cache: chunk text is decoded
+    only for the chunks a query returns, and nothing per chunk is copied
+    into a worker's heap.
+    """
+
+    def __init__(self, path, manifest):
+        self.path = Path(path)
+        self.manifest = manifest
+        self.version = manifest["version"]
+        self._offsets = np.load(self.path / "chunks.offsets.npy", mmap_mode='r')
+        self._source_ids = np.load(self.path / "chunks.sources.npy", mmap_mode='r')
+        self._blob = np.memmap(self.path / "chunks.bin", dtype=np.uint8, mode='r') \
+            if self._offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Open the pack at a folder, symlink or ``current`` path.
+
+        Returns:
+            KnowledgePack, or None if there is no valid pack
+        """
+        pack_dir = resolve_pack(path)
+        if pack_dir is None:
+            return None
+        try:
+            with open(pack_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get("format") != PACK_FORMAT:
+                return None
+            pack = cls(pack_dir, manifest)
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(pack) != manifest["chunks"]:
+            return None
+        return pack
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def text(self, chunk_id):
+        """Decode one chunk's text."""
+        start, end = self._offsets[chunk_id], self._offsets[chunk_id + 1]
+        return self._blob[start:end].tobytes().decode('utf-8')
+
+    def texts(self):
+        """Chunk texts as a TextStore over the mapped blob, decoded on access."""
+        return TextStore(self._blob, self._offsets)
+
+    def sources(self, rename=None):
+        """
+        Source name of every chunk as a PackSequence.
+
+        Args:
+            rename: Optional callable mapping stored names to the names to return
+        """
+        names = [rename(name) for name in self.manifest["sources"]] if rename else self.manifest["sources"]
+        source_ids = self._source_ids
+        return PackSequence(len(self), lambda chunk_id: names[source_ids[chunk_id]])
+
+    def source_chunks(self, rename=None):
+        """
+        Chunk ids of every source; a ``range`` when they are contiguous, as
+        packs write them.
+        """
+        names = [rename(name) for name in self.manifest["sources"]] if rename else self.manifest["sources"]
+        order = np.argsort(self._source_ids, kind='stable')
+        counts = np.bincount(self._source_ids, minlength=len(names)).tolist()
+        chunks, start = {}, 0
+        for source_id, count in enumerate(counts):
+            ids = order[start:start + count]
+            start += count
+            if not count:
+                continue
+            first = int(ids[0])
+            contiguous = int(ids[-1]) - first == count - 1
+            chunks[names[source_id]] = range(first, first + count) if contiguous else ids.tolist()
+        return chunks
+
+    @property
+    def fingerprints(self):
+        """``{path: (size, mtime_ns)}`` of the files the pack was built from."""
+        return {path: tuple(fp) for path, fp in self.manifest["fingerprints"].items()}
+
+    @property
+    def digests(self):
+        """``{path: sha256}`` of the files and metadata sidecars the pack was built from."""
+        return self.manifest.get("digests", {})
+
+    @property
+    def settings(self):
+        """Chunking and dedup settings the pack was built with."""
+        return self.manifest.get("settings", {})
+
+    def lexical_index(self):
+        """Memory-mapped BM25 index over the pack's chunks."""
+        params = self.manifest.get("lexical", {})
+        return PackedBM25Index.load(self.path, **params)
+
+    def metadata_index(self):
+        """Chunk metadata and its filter bitmaps."""
+        return MetadataIndex.load(self.path)
+
+    @property
+    def embeddings_path(self):
+        """Dense index matrix path, or None if the pack has no embeddings."""
+        if not self.manifest.get("embeddings"):
+            return None
+        return self.path / self.manifest["embeddings"]["file"]
@@ -0,0 +1,104 @@
+"""Background watcher that keeps the retriever in sync with the knowledge folder."""
+import os
+import threading
+
+from .knowledge_loader import KNOWLEDGE_EXTENSIONS
+
+
+class KnowledgeWatcher:
+    """
+    Polls the knowledge directory and re-indexes files that were added,
+    changed or deleted.
+
+    Polling on (size, mtime) needs no extra dependency and works the same
+    on every platform and on mounted volumes. Each scan also picks up a
+    newly activated knowledge pack.
+    """
+
+    def __init__(self, retriever, interval=10.0):
+        """
+        Initialize the watcher.
+
+        Args:
+            retriever: RAGRetriever to update
+            interval: Seconds between directory scans
+        """
+        self.retriever = retriever
+        self.interval = interval
+        self._known = dict(retriever.source_fingerprints)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _snapshot(self):
+        files = {}
+        directory = self.retriever.knowledge_dir
+        if not directory.exists():
+            # A missing folder (e.g. a pack-only deploy) is not a deletion of every file
+            return None
+        for path in directory.rglob('*'):
+            if path.suffix.lower() not in KNOWLEDGE_EXTENSIONS or not self.retriever.owns(path):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files[str(path)] = (stat.st_size, stat.st_mtime_ns)
+        return files
+
+    def scan(self):
+        """
+        Apply any changes since the last scan.
+
+        Files that fail to re-index keep their previous fingerprint, so the
+        next scan tries them again.
+
+        Returns:
+            tuple: (files re-indexed, files removed)
+        """
+        if self.retriever.reload_pack():
+            self._known = dict(self.retriever.source_fingerprints)
+        current = self._snapshot()
+        if current is None:
+            return 0, 0
+        changed = [path for path, fingerprint in current.items() if self._known.get(path) != fingerprint]
+        removed = [path for path in self._known if path not in current]
+
+        failed = []
+        for path in sorted(changed):
+            try:
+                added, dropped = self.retriever.upsert_document(path)
+                print(f"   🔄 Re-indexed {os.path.basename(path)} (+{added}/-{dropped} chunks)")
+            except Exception as e:
+                print(f"   ❌ Could not re-index {os.path.basename(path)}: {e}")
+                failed.append(path)
+        for path in sorted(removed):
+            _, dropped = self.retriever.remove_document(path)
+            print(f"   🗑️  Removed {os.path.basename(path)} ({dropped} chunks)")
+
+        for path in failed:
+            if path in self._known:
+                current[path] = self._known[path]
+            else:
+                del current[path]
+        self._known = current
+        return len(changed) - len(failed), len(removed)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"⚠️  Knowledge watcher scan failed: {e}")
+
+    def start(self):
+        """Start polling in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="knowledge-watcher", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop polling."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.interval)
+            self._thread = None
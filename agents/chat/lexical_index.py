@@ -0,0 +1,1011 @@
+"""BM25 inverted index for keyword retrieval over the knowledge base."""
+import functools
+import heapq
+import math
+import re
+from pathlib import Path
+
+import numpy as np
+
+from .metadata import filter_mask
+from .positions import contains_phrase, decode_document, decode_documents, encode_document, min_distance
+from .spelling import SpellingIndex
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+PHRASE_PATTERN = re.compile(r'"([^"]+)"')
+# Longer terms are left out of packed indexes so the vocabulary fits a fixed-width array
+MAX_PACKED_TERM_BYTES = 64
+PACKED_FILES = ("terms", "term_offsets", "posting_docs", "posting_tfs", "doc_lengths",
+                "term_max_tfs", "term_min_lengths", "positions", "position_offsets")
+# Query x document score cells accumulated at once by search_many (32 MB of float64)
+BATCH_SCORE_CELLS = 1 << 22
+# Boost for two neighbouring query terms side by side in a document, times their mean idf
+PROXIMITY_WEIGHT = 1.0
+# Query terms further apart than this many tokens in a document get no proximity boost
+PROXIMITY_WINDOW = 8
+
+STOPWORDS = frozenset("""
+a about above after again against all am an and any are as at be because been
+before being below between both but by can could did do does doing down during
+each few for from further had has have having he her here hers herself him
+himself his how i if in into is it its itself just me more most my myself no
+nor not now of off on once only or other our ours ourselves out over own same
+she should so some such than that the their theirs them themselves then there
+these they this those through to too under until up very was we were what when
+where which while who whom why will with would you your yours yourself
+yourselves
+""".split())
+
+
+def _normalize(token):
+    """Fold simple English plurals so 'soybeans' matches 'soybean'."""
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    """Split text into lowercase index terms with stopwords removed."""
+    return [
+        _normalize(token)
+        for token in TOKEN_PATTERN.findall(text.lower())
+        if token not in STOPWORDS
+    ]
+
+
+def term_positions(text):
+    """``{term: ascending token positions}`` of a text's index terms; stopwords still take up a position."""
+    positions = {}
+    for position, token in enumerate(TOKEN_PATTERN.findall(text.lower())):
+        if token not in STOPWORDS:
+            positions.setdefault(_normalize(token), []).append(position)
+    return positions
+
+
+def phrases(query):
+    """Quoted phrases of two or more terms in a query, as ``(term, offset from the first term)`` lists."""
+    found = []
+    for quoted in PHRASE_PATTERN.findall(query):
+        placed = sorted((position, term) for term, positions in term_positions(quoted).items()
+                        for position in positions)
+        if len(placed) > 1:
+            found.append([(term, position - placed[0][0]) for position, term in placed])
+    return found
+
+
+def unquote(query):
+    """A query with its phrase quotes removed, so the phrases are matched as separate words."""
+    return query.replace('"', ' ')
+
+
+def correct_query(query, corrections):
+    """Replace the words of a query whose index term has a correction in ``{term: replacement}``."""
+    if not corrections:
+        return query
+    return TOKEN_PATTERN.sub(lambda match: corrections.get(_normalize(match.group(0).lower()), match.group(0)), query)
+
+
+def _suggestions(index, terms, max_distance):
+    """Spelling suggestions of either index class, see ``BM25Index.suggestions``."""
+    suggestions = {}
+    for term in terms:
+        if term in suggestions:
+            continue
+        if index.document_frequency(term):
+            suggestions[term] = None
+            continue
+        # Candidates left behind by removed documents are skipped
+        ranked = [(distance, abs(len(candidate) - len(term)), -index.document_frequency(candidate), candidate)
+                  for distance, candidate in index._speller().candidates(term, max_distance)]
+        ranked = [suggestion for suggestion in ranked if suggestion[2]]
+        if ranked:
+            suggestions[term] = min(ranked)
+    return suggestions
+
+
+def _scoring(index, stats=None):
+    """
+    BM25 idf function and average document length of an index.
+
+    ``stats`` are ``collection_stats`` summed over every shard of a split
+    corpus; scoring with them makes scores from different shards comparable.
+    """
+    if stats is None:
+        return index.idf, index.average_length or 1.0
+    documents, total_length, frequencies = stats
+
+    def idf(term):
+        df = frequencies.get(term, 0)
+        return math.log(1 + (documents - df + 0.5) / (df + 0.5))
+
+    return idf, (total_length / documents if documents else 0.0) or 1.0
+
+
+def _bm25(tf, length, idf, k1, b, avgdl):
+    """BM25 contribution of a term occurring ``tf`` times in a document of ``length`` terms."""
+    return idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * length / avgdl))
+
+
+def _max_score(bounds, k, term_scores, lookup, floor=0.0, presence=None):
+    """
+    Exact top ``k`` of a query with MaxScore pruning.
+
+    Terms are ordered by the most they can add to any document's score.
+    Once the k-th best complete score reaches the sum of the smallest
+    bounds, documents containing only those "non-essential" terms cannot
+    make the top k, so only the postings of the remaining "essential"
+    terms are scored; the non-essential terms are merely looked up for
+    the candidates those produce. Starting from the strongest term alone,
+    the essential set grows until the threshold it yields covers the rest.
+    Contributions are summed in sorted term order, as ``_search_many``
+    does, so both give identical scores.
+
+    Args:
+        bounds: ``{term: upper bound of its contribution}`` for the query terms in the index
+        k: Number of results
+        term_scores: Callable returning ``(doc_ids, scores)`` arrays of every
+            allowed live document containing a term
+        lookup: Callable returning a term's contribution to each of an array
+            of document ids (0 where absent) and the postings it read
+        floor: Only documents scoring at least this are returned; a known
+            floor prunes from the start
+        presence: Optional ``{term: amount}`` added to the score of every
+            document containing the term
+
+    Returns:
+        tuple: ``(doc_id, score)`` pairs best first, postings read
+    """
+    presence = presence or {}
+    bounds = {term: bound + presence.get(term, 0.0) for term, bound in bounds.items()}
+    by_bound = sorted(bounds, key=lambda term: (bounds[term], term))
+    essential_from, scored, read = len(by_bound) - 1, {}, 0
+    while True:
+        for term in by_bound[essential_from:]:
+            if term not in scored:
+                docs, scores = term_scores(term)
+                scored[term] = docs, scores + presence.get(term, 0.0)
+                read += len(docs)
+        docs = np.unique(np.concatenate([found[0] for found in scored.values()]))
+        totals = np.zeros(len(docs))
+        for term in sorted(bounds):
+            if term in scored:
+                totals[np.searchsorted(docs, scored[term][0])] += scored[term][1]
+            else:
+                contributions, postings = lookup(term, docs)
+                if term in presence:
+                    contributions = contributions + presence[term] * (contributions > 0)
+                totals += contributions
+                read += postings
+        theta = np.partition(totals, len(totals) - k)[len(totals) - k] if len(totals) >= k else 0.0
+        theta = max(theta, floor)
+        # The weakest terms whose bounds together stay below the k-th score are non-essential
+        split, total = 0, 0.0
+        while split < len(by_bound) and total + bounds[by_bound[split]] < theta:
+            total += bounds[by_bound[split]]
+            split += 1
+        if split >= essential_from:
+            break
+        essential_from = split
+    if len(docs) > k or floor > 0:
+        # Keep everything tied with the k-th score so the tie-break below stays exact
+        keep = totals >= theta
+        docs, totals = docs[keep], totals[keep]
+    hits = heapq.nlargest(k, zip(docs.tolist(), totals.tolist()), key=lambda item: (item[1], -item[0]))
+    return hits, read
+
+
+def _count_pruning(stats, postings, read):
+    """Add one query's postings, and how many of them were read, to ``pruning_stats``."""
+    stats["queries"] += 1
+    stats["postings"] += postings
+    stats["read"] += read
+
+
+def _top_scores(scores, k):
+    """
+    Best ``k`` ``(doc_id, score)`` pairs of each row of a score block.
+
+    Only positive scores are matches; ties are broken by document id, as in ``search``.
+    """
+    width = scores.shape[1]
+    if width > k:
+        cutoff = np.partition(scores, width - k, axis=1)[:, width - k]
+    else:
+        cutoff = np.zeros(len(scores))
+    cutoff = np.maximum(cutoff, np.finfo(scores.dtype).tiny)
+    rows, docs = np.nonzero(scores >= cutoff[:, None])
+    values = scores[rows, docs]
+    order = np.lexsort((docs, -values, rows))
+    rows, docs, values = rows[order], docs[order].tolist(), values[order].tolist()
+    bounds = np.searchsorted(rows, np.arange(len(scores) + 1)).tolist()
+    return [
+        list(zip(docs[start:min(end, start + k)], values[start:min(end, start + k)]))
+        for start, end in zip(bounds, bounds[1:])
+    ]
+
+
+def _floor_scores(scores, floors):
+    """``(doc_id, score)`` pairs of each row of a score block reaching that row's floor, best first."""
+    found = []
+    for row, floor in zip(scores, floors):
+        docs = np.flatnonzero(row >= max(floor, np.finfo(scores.dtype).tiny))
+        values = row[docs]
+        order = np.lexsort((docs, -values))
+        found.append(list(zip(docs[order].tolist(), values[order].tolist())))
+    return found
+
+
+def _search_many(queries, k, width, term_scores, floors=None, presence=None):
+    """
+    Rank a batch of queries.
+
+    Queries are scored in blocks of dense score rows. Each distinct term of
+    a block is looked up and scored once, then added into the rows of every
+    query containing it, so common terms are traversed once per block
+    instead of once per query.
+
+    Args:
+        queries: Free-text queries
+        k: Number of results per query
+        width: One past the largest document id
+        term_scores: Callable returning ``(doc_ids, scores)`` arrays for a term, or None
+        floors: Optional per-query scores; every document reaching its
+            query's floor is returned instead of the top ``k``
+        presence: Optional per-query ``{term: amount}`` added to the score of
+            every document containing the term, as in ``_max_score``
+
+    Returns:
+        list: One ``(doc_id, score)`` list per query, best first
+    """
+    query_terms = [set(tokenize(query)) for query in queries]
+    if k <= 0 or not width:
+        return [[] for _ in queries]
+    block_size = max(1, BATCH_SCORE_CELLS // width)
+    results = []
+    for start in range(0, len(query_terms), block_size):
+        block = query_terms[start:start + block_size]
+        rows_by_term = {}
+        for row, terms in enumerate(block):
+            for term in terms:
+                rows_by_term.setdefault(term, []).append(row)
+        scores = np.zeros((len(block), width))
+        for term, rows in sorted(rows_by_term.items()):
+            scored = term_scores(term)
+            if scored is None:
+                continue
+            docs, contributions = scored
+            for row in rows:
+                row_scores = scores[row]
+                credit = presence[start + row].get(term, 0.0) if presence else 0.0
+                row_scores[docs] += contributions + credit if credit else contributions
+        if floors is None:
+            results.extend(_top_scores(scores, k))
+        else:
+            results.extend(_floor_scores(scores, floors[start:start + block_size]))
+    return results
+
+
+def _phrase_filter(index, query_phrases, allowed=None):
+    """
+    Filter bitmap of the allowed documents containing every phrase.
+
+    Candidates are the documents holding all of a phrase's terms; their
+    stored positions are then checked for the terms at the phrase's offsets.
+    """
+    matched = None
+    for phrase in query_phrases:
+        terms = {term for term, _ in phrase}
+        candidates = functools.reduce(np.intersect1d, (index.documents_with(term) for term in terms))
+        if matched is not None:
+            candidates = np.intersect1d(candidates, matched)
+        if allowed is not None:
+            candidates = candidates[filter_mask(allowed, candidates)]
+        candidates = candidates.tolist()
+        matched = np.array([doc_id for doc_id, positions in zip(candidates, index.positions(candidates, terms))
+                            if contains_phrase(positions, phrase)], dtype=np.int64)
+    mask = np.zeros(int(matched.max()) + 1 if len(matched) else 0, dtype=bool)
+    mask[matched] = True
+    return mask
+
+
+def _proximity_pairs(index, query, idf_of):
+    """Neighbouring query terms that are both in the index, with the most they add to a document's score."""
+    if PROXIMITY_WEIGHT <= 0:
+        return []
+    terms = tokenize(query)
+    return [(first, second, PROXIMITY_WEIGHT * (idf_of(first) + idf_of(second)) / 2)
+            for first, second in zip(terms, terms[1:])
+            if first != second and index.document_frequency(first) and index.document_frequency(second)]
+
+
+def _proximity_boost(positions, pairs):
+    """Score added to a document, given its positions of the pair terms, for holding them close together."""
+    boost = 0.0
+    for first, second, weight in pairs:
+        if first in positions and second in positions:
+            distance = min_distance(positions[first], positions[second])
+            if distance <= PROXIMITY_WINDOW:
+                boost += weight / distance
+    return boost
+
+
+def _boosted(index, pairs, k, hits):
+    """Top ``k`` of BM25 hits once proximity boosts are added."""
+    terms = {term for first, second, _ in pairs for term in (first, second)}
+    positions = index.positions([doc_id for doc_id, _ in hits], terms)
+    boosted = [(doc_id, score + _proximity_boost(found, pairs)) for (doc_id, score), found in zip(hits, positions)]
+    return heapq.nlargest(k, boosted, key=lambda item: (item[1], -item[0]))
+
+
+def _rescored(index, query, hits, scoring):
+    """
+    Hits with their plain BM25 scores.
+
+    Terms are summed in sorted order, as ``_max_score`` and ``_search_many``
+    sum them, so a document scores the same whichever way it was found.
+    """
+    idf_of, avgdl = scoring
+    docs = np.array(sorted(doc_id for doc_id, _ in hits), dtype=np.int64)
+    totals = np.zeros(len(docs))
+    for term in sorted(set(tokenize(query))):
+        if index.document_frequency(term):
+            totals += index._lookup(term, docs, idf_of(term), avgdl)[0]
+    return list(zip(docs.tolist(), totals.tolist()))
+
+
+def _credits(pairs):
+    """Half the boost of every pair a term belongs to, which bounds what the term brings a document."""
+    credits = {}
+    for first, second, weight in pairs:
+        credits[first] = credits.get(first, 0.0) + weight / 2
+        credits[second] = credits.get(second, 0.0) + weight / 2
+    return credits
+
+
+def _proximity_floor(pairs, k, hits, top):
+    """
+    None if the boosted BM25 top ``k`` is already final, else the score a document needs to enter it.
+
+    A pair only boosts documents holding both its terms, so a document
+    scores at most its BM25 score plus the credits of the pair terms it
+    contains. If even the full boost of every pair cannot lift a document
+    outside the hits past the k-th boosted score, nothing else can enter.
+    """
+    if len(hits) < k or top[-1][1] > hits[-1][1] + sum(weight for _, _, weight in pairs):
+        return None
+    # A little slack so rounding cannot drop a document tied with the k-th score
+    return top[-1][1] - 1e-9
+
+
+def _proximity_rerank(index, query, k, allowed, scoring, pairs, hits=None):
+    """
+    Exact top ``k`` once proximity boosts are added to BM25 scores.
+
+    The BM25 top ``k`` are boosted first. Unless that settles the result,
+    one MaxScore pass with each term's credits added to its scores finds
+    every document that could still reach the k-th boosted score, and those
+    are boosted and re-ranked.
+
+    Args:
+        index: BM25Index or PackedBM25Index
+        query: Free-text query
+        k: Number of results
+        allowed: Optional filter bitmap over document ids
+        scoring: ``_scoring`` of the index
+        pairs: ``_proximity_pairs`` of the query
+        hits: The BM25 top ``k``, if already ranked
+
+    Returns:
+        list: ``(doc_id, score)`` pairs, best first
+    """
+    if hits is None:
+        hits = index._ranked(query, k, allowed, scoring)
+    top = _boosted(index, pairs, k, hits)
+    floor = _proximity_floor(pairs, k, hits, top)
+    if floor is None:
+        return top
+    candidates = index._ranked(query, len(index), allowed, scoring, floor, _credits(pairs))
+    return _boosted(index, pairs, k, _rescored(index, query, candidates, scoring))
+
+
+def _search(index, query, k, allowed, scoring, pooled=None):
+    """
+    Rank documents for one query of either index class.
+
+    Quoted phrases restrict the results to documents containing them, and
+    BM25 scores are boosted by how close neighbouring query terms are.
+
+    Args:
+        index: BM25Index or PackedBM25Index
+        query: Free-text query
+        k: Number of results
+        allowed: Optional filter bitmap over document ids
+        scoring: ``_scoring`` of the index
+        pooled: The query's BM25 top ``k``, if already ranked
+
+    Returns:
+        list: ``(doc_id, score)`` pairs, best first
+    """
+    query_phrases = phrases(query)
+    if query_phrases:
+        allowed, pooled = _phrase_filter(index, query_phrases, allowed), None
+    pairs = _proximity_pairs(index, query, scoring[0])
+    if not pairs:
+        return pooled if pooled is not None else index._ranked(query, k, allowed, scoring)
+    return _proximity_rerank(index, query, k, allowed, scoring, pairs, pooled)
+
+
+def _rank_many(index, queries, k, allowed, scoring, width, term_scores):
+    """
+    ``search_many`` of either index class.
+
+    The BM25 top ``k`` of every query is ranked in one batch, and so are
+    the candidates of the queries whose proximity boosts can still change
+    it; queries with quoted phrases are searched on their own.
+    """
+    results = _search_many(queries, k, width, term_scores)
+    unsettled = []
+    for i, query in enumerate(queries):
+        if phrases(query):
+            results[i] = _search(index, query, k, allowed, scoring)
+            continue
+        pairs = _proximity_pairs(index, query, scoring[0])
+        if not pairs:
+            continue
+        top = _boosted(index, pairs, k, results[i])
+        floor = _proximity_floor(pairs, k, results[i], top)
+        if floor is None:
+            results[i] = top
+        else:
+            unsettled.append((i, pairs, floor))
+    if unsettled:
+        candidates = _search_many([queries[i] for i, _, _ in unsettled], k, width, term_scores,
+                                  floors=[floor for _, _, floor in unsettled],
+                                  presence=[_credits(pairs) for _, pairs, _ in unsettled])
+        for (i, pairs, _), found in zip(unsettled, candidates):
+            results[i] = _boosted(index, pairs, k, _rescored(index, queries[i], found, scoring))
+    return results
+
+
+class BM25Index:
+    """Inverted index that ranks documents with Okapi BM25.
+
+    Postings map each term to ``{doc_id: term_frequency}``, so a query only
+    touches the documents that contain at least one of its terms. Each term
+    also keeps its highest frequency and shortest document, which bound its
+    score so ``search`` can skip the postings of common terms (MaxScore).
+    Bounds are not lowered when documents are removed; they stay valid,
+    only less tight. Term positions are kept per document as one
+    delta-encoded byte string (see ``positions.encode_document``) for
+    phrase and proximity matching.
+    """
+
+    def __init__(self, documents=(), k1=1.5, b=0.75):
+        """
+        Build the index.
+
+        Args:
+            documents: Iterable of document texts; ids are their positions
+            k1: Term frequency saturation parameter
+            b: Document length normalisation parameter
+        """
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+        self.max_tfs = {}
+        self.min_lengths = {}
+        self.term_ids = {}  # term -> id used in the encoded positions
+        self.doc_positions = {}
+        self.pruning_stats = {"queries": 0, "postings": 0, "read": 0}
+        self._spelling = None
+        for doc_id, text in enumerate(documents):
+            self.add(doc_id, text)
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    @property
+    def average_length(self):
+        """Average document length in terms."""
+        return self.total_length / len(self.doc_lengths) if self.doc_lengths else 0.0
+
+    def add(self, doc_id, text):
+        """Index a document under the given id."""
+        positions = term_positions(text)
+        length = sum(len(found) for found in positions.values())
+        for term, found in positions.items():
+            tf = len(found)
+            self.postings.setdefault(term, {})[doc_id] = tf
+            self.max_tfs[term] = max(self.max_tfs.get(term, 0), tf)
+            self.min_lengths[term] = min(self.min_lengths.get(term, length), length)
+            self.term_ids.setdefault(term, len(self.term_ids))
+            if self._spelling is not None:
+                self._spelling.add(term)
+        self.doc_positions[doc_id] = encode_document(
+            {self.term_ids[term]: found for term, found in positions.items()})
+        self.doc_lengths[doc_id] = length
+        self.total_length += length
+
+    def remove(self, doc_id, text):
+        """Drop a document, given the text it was indexed with."""
+        if doc_id not in self.doc_lengths:
+            return
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            posting.pop(doc_id, None)
+            if not posting:
+                del self.postings[term]
+                del self.max_tfs[term], self.min_lengths[term]
+        del self.doc_positions[doc_id]
+        self.total_length -= self.doc_lengths.pop(doc_id)
+
+    def document_frequency(self, term):
+        """Number of documents containing the term."""
+        return len(self.postings.get(term, ()))
+
+    def documents_with(self, term):
+        """Ascending ids of the documents containing a term."""
+        posting = self.postings.get(term, {})
+        return np.sort(np.fromiter(posting, dtype=np.int64, count=len(posting)))
+
+    def positions(self, doc_ids, terms):
+        """``{term: ascending token positions}`` of those of ``terms`` each of the documents contains."""
+        wanted = {self.term_ids[term]: term for term in terms if term in self.term_ids}
+        if not wanted:
+            return [{} for _ in doc_ids]
+        encoded = [self.doc_positions.get(doc_id, b"") for doc_id in doc_ids]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in encoded], out=offsets[1:])
+        return decode_documents(b"".join(encoded), offsets, wanted)
+
+    def idf(self, term):
+        """BM25 inverse document frequency of a term."""
+        df = self.document_frequency(term)
+        n = len(self.doc_lengths)
+        return math.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    def collection_stats(self, terms):
+        """Document count, total length and document frequency of each term, to sum across shards."""
+        return len(self), self.total_length, {term: self.document_frequency(term) for term in terms}
+
+    def suggestions(self, terms, max_distance=2):
+        """
+        Spelling corrections for query terms missing from the index.
+
+        Args:
+            terms: Query terms, as produced by ``tokenize``
+            max_distance: Most edits between a term and its correction
+
+        Returns:
+            dict: None for each term found in the index, and ``(edits, length
+                difference, -document frequency, correction)`` for each missing
+                term with an indexed term close enough; the smallest is best
+        """
+        return _suggestions(self, terms, max_distance)
+
+    def corrections(self, terms, max_distance=2):
+        """``{term: correction}`` for the query terms that are missing from the index and have one."""
+        return {term: found[-1] for term, found in self.suggestions(terms, max_distance).items() if found}
+
+    def _speller(self):
+        """Trigram index of the vocabulary, built on the first lookup and kept up to date after."""
+        if self._spelling is None:
+            self._spelling = SpellingIndex(self.postings)
+        return self._spelling
+
+    def search(self, query, k=4, allowed=None, stats=None):
+        """
+        Rank documents against a query.
+
+        Args:
+            query: Free-text query
+            k: Number of results to return
+            allowed: Optional filter bitmap over document ids
+            stats: Optional corpus-wide ``collection_stats`` to score with
+
+        Returns:
+            list: ``(doc_id, score)`` pairs, best first
+        """
+        if not self.doc_lengths or k <= 0:
+            return []
+        return _search(self, query, k, allowed, _scoring(self, stats))
+
+    def _ranked(self, query, k, allowed, scoring, floor=0.0, presence=None):
+        """BM25 top ``k`` of a query, without phrases or proximity; see ``_max_score`` for the rest."""
+        idf_of, avgdl = scoring
+        terms = [term for term in set(tokenize(query)) if term in self.postings]
+        if not terms:
+            return []
+        idfs = {term: idf_of(term) for term in terms}
+        bounds = {term: _bm25(self.max_tfs[term], self.min_lengths[term], idfs[term], self.k1, self.b, avgdl)
+                  for term in terms}
+        hits, read = _max_score(bounds, k, lambda term: self._term_scores(term, avgdl, allowed, idf=idfs[term]),
+                                lambda term, docs: self._lookup(term, docs, idfs[term], avgdl), floor, presence)
+        _count_pruning(self.pruning_stats, sum(len(self.postings[term]) for term in terms), read)
+        return hits
+
+    def _lookup(self, term, docs, idf, avgdl):
+        """A term's contribution to each of a sorted array of document ids, and the postings read."""
+        posting = self.postings.get(term, {})
+        if len(posting) <= 4 * len(docs):
+            # Reading the whole posting is cheaper than probing it once per candidate
+            found = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+            tf = np.fromiter(posting.values(), dtype=np.float64, count=len(posting))
+            at = np.minimum(np.searchsorted(docs, found), len(docs) - 1)
+            inside = docs[at] == found
+            at, tf, read = at[inside], tf[inside], len(posting)
+        else:
+            tf = np.fromiter((posting.get(doc_id, 0) for doc_id in docs.tolist()), dtype=np.float64, count=len(docs))
+            at = np.flatnonzero(tf)
+            tf, read = tf[at], len(docs)
+        lengths = np.fromiter((self.doc_lengths[doc_id] for doc_id in docs[at].tolist()),
+                              dtype=np.float64, count=len(at))
+        contributions = np.zeros(len(docs))
+        contributions[at] = _bm25(tf, lengths, idf, self.k1, self.b, avgdl)
+        return contributions, read
+
+    def _term_scores(self, term, avgdl, allowed=None, idf=None):
+        """BM25 contribution of one term to each document containing it, as arrays."""
+        posting = self.postings.get(term)
+        if not posting:
+            return None
+        docs = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+        tf = np.fromiter(posting.values(), dtype=np.float64, count=len(posting))
+        lengths = np.fromiter((self.doc_lengths[doc_id] for doc_id in posting), dtype=np.float64, count=len(posting))
+        if allowed is not None:
+            keep = filter_mask(allowed, docs)
+            docs, tf, lengths = docs[keep], tf[keep], lengths[keep]
+        idf = self.idf(term) if idf is None else idf
+        return docs, _bm25(tf, lengths, idf, self.k1, self.b, avgdl)
+
+    def search_many(self, queries, k=4, allowed=None, stats=None):
+        """
+        Rank documents against a batch of queries, sharing posting traversal.
+
+        Args:
+            queries: Free-text queries
+            k: Number of results per query
+            allowed: Optional filter bitmap over document ids, applied to every query
+            stats: Optional corpus-wide ``collection_stats`` to score with
+
+        Returns:
+            list: One ``search`` result per query
+        """
+        if not self.doc_lengths or k <= 0:
+            return [[] for _ in queries]
+        idf_of, avgdl = _scoring(self, stats)
+        return _rank_many(self, queries, k, allowed, (idf_of, avgdl), max(self.doc_lengths) + 1,
+                          lambda term: self._term_scores(term, avgdl, allowed, idf=idf_of(term)))
+
+    def save(self, directory, doc_ids):
+        """
+        Write the index as flat arrays that PackedBM25Index can memory-map.
+
+        Args:
+            directory: Destination folder
+            doc_ids: Ids to keep, in order; they are renumbered 0..n-1
+        """
+        directory = Path(directory)
+        new_ids = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+        terms, offsets, docs, tfs, max_tfs, min_lengths = [], [0], [], [], [], []
+        packed_ids = {}  # term id in the encoded positions -> position in the packed vocabulary
+        for term in sorted(self.postings):
+            encoded = term.encode('utf-8')
+            if len(encoded) > MAX_PACKED_TERM_BYTES:
+                continue
+            posting = sorted((new_ids[doc_id], tf) for doc_id, tf in self.postings[term].items()
+                             if doc_id in new_ids)
+            if not posting:
+                continue
+            packed_ids[self.term_ids[term]] = len(terms)
+            terms.append(encoded)
+            docs.extend(doc_id for doc_id, _ in posting)
+            tfs.extend(tf for _, tf in posting)
+            offsets.append(len(docs))
+            max_tfs.append(max(tf for _, tf in posting))
+            min_lengths.append(min(self.doc_lengths[doc_ids[doc_id]] for doc_id, _ in posting))
+
+        # Positions are re-encoded with packed term ids, one document after another
+        positions = [encode_document(decode_document(self.doc_positions[doc_id], packed_ids)) for doc_id in doc_ids]
+        position_offsets = np.zeros(len(positions) + 1, dtype=np.int64)
+        np.cumsum([len(data) for data in positions], out=position_offsets[1:])
+
+        width = max((len(term) for term in terms), default=1)
+        arrays = {
+            "terms": np.array(terms, dtype=f"S{width}"),
+            "term_offsets": np.array(offsets, dtype=np.int64),
+            "posting_docs": np.array(docs, dtype=np.int32),
+            "posting_tfs": np.minimum(np.array(tfs, dtype=np.int64), 65535).astype(np.uint16),
+            "doc_lengths": np.array([self.doc_lengths[doc_id] for doc_id in doc_ids], dtype=np.int32),
+            # Per-term score bounds for MaxScore pruning
+            "term_max_tfs": np.minimum(np.array(max_tfs, dtype=np.int64), 65535).astype(np.uint16),
+            "term_min_lengths": np.array(min_lengths, dtype=np.int32),
+            "positions": np.frombuffer(b"".join(positions), dtype=np.uint8),
+            "position_offsets": position_offsets,
+        }
+        for name in PACKED_FILES:
+            np.save(directory / f"lexical.{name}.npy", arrays[name])
+
+
+class PackedBM25Index:
+    """
+    Read-only BM25 index over memory-mapped posting arrays.
+
+    The vocabulary is a sorted fixed-width byte array searched with
+    ``np.searchsorted``, and each term's postings are one slice of the
+    document and term-frequency arrays, so opening the index reads nothing
+    up front and queries are scored with NumPy. Stored per-term score
+    bounds let ``search`` skip most postings of common terms: they are only
+    binary-searched for the candidates of rarer terms (MaxScore). Each
+    document's encoded term positions are one slice of a byte array.
+    Documents added after loading go to a BM25Index overlay and removed ones
+    are masked out; collection statistics cover both.
+    """
+
+    def __init__(self, terms, term_offsets, posting_docs, posting_tfs, doc_lengths,
+                 term_max_tfs, term_min_lengths, positions, position_offsets, k1=1.5, b=0.75):
+        """
+        Initialize the index from arrays written by ``BM25Index.save``.
+        """
+        self.k1 = k1
+        self.b = b
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.posting_docs = posting_docs
+        self.posting_tfs = posting_tfs
+        self.doc_lengths = doc_lengths
+        self.term_max_tfs = term_max_tfs
+        self.term_min_lengths = term_min_lengths
+        self.position_bytes = positions
+        self.position_offsets = position_offsets
+        self.base_size = len(doc_lengths)
+        self.base_length = int(doc_lengths.sum(dtype=np.int64))
+        self.overlay = BM25Index(k1=k1, b=b)
+        self._deleted = set()
+        self._deleted_mask = np.zeros(self.base_size, dtype=bool)
+        self._deleted_length = 0
+        self._spelling = None
+        self.pruning_stats = {"queries": 0, "postings": 0, "read": 0}
+
+    @classmethod
+    def load(cls, directory, k1=1.5, b=0.75):
+        """
+        Open an index written by ``BM25Index.save``.
+
+        Returns:
+            PackedBM25Index, or None if files are missing or inconsistent
+        """
+        directory = Path(directory)
+        try:
+            arrays = [np.load(directory / f"lexical.{name}.npy", mmap_mode='r') for name in PACKED_FILES]
+        except (OSError, ValueError):
+            return None
+        terms, term_offsets, posting_docs, posting_tfs, doc_lengths, term_max_tfs, term_min_lengths, _, \
+            position_offsets = arrays
+        if len(term_offsets) != len(terms) + 1 or len(posting_docs) != len(posting_tfs):
+            return None
+        if len(term_max_tfs) != len(terms) or len(term_min_lengths) != len(terms):
+            return None
+        if len(position_offsets) != len(doc_lengths) + 1:
+            return None
+        return cls(*arrays, k1=k1, b=b)
+
+    def __len__(self):
+        return self.base_size - len(self._deleted) + len(self.overlay)
+
+    @property
+    def average_length(self):
+        """Average document length in terms."""
+        total = self.base_length - self._deleted_length + self.overlay.total_length
+        return total / len(self) if len(self) else 0.0
+
+    def _term_id(self, term):
+        """Position of a term in the packed vocabulary, or None."""
+        encoded = term.encode('utf-8')
+        if len(encoded) > self.terms.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self.terms, encoded))
+        return i if i < len(self.terms) and self.terms[i] == encoded else None
+
+    def _posting_range(self, term):
+        i = self._term_id(term)
+        if i is None:
+            return 0, 0
+        return int(self.term_offsets[i]), int(self.term_offsets[i + 1])
+
+    def document_frequency(self, term):
+        """Number of documents containing the term."""
+        start, end = self._posting_range(term)
+        df = end - start + self.overlay.document_frequency(term)
+        if self._deleted and end > start:
+            df -= int(np.count_nonzero(self._deleted_mask[self.posting_docs[start:end]]))
+        return df
+
+    def documents_with(self, term):
+        """Ascending ids of the live documents containing a term."""
+        start, end = self._posting_range(term)
+        docs = np.asarray(self.posting_docs[start:end], dtype=np.int64)
+        if self._deleted:
+            docs = docs[~self._deleted_mask[docs]]
+        return np.concatenate([docs, self.overlay.documents_with(term)])
+
+    def positions(self, doc_ids, terms):
+        """``{term: ascending token positions}`` of those of ``terms`` each of the documents contains."""
+        found = [{} for _ in doc_ids]
+        added = [i for i, doc_id in enumerate(doc_ids) if doc_id >= self.base_size]
+        for i, document in zip(added, self.overlay.positions([doc_ids[i] for i in added], terms)):
+            found[i] = document
+        wanted = {}
+        for term in terms:
+            term_id = self._term_id(term)
+            if term_id is not None:
+                wanted[term_id] = term
+        packed = [i for i, doc_id in enumerate(doc_ids) if doc_id < self.base_size]
+        if wanted and packed:
+            ids = np.array([doc_ids[i] for i in packed], dtype=np.int64)
+            starts, ends = self.position_offsets[ids], self.position_offsets[ids + 1]
+            data = b"".join(self.position_bytes[start:end].tobytes()
+                            for start, end in zip(starts.tolist(), ends.tolist()))
+            offsets = np.concatenate(([0], np.cumsum(ends - starts)))
+            for i, document in zip(packed, decode_documents(data, offsets, wanted)):
+                found[i] = document
+        return found
+
+    def idf(self, term):
+        """BM25 inverse document frequency of a term."""
+        df = self.document_frequency(term)
+        return math.log(1 + (len(self) - df + 0.5) / (df + 0.5))
+
+    def collection_stats(self, terms):
+        """Document count, total length and document frequency of each term, to sum across shards."""
+        total_length = self.base_length - self._deleted_length + self.overlay.total_length
+        return len(self), total_length, {term: self.document_frequency(term) for term in terms}
+
+    def add(self, doc_id, text):
+        """Index a document added after the pack was built."""
+        self.overlay.add(doc_id, text)
+        if self._spelling is not None:
+            for term in set(tokenize(text)):
+                self._spelling.add(term)
+
+    def remove(self, doc_id, text):
+        """Drop a document, given the text it was indexed with."""
+        if doc_id < self.base_size:
+            if doc_id not in self._deleted:
+                self._deleted.add(doc_id)
+                self._deleted_mask[doc_id] = True
+                self._deleted_length += int(self.doc_lengths[doc_id])
+        else:
+            self.overlay.remove(doc_id, text)
+
+    def suggestions(self, terms, max_distance=2):
+        """Spelling corrections for query terms missing from the index, see ``BM25Index.suggestions``."""
+        return _suggestions(self, terms, max_distance)
+
+    def corrections(self, terms, max_distance=2):
+        """``{term: correction}`` for the query terms that are missing from the index and have one."""
+        return {term: found[-1] for term, found in self.suggestions(terms, max_distance).items() if found}
+
+    def _speller(self):
+        """Trigram index of the packed and overlay vocabulary, built on the first lookup."""
+        if self._spelling is None:
+            self._spelling = SpellingIndex(term.decode('utf-8') for term in self.terms.tolist())
+            for term in self.overlay.postings:
+                self._spelling.add(term)
+        return self._spelling
+
+    def search(self, query, k=4, allowed=None, stats=None):
+        """
+        Rank documents against a query.
+
+        Args:
+            query: Free-text query
+            k: Number of results to return
+            allowed: Optional filter bitmap over document ids
+            stats: Optional corpus-wide ``collection_stats`` to score with
+
+        Returns:
+            list: ``(doc_id, score)`` pairs, best first
+        """
+        if not len(self) or k <= 0:
+            return []
+        return _search(self, query, k, allowed, _scoring(self, stats))
+
+    def _ranked(self, query, k, allowed, scoring, floor=0.0, presence=None):
+        """BM25 top ``k`` of a query, without phrases or proximity; see ``_max_score`` for the rest."""
+        idf_of, avgdl = scoring
+        bounds, ranges, idfs = {}, {}, {}
+        for term in set(tokenize(query)):
+            term_id = self._term_id(term)
+            overlay_bound = None
+            if term in self.overlay.postings:
+                overlay_bound = (self.overlay.max_tfs[term], self.overlay.min_lengths[term])
+            if term_id is None and overlay_bound is None:
+                continue
+            idfs[term] = idf = idf_of(term)
+            bounds[term] = 0.0
+            if term_id is not None:
+                ranges[term] = int(self.term_offsets[term_id]), int(self.term_offsets[term_id + 1])
+                bounds[term] = _bm25(int(self.term_max_tfs[term_id]), int(self.term_min_lengths[term_id]),
+                                     idf, self.k1, self.b, avgdl)
+            if overlay_bound is not None:
+                bounds[term] = max(bounds[term], _bm25(*overlay_bound, idf, self.k1, self.b, avgdl))
+        if not bounds:
+            return []
+        hits, read = _max_score(bounds, k, lambda term: self._term_scores(term, avgdl, allowed, idf=idfs[term]),
+                                lambda term, docs: self._lookup(term, docs, idfs[term], avgdl), floor, presence)
+        postings = sum(end - start for start, end in ranges.values()) + \
+            sum(len(self.overlay.postings.get(term, ())) for term in bounds)
+        _count_pruning(self.pruning_stats, postings, read)
+        return hits
+
+    def _lookup(self, term, docs, idf, avgdl):
+        """A term's contribution to each of a sorted array of document ids, and the postings read."""
+        contributions = np.zeros(len(docs))
+        start, end = self._posting_range(term)
+        if end > start:
+            # Binary search of the candidates in the doc-ordered posting slice
+            posting = self.posting_docs[start:end]
+            at = np.minimum(np.searchsorted(posting, docs), end - start - 1)
+            found = np.asarray(posting[at]) == docs
+            tf = np.asarray(self.posting_tfs[start:end][at[found]], dtype=np.float64)
+            contributions[found] = _bm25(tf, self.doc_lengths[docs[found]], idf, self.k1, self.b, avgdl)
+        overlay = self.overlay.postings.get(term)
+        if overlay:
+            for i in np.flatnonzero(docs >= self.base_size).tolist():
+                tf = overlay.get(int(docs[i]))
+                if tf:
+                    contributions[i] = _bm25(tf, self.overlay.doc_lengths[int(docs[i])], idf, self.k1, self.b, avgdl)
+        return contributions, len(docs)
+
+    def _base_scores(self, start, end, idf, avgdl, allowed=None):
+        """BM25 contributions of one packed posting slice."""
+        docs = np.asarray(self.posting_docs[start:end])
+        tf = np.asarray(self.posting_tfs[start:end], dtype=np.float64)
+        if allowed is not None:
+            # Only postings inside the filter are scored and merged
+            keep = filter_mask(allowed, docs)
+            docs, tf = docs[keep], tf[keep]
+        return docs, _bm25(tf, self.doc_lengths[docs], idf, self.k1, self.b, avgdl)
+
+    def _term_scores(self, term, avgdl, allowed=None, idf=None):
+        """BM25 contribution of one term to each live document containing it, as arrays."""
+        start, end = self._posting_range(term)
+        if start == end and not self.overlay.postings.get(term):
+            return None
+        idf = self.idf(term) if idf is None else idf
+        docs, scores = self._base_scores(start, end, idf, avgdl, allowed)
+        if self._deleted:
+            live = ~self._deleted_mask[docs]
+            docs, scores = docs[live], scores[live]
+        overlay = self.overlay._term_scores(term, avgdl, allowed, idf=idf)
+        if overlay is not None:
+            docs = np.concatenate([docs, overlay[0]])
+            scores = np.concatenate([scores, overlay[1]])
+        return docs, scores
+
+    def search_many(self, queries, k=4, allowed=None, stats=None):
+        """
+        Rank documents against a batch of queries, sharing posting traversal.
+
+        Args:
+            queries: Free-text queries
+            k: Number of results per query
+            allowed: Optional filter bitmap over document ids, applied to every query
+            stats: Optional corpus-wide ``collection_stats`` to score with
+
+        Returns:
+            list: One ``search`` result per query
+        """
+        if not len(self) or k <= 0:
+            return [[] for _ in queries]
+        idf_of, avgdl = _scoring(self, stats)
+        width = max(self.base_size, max(self.overlay.doc_lengths, default=-1) + 1)
+        return _rank_many(self, queries, k, allowed, (idf_of, avgdl), width,
+                          lambda term: self._term_scores(term, avgdl, allowed, idf=idf_of(term)))
@@ -0,0 +1,417 @@
+"""Chunk metadata and bitmap-indexed metadata filters."""
+import json
+import re
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+
+from ..reasoning.react_agent import TOPIC_REGEXES
+
+DEFAULT_LANGUAGE = "en"
+# Folder-wide metadata; applies to every file in the folder and below
+FOLDER_METADATA_NAME = "_metadata.json"
+# Per-file metadata lives next to the file as ``<name>.meta.json``
+FILE_METADATA_SUFFIX = ".meta.json"
+
+# Growth stages recognised in chunk text, with the R/V stage codes used in extension guides
+CROP_STAGE_PATTERNS = {
+    "planting": r"planting|sowing|sown|seedbed|seed(?:ing)? rate|seed dressing|inoculat\w*",
+    "emergence": r"emergence|germinat\w*|seedlings?|v[ce]",
+    "vegetative": r"vegetative|trifoliates?|unifoliates?|v[1-9]",
+    "flowering": r"flowering|flowers?|bloom\w*|r[12]",
+    "podding": r"pod(?:ding| set| fill\w*| formation| development)|seed fill\w*|r[3-6]",
+    "maturity": r"maturity|mature|senescence|r[78]",
+    "harvest": r"harvest\w*|threshing",
+    "storage": r"storage|post-harvest",
+}
+CROP_STAGE_REGEXES = {
+    stage: re.compile(rf"\b(?:{pattern})\b") for stage, pattern in CROP_STAGE_PATTERNS.items()
+}
+
+# Topic of chunks that name no specific farming topic; searched by every topic-routed query
+GENERAL_TOPIC = "general"
+# A chunk joins every topic mentioned at least this share as often as its most mentioned one
+TOPIC_DOMINANCE = 0.5
+
+# Evaluated filters kept per index until the metadata changes
+FILTER_CACHE_SIZE = 64
+
+
+def normalize_value(value):
+    """Case-insensitive form of a metadata value."""
+    return str(value).strip().casefold()
+
+
+def detect_crop_stages(text):
+    """Crop stages a chunk talks about, in growing-season order."""
+    lowered = text.lower()
+    return [stage for stage, regex in CROP_STAGE_REGEXES.items() if regex.search(lowered)]
+
+
+def detect_chunk_topics(text):
+    """
+    Farming topics a chunk is mainly about, or ``general``.
+
+    Uses the keywords ReACT reasoning detects in questions. Long chunks
+    mention most topics in passing, so only topics mentioned nearly as
+    often as the chunk's main one are kept.
+    """
+    folded = text.casefold()
+    counts = {
+        topic: len(regex.findall(folded))
+        for topic, regex in TOPIC_REGEXES.items() if topic != GENERAL_TOPIC
+    }
+    top = max(counts.values(), default=0)
+    if not top:
+        return [GENERAL_TOPIC]
+    return [topic for topic, count in counts.items() if count >= TOPIC_DOMINANCE * top]
+
+
+def _read_metadata_file(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"   ⚠️  Ignoring metadata file {path.name}: {e}")
+        return {}
+    if not isinstance(data, dict):
+        print(f"   ⚠️  Ignoring metadata file {path.name}: expected a JSON object")
+        return {}
+    return data
+
+
+def source_metadata(source, knowledge_dir, builtin_source="builtin"):
+    """
+    File-level metadata of a knowledge source.
+
+    ``_metadata.json`` files from the knowledge folder down to the file's
+    folder are merged in order, then the file's own ``<name>.meta.json``,
+    so the most specific value wins. ``source`` is the path relative to the
+    knowledge folder and ``language`` defaults to English.
+
+    Returns:
+        dict: Field to value (or list of values)
+    """
+    metadata = {"language": DEFAULT_LANGUAGE}
+    if source == builtin_source:
+        metadata["source"] = builtin_source
+        return metadata
+
+    path = Path(source)
+    knowledge_dir = Path(knowledge_dir)
+    try:
+        relative = path.resolve().relative_to(knowledge_dir.resolve())
+    except ValueError:
+        relative = Path(path.name)
+    folder = knowledge_dir
+    for part in (Path(),) + tuple(relative.parents)[-2::-1]:
+        candidate = folder / part / FOLDER_METADATA_NAME
+        if candidate.is_file():
+            metadata.update(_read_metadata_file(candidate))
+    sidecar = path.with_name(path.name + FILE_METADATA_SUFFIX)
+    if sidecar.is_file():
+        metadata.update(_read_metadata_file(sidecar))
+    metadata["source"] = relative.as_posix()
+    return metadata
+
+
+def chunk_metadata(text, base):
+    """A chunk's metadata: its source's metadata plus the crop stages and topics found in the text."""
+    metadata = dict(base)
+    if "crop_stage" not in metadata:
+        stages = detect_crop_stages(text)
+        if stages:
+            metadata["crop_stage"] = stages
+    if "topic" not in metadata:
+        metadata["topic"] = detect_chunk_topics(text)
+    return metadata
+
+
+def filter_mask(allowed, doc_ids):
+    """Which of ``doc_ids`` a filter bitmap allows; ids past its end are not allowed."""
+    doc_ids = np.asarray(doc_ids, dtype=np.int64)
+    inside = doc_ids < len(allowed)
+    mask = np.zeros(len(doc_ids), dtype=bool)
+    mask[inside] = allowed[doc_ids[inside]]
+    return mask
+
+
+class _Posting:
+    """Sorted, growable array of chunk ids."""
+
+    __slots__ = ("ids", "count")
+
+    def __init__(self, ids=None):
+        self.ids = np.zeros(8, dtype=np.int32) if ids is None else np.asarray(ids, dtype=np.int32)
+        self.count = 0 if ids is None else len(self.ids)
+
+    def view(self):
+        return self.ids[:self.count]
+
+    def add(self, doc_id):
+        if self.count == len(self.ids):
+            self.ids = np.concatenate([self.ids, np.zeros(max(8, self.count), dtype=np.int32)])
+        i = self.count if not self.count or self.ids[self.count - 1] < doc_id \
+            else int(np.searchsorted(self.view(), doc_id))
+        self.ids[i + 1:self.count + 1] = self.ids[i:self.count]
+        self.ids[i] = doc_id
+        self.count += 1
+
+    def discard(self, doc_id):
+        i = int(np.searchsorted(self.view(), doc_id))
+        if i < self.count and self.ids[i] == doc_id:
+            self.ids[i:self.count - 1] = self.ids[i + 1:self.count]
+            self.count -= 1
+
+
+class MetadataIndex:
+    """
+    Per-chunk metadata with a bitmap per (field, value).
+
+    Each chunk points at one of a small set of distinct metadata records,
+    so per-chunk storage is a single int32. Every (field, value) keeps a
+    sorted posting of chunk ids, turned into a boolean bitmap over chunk
+    ids the first time a filter uses it and kept up to date afterwards.
+    A filter is the AND/OR/NOT of those bitmaps, cached until the metadata
+    changes, and searches intersect it with their candidate ids.
+
+    Filters use the ``where`` syntax of Chroma::
+
+        {"region": "zambia"}
+        {"crop_stage": {"$in": ["flowering", "podding"]}, "language": "en"}
+        {"$or": [{"source": "rust.pdf"}, {"region": {"$ne": "malawi"}}]}
+
+    Keys of one dict are ANDed; ``$eq``, ``$ne``, ``$in`` and ``$nin`` are
+    supported on fields, ``$and`` and ``$or`` on lists of filters. A chunk
+    with several values for a field (e.g. two crop stages) matches each of
+    them. Values compare case-insensitively.
+    """
+
+    def __init__(self, records=(), codes=None, postings=None):
+        """
+        Initialize the index.
+
+        Args:
+            records: Distinct metadata records (field to tuple of values)
+            codes: Record index of each chunk id, -1 for none
+            postings: ``{(field, value): sorted chunk ids}`` matching ``codes``
+        """
+        self._records = [dict(record) for record in records]
+        self._record_ids = {self._key(record): i for i, record in enumerate(self._records)}
+        self._codes = np.full(64, -1, dtype=np.int32) if codes is None else codes
+        self._postings = {pair: _Posting(ids) for pair, ids in (postings or {}).items()}
+        self._bitmaps = {}
+        self._filters = OrderedDict()
+
+    @staticmethod
+    def _key(record):
+        return tuple(sorted(record.items()))
+
+    @staticmethod
+    def _pairs(record):
+        return [(field, value) for field, values in record.items() for value in values]
+
+    @staticmethod
+    def _normalize(metadata):
+        record = {}
+        for field, values in metadata.items():
+            values = values if isinstance(values, (list, tuple, set)) else [values]
+            values = tuple(sorted({normalize_value(v) for v in values if v is not None and str(v).strip()}))
+            if values:
+                record[str(field)] = values
+        return record
+
+    def __len__(self):
+        return int(np.count_nonzero(self._codes >= 0))
+
+    def _changed(self):
+        self._filters.clear()
+
+    def _ensure_capacity(self, doc_id):
+        if doc_id < len(self._codes):
+            return
+        extra = max(doc_id + 1, 2 * len(self._codes)) - len(self._codes)
+        self._codes = np.concatenate([self._codes, np.full(extra, -1, dtype=np.int32)])
+        for pair, bitmap in self._bitmaps.items():
+            self._bitmaps[pair] = np.concatenate([bitmap, np.zeros(extra, dtype=bool)])
+
+    def add(self, doc_id, metadata):
+        """
+        Record a chunk's metadata (field to value or list of values),
+        replacing what the chunk had before.
+
+        Returns:
+            bool: False if the chunk already had exactly this metadata
+        """
+        record = self._normalize(metadata)
+        key = self._key(record)
+        code = self._record_ids.get(key)
+        if code is None:
+            code = self._record_ids[key] = len(self._records)
+            self._records.append(record)
+        if doc_id < len(self._codes) and self._codes[doc_id] == code:
+            return False
+        self.remove(doc_id)
+        self._ensure_capacity(doc_id)
+        self._codes[doc_id] = code
+        for pair in self._pairs(record):
+            self._postings.setdefault(pair, _Posting()).add(doc_id)
+            if pair in self._bitmaps:
+                self._bitmaps[pair][doc_id] = True
+        self._changed()
+        return True
+
+    def remove(self, doc_id):
+        """Forget a chunk's metadata."""
+        if not 0 <= doc_id < len(self._codes) or self._codes[doc_id] < 0:
+            return
+        for pair in self._pairs(self._records[self._codes[doc_id]]):
+            self._postings[pair].discard(doc_id)
+            if pair in self._bitmaps:
+                self._bitmaps[pair][doc_id] = False
+        self._codes[doc_id] = -1
+        self._changed()
+
+    def metadata(self, doc_id):
+        """A chunk's metadata; fields with one value map to it, others to a list."""
+        if not 0 <= doc_id < len(self._codes) or self._codes[doc_id] < 0:
+            return {}
+        record = self._records[self._codes[doc_id]]
+        return {field: values[0] if len(values) == 1 else list(values) for field, values in record.items()}
+
+    def values(self, field):
+        """Indexed values of a field with their chunk counts."""
+        return {value: posting.count for (f, value), posting in self._postings.items()
+                if f == field and posting.count}
+
+    def _bitmap(self, field, value):
+        pair = (field, normalize_value(value))
+        bitmap = self._bitmaps.get(pair)
+        if bitmap is None:
+            posting = self._postings.get(pair)
+            if posting is None:
+                return np.zeros(len(self._codes), dtype=bool)
+            bitmap = np.zeros(len(self._codes), dtype=bool)
+            bitmap[posting.view()] = True
+            self._bitmaps[pair] = bitmap
+        return bitmap
+
+    def _any_of(self, field, values):
+        if not isinstance(values, (list, tuple, set)):
+            raise ValueError(f"filter on '{field}' expects a list of values")
+        mask = np.zeros(len(self._codes), dtype=bool)
+        for value in values:
+            mask |= self._bitmap(field, value)
+        return mask
+
+    def _evaluate(self, where):
+        if not isinstance(where, dict):
+            raise ValueError(f"filter must be a dict, got {type(where).__name__}")
+        mask = self._codes >= 0
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                if not isinstance(condition, (list, tuple)) or not condition:
+                    raise ValueError(f"'{key}' expects a non-empty list of filters")
+                parts = [self._evaluate(part) for part in condition]
+                combined = np.logical_and.reduce(parts) if key == "$and" else np.logical_or.reduce(parts)
+                mask &= combined
+            elif key.startswith("$"):
+                raise ValueError(f"unknown filter operator '{key}'")
+            elif isinstance(condition, dict):
+                for op, operand in condition.items():
+                    if op == "$eq":
+                        mask &= self._bitmap(key, operand)
+                    elif op == "$ne":
+                        mask &= ~self._bitmap(key, operand)
+                    elif op == "$in":
+                        mask &= self._any_of(key, operand)
+                    elif op == "$nin":
+                        mask &= ~self._any_of(key, operand)
+                    else:
+                        raise ValueError(f"unknown operator '{op}' on '{key}'")
+            else:
+                mask &= self._bitmap(key, condition)
+        return mask
+
+    def evaluate(self, where):
+        """
+        Bitmap over chunk ids of the chunks matching a filter.
+
+        Raises:
+            ValueError: If the filter is malformed
+        """
+        key = json.dumps(where, sort_keys=True, default=str)
+        mask = self._filters.get(key)
+        if mask is None:
+            mask = self._evaluate(where)
+            self._filters[key] = mask
+            while len(self._filters) > FILTER_CACHE_SIZE:
+                self._filters.popitem(last=False)
+        else:
+            self._filters.move_to_end(key)
+        return mask
+
+    def save(self, directory, doc_ids):
+        """
+        Write the metadata of ``doc_ids`` into a folder, renumbered by position.
+
+        Files: ``metadata.records.json`` (distinct records and posting
+        keys), ``metadata.codes.npy`` (record of each chunk) and
+        ``metadata.posting_{ids,offsets}.npy`` (postings, concatenated).
+        """
+        directory = Path(directory)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        codes = np.full(len(doc_ids), -1, dtype=np.int32)
+        inside = doc_ids < len(self._codes)
+        codes[inside] = self._codes[doc_ids[inside]]
+
+        order = np.argsort(codes, kind='stable')
+        counts = np.bincount(codes[codes >= 0], minlength=len(self._records)).tolist()
+        start = int(np.count_nonzero(codes < 0))
+        grouped = {}
+        for code, count in enumerate(counts):
+            for pair in self._pairs(self._records[code]):
+                grouped.setdefault(pair, []).append(order[start:start + count])
+            start += count
+        keys = sorted(pair for pair, parts in grouped.items() if sum(len(ids) for ids in parts))
+        postings = [np.sort(np.concatenate(grouped[pair])).astype(np.int32) for pair in keys]
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(ids) for ids in postings], out=offsets[1:])
+
+        np.save(directory / "metadata.codes.npy", codes)
+        np.save(directory / "metadata.posting_ids.npy",
+                np.concatenate(postings) if postings else np.zeros(0, dtype=np.int32))
+        np.save(directory / "metadata.posting_offsets.npy", offsets)
+        with open(directory / "metadata.records.json", 'w', encoding='utf-8') as f:
+            json.dump({
+                "records": [{field: list(values) for field, values in record.items()} for record in self._records],
+                "postings": [list(pair) for pair in keys],
+            }, f)
+
+    @classmethod
+    def load(cls, directory):
+        """
+        Open metadata written by ``save``.
+
+        The arrays are memory-mapped copy-on-write: processes share the
+        file's pages until one of them changes a chunk's metadata.
+
+        Returns:
+            MetadataIndex, or None if the files are missing or unreadable
+        """
+        directory = Path(directory)
+        try:
+            with open(directory / "metadata.records.json", 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            records = [{field: tuple(values) for field, values in record.items()} for record in stored["records"]]
+            keys = [tuple(pair) for pair in stored["postings"]]
+            codes = np.load(directory / "metadata.codes.npy", mmap_mode='c')
+            ids = np.load(directory / "metadata.posting_ids.npy", mmap_mode='c')
+            offsets = np.load(directory / "metadata.posting_offsets.npy")
+        except (OSError, ValueError, KeyError):
+            return None
+        if len(offsets) != len(keys) + 1 or (len(codes) and codes.max() >= len(records)):
+            return None
+        postings = {pair: ids[offsets[i]:offsets[i + 1]] for i, pair in enumerate(keys)}
+        return cls(records, codes, postings)
@@ -0,0 +1,124 @@
+"""Delta-encoded term positions for phrase and proximity matching."""
+from itertools import accumulate
+
+import numpy as np
+
+
+def encode_varints(values):
+    """Encode non-negative integers as LEB128 varints (7 bits per byte, high bit = more follows)."""
+    out = bytearray()
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7F | 0x80)
+            value >>= 7
+        out.append(value)
+    return bytes(out)
+
+
+def decode_varints(data):
+    """Decode LEB128 varints back into an int64 array."""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw < 0x80)
+    if len(ends) == len(raw):
+        # Every value fits in one byte
+        return raw.astype(np.int64)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    # Byte i of a value holds bits 7*i and up
+    shifts = 7 * (np.arange(len(raw)) - np.repeat(starts, ends - starts + 1))
+    return np.add.reduceat((raw & 0x7F).astype(np.int64) << shifts, starts)
+
+
+def encode_document(positions):
+    """
+    Encode one document's term positions.
+
+    The document is written as its number of terms, the gaps between its
+    ascending term ids, each term's number of positions, then each term's
+    gaps between successive positions, so most numbers fit in one byte and
+    the header can be decoded without walking the positions.
+
+    Args:
+        positions: ``{term_id: ascending token positions}``
+
+    Returns:
+        bytes: The encoded document
+    """
+    term_ids = sorted(positions)
+    values = [len(term_ids)]
+    values.extend(term_id - previous for previous, term_id in zip([0] + term_ids, term_ids))
+    values.extend(len(positions[term_id]) for term_id in term_ids)
+    for term_id in term_ids:
+        term_positions = positions[term_id]
+        values.extend(position - previous for previous, position in zip([0] + term_positions, term_positions))
+    return encode_varints(values)
+
+
+def decode_documents(data, offsets, wanted):
+    """
+    Positions of some terms in documents encoded by ``encode_document``.
+
+    Args:
+        data: The encoded documents, concatenated
+        offsets: Where each document starts in ``data``, then the end of the last
+        wanted: ``{term_id: term}`` of the terms to return
+
+    Returns:
+        list: ``{term: ascending positions}`` of the wanted terms in each document
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    raw = np.frombuffer(data, dtype=np.uint8)
+    values = decode_varints(data).tolist()
+    # Every value ends on a byte below 0x80, so counting those finds where each document's values start
+    ends_before = np.concatenate(([0], np.cumsum(raw < 0x80)))
+    found = []
+    for start, end in zip(ends_before[offsets[:-1]].tolist(), ends_before[offsets[1:]].tolist()):
+        document = {}
+        if end > start:
+            count = values[start]
+            header, position_start, term_id = start + count + 1, start + 2 * count + 1, 0
+            for gap, positions in zip(values[start + 1:header], values[header:position_start]):
+                term_id += gap
+                if term_id in wanted:
+                    document[wanted[term_id]] = list(accumulate(values[position_start:position_start + positions]))
+                position_start += positions
+        found.append(document)
+    return found
+
+
+def decode_document(data, wanted):
+    """Positions of some terms in one encoded document, see ``decode_documents``."""
+    return decode_documents(data, [0, len(data)], wanted)[0]
+
+
+def min_distance(first, second):
+    """Smallest gap between a position in one ascending list and one in the other."""
+    i = j = 0
+    best = None
+    while i < len(first) and j < len(second):
+        gap = first[i] - second[j]
+        if gap < 0:
+            gap = -gap
+            i += 1
+        else:
+            j += 1
+        if best is None or gap < best:
+            best = gap
+    return best
+
+
+def contains_phrase(positions, phrase):
+    """
+    True if the terms of a phrase occur at their offsets from one another.
+
+    Args:
+        positions: ``{term: ascending positions}`` in a document
+        phrase: ``(term, offset)`` pairs, offsets relative to the first term
+    """
+    if any(term not in positions for term, _ in phrase):
+        return False
+    first_term, first_offset = phrase[0]
+    others = [(set(positions[term]), offset - first_offset) for term, offset in phrase[1:]]
+    return any(
+        all(start + offset in found for found, offset in others)
+        for start in positions[first_term]
+    )
@@ -0,0 +1,312 @@
+"""Compressed embedding storage: int8 scalar and product quantization."""
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from .metadata import filter_mask
+from .vector_index import DenseVectorIndex, _atomic_save
+
+
+def _kmeans(points, clusters, iterations, rng):
+    """Euclidean k-means; returns ``(clusters, dim)`` float32 centroids."""
+    centroids = points[rng.choice(len(points), clusters, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(points, centroids)
+        counts = np.bincount(labels, minlength=clusters)
+        order = np.argsort(labels, kind='stable')
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        sums = np.add.reduceat(points[order], starts, axis=0)
+        centroids[filled] = sums / counts[filled, None]
+        empty = np.flatnonzero(counts == 0)
+        centroids[empty] = points[rng.choice(len(points), len(empty), replace=False)]
+    return centroids
+
+
+def _nearest(points, centroids):
+    """Index of the nearest centroid (squared Euclidean distance) for every point."""
+    distances = (centroids ** 2).sum(axis=1) - 2 * points @ centroids.T
+    return np.argmin(distances, axis=1)
+
+
+class QuantizedIndex(DenseVectorIndex, ABC):
+    """
+    Dense index that scans compact codes instead of the embedding matrix.
+
+    Every chunk is stored twice: as a small code array that is scanned for
+    each query, and as the float16 matrix of DenseVectorIndex, which stays
+    memory-mapped on disk. With ``rerank`` set, the best ``k * rerank``
+    candidates by code score are re-scored from their full-precision rows,
+    so only those pages of the matrix are ever read. Subclasses define the
+    code format.
+    """
+
+    CODEBOOK_SUFFIX = '.codebook.npy'
+
+    def __init__(self, matrix, doc_ids, codes, codebook, rerank=4):
+        """
+        Initialize the index.
+
+        Args:
+            matrix: ``(n, dim)`` float16 array (memory-mapped, used for reranking)
+            doc_ids: ``(n,)`` int64 chunk ids, one per row
+            codes: ``(n, code_size)`` uint8 codes (memory-mapped)
+            codebook: Quantizer parameters written by ``train``
+            rerank: Shortlist multiplier for full-precision reranking (0 = off)
+        """
+        super().__init__(matrix, doc_ids)
+        self.codes = codes
+        self.codebook = codebook
+        self.rerank = rerank
+
+    @property
+    def bytes_per_vector(self):
+        return self.codes.shape[1]
+
+    @classmethod
+    def _code_paths(cls, path):
+        matrix_path = DenseVectorIndex._paths(path)[0]
+        return matrix_path.with_suffix('.codes.npy'), matrix_path.with_suffix(cls.CODEBOOK_SUFFIX)
+
+    @classmethod
+    @abstractmethod
+    def train(cls, vectors, **options):
+        """Fit the quantizer parameters to a sample of vectors."""
+
+    @classmethod
+    @abstractmethod
+    def encode(cls, vectors, codebook):
+        """Compress ``(n, dim)`` vectors into ``(n, code_size)`` uint8 codes."""
+
+    @abstractmethod
+    def _code_scores(self, codes, query):
+        """Approximate similarity of the query to a block of codes."""
+
+    @classmethod
+    def build(cls, path, doc_ids, vectors, manifest, rerank=4, **options):
+        """
+        Train the quantizer, write codes and full vectors, and open the index.
+
+        Args:
+            path: Destination ``.npy`` file for the full-precision matrix
+            doc_ids: Chunk id for each row of ``vectors``
+            vectors: ``(n, dim)`` unit-length embeddings
+            manifest: JSON-serialisable description used to validate reloads
+            rerank: Shortlist multiplier for full-precision reranking (0 = off)
+            **options: Quantizer settings passed to ``train``
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            raise ValueError("cannot train a quantizer without vectors")
+        codebook = cls.train(vectors, **options)
+        codes = np.concatenate([
+            cls.encode(vectors[start:start + cls.BLOCK_ROWS], codebook)
+            for start in range(0, len(vectors), cls.BLOCK_ROWS)
+        ])
+        codes_path, codebook_path = cls._code_paths(path)
+        codes_path.parent.mkdir(parents=True, exist_ok=True)
+        # Column-major on disk: each code position is contiguous within a block of rows
+        _atomic_save(codes_path, np.asfortranarray(codes))
+        _atomic_save(codebook_path, codebook)
+        # The manifest is written last, so a half-written index never validates
+        DenseVectorIndex.build(path, doc_ids, vectors, manifest)
+        return cls.load(path, manifest, rerank)
+
+    @classmethod
+    def load(cls, path, manifest=None, rerank=4):
+        """
+        Open an index written by ``build``.
+
+        Returns:
+            The index, or None if missing or if ``manifest`` does not match
+        """
+        base = DenseVectorIndex.load(path, manifest)
+        if base is None:
+            return None
+        codes_path, codebook_path = cls._code_paths(path)
+        try:
+            codes = np.load(codes_path, mmap_mode='r')
+            codebook = np.load(codebook_path)
+        except (OSError, ValueError):
+            return None
+        if len(codes) != len(base.doc_ids):
+            return None
+        return cls(base.matrix, base.doc_ids, codes, codebook, rerank)
+
+    def search(self, query_vector, k=4, rerank=None, allowed=None):
+        """
+        Find the chunks most similar to a query embedding.
+
+        Args:
+            query_vector: Unit-length query embedding
+            k: Number of results
+            rerank: Override of ``self.rerank`` for this query
+            allowed: Optional filter bitmap over chunk ids
+
+        Returns:
+            list: ``(doc_id, score)`` pairs, best first
+        """
+        if k <= 0:
+            return []
+        query = np.asarray(query_vector, dtype=np.float32)
+        rerank = self.rerank if rerank is None else rerank
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), self.BLOCK_ROWS):
+            block = np.asarray(self.codes[start:start + self.BLOCK_ROWS])
+            scores[start:start + len(block)] = self._code_scores(block, query)
+        if self._deleted_mask is not None:
+            scores[self._deleted_mask] = -np.inf
+        if allowed is not None:
+            scores[~filter_mask(allowed, self.doc_ids)] = -np.inf
+
+        shortlist = min(k * rerank if rerank else k, len(scores))
+        rows = np.argpartition(-scores, shortlist - 1)[:shortlist] if shortlist else np.zeros(0, dtype=np.int64)
+        rows = rows[np.isfinite(scores[rows])]
+        if rerank:
+            rows.sort()  # Sequential page access on the memory-mapped matrix
+            row_scores = np.asarray(self.matrix[rows], dtype=np.float32) @ query
+        else:
+            row_scores = scores[rows]
+        doc_ids = self.doc_ids[rows]
+
+        extra_ids, extra_vectors = self._overlay(allowed)
+        if len(extra_ids):
+            doc_ids = np.concatenate([doc_ids, extra_ids])
+            row_scores = np.concatenate([row_scores, extra_vectors @ query])
+        if len(row_scores) == 0:
+            return []
+        k = min(k, len(row_scores))
+        top = np.argpartition(-row_scores, k - 1)[:k]
+        top = top[np.argsort(-row_scores[top], kind='stable')]
+        return [(int(doc_ids[i]), float(row_scores[i])) for i in top]
+
+    def search_many(self, query_vectors, k=4, rerank=None, allowed=None):
+        """Search a batch of query embeddings, one shortlist and rerank per query."""
+        return [self.search(query, k, rerank=rerank, allowed=allowed) for query in query_vectors]
+
+    def exact_search(self, query_vector, k=4, allowed=None):
+        """Brute-force search over the full-precision matrix, the ground truth for ``search``."""
+        return DenseVectorIndex.search(self, query_vector, k, allowed)
+
+
+class ScalarQuantizedIndex(QuantizedIndex):
+    """
+    int8 scalar quantization: one byte per dimension (4x smaller than float32).
+
+    Each dimension is mapped linearly onto 0-255 between its observed
+    minimum and maximum, so a query scores ``codes @ (q * scale) + q . low``
+    without decoding the vectors.
+    """
+
+    @classmethod
+    def train(cls, vectors, **options):
+        low = vectors.min(axis=0)
+        scale = np.maximum(vectors.max(axis=0) - low, 1e-12) / 255.0
+        return np.stack([low, scale]).astype(np.float32)
+
+    @classmethod
+    def encode(cls, vectors, codebook):
+        low, scale = codebook
+        return np.clip(np.rint((vectors - low) / scale), 0, 255).astype(np.uint8)
+
+    def _code_scores(self, codes, query):
+        low, scale = self.codebook
+        return codes.astype(np.float32) @ (query * scale) + float(query @ low)
+
+
+class ProductQuantizedIndex(QuantizedIndex):
+    """
+    Product quantization with asymmetric distance computation (ADC).
+
+    Vectors are cut into ``subspaces`` equal slices and each slice is
+    replaced by the id of its nearest of 256 k-means centroids, so a vector
+    costs one byte per subspace (16x smaller than float32 with the default
+    of 4 dimensions per subspace). A query is never quantized: its dot
+    product with every centroid is tabulated once, and a code's score is the
+    sum of its table entries.
+    """
+
+    CENTROIDS = 256
+
+    @classmethod
+    def train(cls, vectors, subspaces=0, iterations=15, sample_size=16384, seed=0):
+        """
+        Args:
+            subspaces: Number of slices, must divide the dimension (0 = dimension / 4)
+            iterations: k-means iterations per subspace
+            sample_size: Vectors used for training
+            seed: Random seed, so rebuilds are reproducible
+        """
+        dim = vectors.shape[1]
+        subspaces = subspaces or max(1, dim // 4)
+        if dim % subspaces:
+            raise ValueError(f"{subspaces} subspaces do not divide dimension {dim}")
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample_size:
+            vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+        clusters = min(cls.CENTROIDS, len(vectors))
+        width = dim // subspaces
+        codebook = np.zeros((subspaces, cls.CENTROIDS, width), dtype=np.float32)
+        for j in range(subspaces):
+            codebook[j, :clusters] = _kmeans(vectors[:, j * width:(j + 1) * width], clusters, iterations, rng)
+            # Unused slots (tiny corpora) repeat a real centroid so no code points at zeros
+            codebook[j, clusters:] = codebook[j, 0]
+        return codebook
+
+    @classmethod
+    def encode(cls, vectors, codebook):
+        subspaces, _, width = codebook.shape
+        codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+        for j in range(subspaces):
+            codes[:, j] = _nearest(vectors[:, j * width:(j + 1) * width], codebook[j])
+        return codes
+
+    def _code_scores(self, codes, query):
+        subspaces, _, width = self.codebook.shape
+        table = np.einsum('jcw,jw->jc', self.codebook, query.reshape(subspaces, width))
+        scores = np.zeros(len(codes), dtype=np.float32)
+        for j, column in enumerate(codes.T):
+            scores += table[j].take(column)
+        return scores
+
+
+def quantization_report(index, queries, k=10, reranks=(0, 4)):
+    """
+    Measure memory, recall@k and latency of a quantized index against exact search.
+
+    Args:
+        index: QuantizedIndex to evaluate
+        queries: ``(q, dim)`` query embeddings (indexed vectors work well)
+        k: Cut-off for recall
+        reranks: Shortlist multipliers to try (0 = no reranking)
+
+    Returns:
+        dict: Bytes per vector, compression versus float32 and, per
+        rerank setting, recall and latency
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    start = time.perf_counter()
+    truth = [{doc_id for doc_id, _ in index.exact_search(q, k)} for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+
+    report = {
+        "k": k,
+        "queries": len(queries),
+        "bytes_per_vector": index.bytes_per_vector,
+        "compression": round(index.dimension * 4 / index.bytes_per_vector, 1),
+        "exact_ms": round(exact_ms, 3),
+        "rerank": [],
+    }
+    for rerank in reranks:
+        found = 0
+        start = time.perf_counter()
+        for q, expected in zip(queries, truth):
+            found += len(expected & {doc_id for doc_id, _ in index.search(q, k, rerank)})
+        elapsed_ms = (time.perf_counter() - start) * 1000 / max(len(queries), 1)
+        report["rerank"].append({
+            "rerank": rerank,
+            "recall": round(found / max(sum(len(t) for t in truth), 1), 4),
+            "ms": round(elapsed_ms, 3),
+        })
+    return report
@@ -1,41 +1,262 @@
 """RAG retriever for soybean farming knowledge."""
+import hashlib
+import math
 import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from itertools import islice
+from pathlib import Path
 
-try:
-    import chromadb
-    # Try newer packages first
+import numpy as np
+
+from config import Config
+from .ann_index import IVFIndex, recall_report
+from .chroma_index import ChromaVectorIndex, corpus_collection_name
+from .chunker import TokenChunker
+from .dedup import NearDuplicateFilter
+from .embeddings import SENTENCE_TRANSFORMERS_AVAILABLE, EmbeddingCache, SentenceEmbedder
+from .fusion import reciprocal_rank_fusion
+from .knowledge_cache import KnowledgeCache, file_digest
+from .knowledge_loader import KnowledgeLoader
+from .knowledge_pack import KnowledgePack, resolve_pack
+from .knowledge_watcher import KnowledgeWatcher
+from .lexical_index import BM25Index, correct_query, phrases, tokenize, unquote
+from .metadata import GENERAL_TOPIC, MetadataIndex, chunk_metadata, source_metadata
+from .quantization import ProductQuantizedIndex, QuantizedIndex, ScalarQuantizedIndex, quantization_report
+from .result_cache import RetrievalCache
+from .text_store import TextStore
+from .vector_index import DenseVectorIndex
+from ..reasoning.react_agent import detect_topics
+
+
+BUILTIN_SOURCE = "builtin"
+
+# Hybrid mode fetches this many candidates per requested result from each stage
+HYBRID_CANDIDATES_PER_RESULT = 4
+# Dense searches can outlive their query's budget; spare threads keep them from delaying the next query
+HYBRID_STAGE_THREADS = 4
+QUANTIZED_INDEXES = {"int8": ScalarQuantizedIndex, "pq": ProductQuantizedIndex}
+
+
+def routing_score(query, texts, stats):
+    """
+    Share of a query's BM25 idf weight that its topic-routed results contain.
+
+    Terms no chunk holds are left out, since no partition could match
+    them; 1.0 when nothing is left.
+
+    Args:
+        query: Search query
+        texts: Text of the routed hits
+        stats: ``collection_stats`` covering the query's terms
+    """
+    documents, _, frequencies = stats
+    weights = {}
+    for term in set(tokenize(query)):
+        df = frequencies.get(term, 0)
+        if df:
+            weights[term] = math.log(1 + (documents - df + 0.5) / (df + 0.5))
+    total = sum(weights.values())
+    if not total:
+        return 1.0
+    found = set()
+    for text in texts:
+        found.update(tokenize(text))
+    return sum(weight for term, weight in weights.items() if term in found) / total
+
+
+def shard_of(source, knowledge_dir, count):
+    """Shard holding a knowledge source: built-in facts go to shard 0, files by a hash of their relative path."""
+    if source == BUILTIN_SOURCE or count <= 1:
+        return 0
     try:
-        from langchain_chroma import Chroma
-        from langchain_huggingface import HuggingFaceEmbeddings
-    except ImportError:
-        # Fallback to older packages
-        from langchain_community.vectorstores import Chroma
-        try:
-            from langchain_huggingface import HuggingFaceEmbeddings
-        except ImportError:
-            from langchain_community.embeddings import HuggingFaceEmbeddings
-    CHROMADB_AVAILABLE = True
-except ImportError as e:
-    print(f"⚠️  ChromaDB not available: {e}")
-    print("   Using simple knowledge base instead")
-    CHROMADB_AVAILABLE = False
+        name = Path(source).resolve().relative_to(Path(knowledge_dir).resolve()).as_posix()
+    except ValueError:
+        name = Path(source).name
+    return int(hashlib.sha1(name.encode('utf-8')).hexdigest(), 16) % count
+
+
+def dense_manifest(corpus, count):
+    """Manifest identifying a dense index of ``count`` chunks built with the configured model and index type."""
+    index_type = Config.VECTOR_INDEX_TYPE if count else "exact"
+    if index_type == "chroma":
+        # Chroma keeps its own store; this matrix is the fallback when it is unavailable
+        index_type = "exact"
+    manifest = {"model": Config.EMBEDDING_MODEL, "corpus": corpus, "index": index_type}
+    if index_type == "ivf":
+        manifest["nlist"] = Config.ANN_NLIST
+    elif index_type in QUANTIZED_INDEXES:
+        manifest["subspaces"] = Config.PQ_SUBSPACES
+    return manifest
+
+
+def load_dense_index(path, manifest):
+    """Open the dense index described by ``manifest``, or None if it is missing or stale."""
+    index_type = manifest["index"]
+    if index_type == "ivf":
+        return IVFIndex.load(path, manifest, Config.ANN_NPROBE)
+    if index_type in QUANTIZED_INDEXES:
+        return QUANTIZED_INDEXES[index_type].load(path, manifest, Config.VECTOR_RERANK)
+    return DenseVectorIndex.load(path, manifest)
+
+
+def build_dense_index(path, doc_ids, vectors, manifest):
+    """Write the dense index described by ``manifest``."""
+    index_type = manifest["index"]
+    if index_type == "ivf":
+        index = IVFIndex.build(path, doc_ids, vectors, manifest, nlist=Config.ANN_NLIST, nprobe=Config.ANN_NPROBE)
+    elif index_type in QUANTIZED_INDEXES:
+        index = QUANTIZED_INDEXES[index_type].build(
+            path, doc_ids, vectors, manifest, rerank=Config.VECTOR_RERANK, subspaces=Config.PQ_SUBSPACES
+        )
+    else:
+        index = DenseVectorIndex.build(path, doc_ids, vectors, manifest)
+    return index
+
+
+def dense_index_report(index, vectors=None, samples=100):
+    """
+    Print and return how closely an approximate dense index matches exact search.
+
+    Each sampled vector is also searched exhaustively, a full scan of the
+    matrix, so this is for offline tools (the pack build and the
+    benchmark) rather than index builds inside API workers.
+
+    Args:
+        index: Dense index to check
+        vectors: The indexed ``(n, dim)`` vectors (default: the index's matrix);
+            every ``n // samples``-th row is used as a query
+        samples: Number of query vectors
+
+    Returns:
+        dict: The recall report, or None for an exact index
+    """
+    if not isinstance(index, (IVFIndex, QuantizedIndex)):
+        return None
+    vectors = index.matrix if vectors is None else vectors
+    sample = np.asarray(vectors[::max(1, len(vectors) // samples)][:samples], dtype=np.float32)
+    if isinstance(index, QuantizedIndex):
+        report = quantization_report(index, sample, k=10, reranks=[index.rerank])
+        probe = report["rerank"][0]
+        print(f"   🎯 {type(index).__name__} codes {report['compression']}x smaller, recall@10 "
+              f"{probe['recall']:.3f} with rerank={probe['rerank']} "
+              f"({probe['ms']:.2f} ms vs {report['exact_ms']:.2f} ms exact)")
+        return report
+    report = recall_report(index, sample, k=10, nprobes=[index.nprobe])
+    probe = report["nprobe"][0]
+    print(f"   🎯 IVF recall@10 {probe['recall']:.3f} at nprobe={probe['nprobe']}/"
+          f"{report['nlist']} ({probe['ms']:.2f} ms vs {report['exact_ms']:.2f} ms exact)")
+    return report
 
 
 class RAGRetriever:
-    """Retrieves relevant soybean farming knowledge."""
+    """
+    Retrieves relevant soybean farming knowledge.
     
-    def __init__(self, persist_directory="./data/chromadb"):
-        """Initialize the RAG retriever."""
-        self.persist_directory = persist_directory
-        self.knowledge_base = self._get_initial_knowledge()
+    Chunks are tracked per source file so single documents can be added,
+    updated or removed while the API is running. Index changes and queries
+    share a lock, so a query always sees the index before or after an
+    update, never half of one.
+    
+    Every chunk carries metadata (source, language, region, crop stage,
+    farming topic, plus any field set in ``_metadata.json`` /
+    ``<file>.meta.json`` files) that ``retrieve`` can filter on. Queries
+    naming one or two farming topics only search the chunks tagged with
+    them (and untagged ``general`` chunks), falling back to the whole
+    index when that finds too little or finds chunks missing most of the
+    query's rarer words. Misspelled query words ("soyabean",
+    "mildue") are searched as the closest indexed terms.
+    """
+    
+    def __init__(self, persist_directory=None, knowledge_dir=None, knowledge_pack=None, shard=None,
+                 retrieval_mode=None):
+        """
+        Initialize the RAG retriever.
+        
+        Args:
+            persist_directory: Chroma store for VECTOR_INDEX_TYPE=chroma (default: Config.CHROMADB_PATH)
+            knowledge_dir: Folder of knowledge files (default: data/knowledge)
+            knowledge_pack: Prebuilt pack to serve (default: Config.KNOWLEDGE_PACK_PATH,
+                "" to always index the raw files)
+            shard: ``(index, count)`` to index only the files of one shard (see ShardedRetriever)
+            retrieval_mode: "lexical", "dense" or "hybrid" (default: Config.RETRIEVAL_MODE)
+        """
+        self.shard = shard
+        self.persist_directory = persist_directory or Config.CHROMADB_PATH
+        self.knowledge_dir = Path(knowledge_dir or Path(__file__).parent.parent.parent / "data" / "knowledge")
+        self.loader = KnowledgeLoader(
+            KnowledgeCache(Config.KNOWLEDGE_CACHE_DIR),
+            workers=Config.KNOWLEDGE_WORKERS,
+            pages_per_task=Config.KNOWLEDGE_PDF_PAGES_PER_TASK
+        )
+        self.ingestion_report = []
+        
+        self._lock = threading.RLock()
+        self.knowledge_version = 0
+        self.knowledge_base = TextStore()  # chunk text by id, None once removed
+        self.chunk_sources = []
+        self._source_chunks = {}
+        self.lexical_index = BM25Index()
+        self.metadata_index = MetadataIndex()
+        self.embedder = None
+        self.dense_index = None
+        self.chunker = TokenChunker(Config.CHUNK_MAX_TOKENS, Config.CHUNK_OVERLAP_TOKENS)
+        self._duplicates = NearDuplicateFilter(Config.DEDUP_SIMILARITY)
+        self.duplicates_dropped = 0
+        self._shadowed = {}  # source -> [(text, ids of the other sources' chunks it duplicates)]
         
-        # Disable ChromaDB for now due to compatibility issues
-        # Use reliable keyword search instead
-        print("🔍 Using keyword-based search (ChromaDB disabled for stability)")
-        self.use_vector_store = False
+        # A prebuilt knowledge pack replaces parsing and indexing the raw files
+        self.pack_path = Config.KNOWLEDGE_PACK_PATH if knowledge_pack is None else knowledge_pack
+        self.knowledge_pack = KnowledgePack.open(self.pack_path) if self.pack_path else None
+        if self.knowledge_pack is not None:
+            state = self._read_pack(self.knowledge_pack)
+            self.knowledge_base, self.chunk_sources, self._source_chunks = state[:3]
+            self.lexical_index, self.metadata_index, self.loader.fingerprints = state[3:]
+            self._duplicates = None
+            self.knowledge_version += 1
+            print(f"📦 Loaded knowledge pack {self.knowledge_pack.version} ({len(self.knowledge_pack)} chunks)")
+        else:
+            for source, paragraphs in self._get_initial_knowledge():
+                try:
+                    chunks = self._prepare_chunks(source, paragraphs)
+                except ValueError:
+                    # A PDF with no readable page; the loader has reported it
+                    continue
+                self.replace_source(source, chunks)
+        if self.duplicates_dropped:
+            print(f"🧹 Dropped {self.duplicates_dropped} duplicate knowledge chunks")
+        
+        # Built-in dense index (memory-mapped NumPy matrix, no server process)
+        self.retrieval_mode = Config.RETRIEVAL_MODE if retrieval_mode is None else retrieval_mode
+        self.last_timings = {}
+        # low_score: routed results missing most of the query's weight, searched again globally
+        self.routing_stats = {"routed": 0, "global": 0, "fallback": 0, "low_score": 0}
+        self.result_cache = None
+        if Config.RETRIEVAL_CACHE_SIZE > 0 and Config.RETRIEVAL_CACHE_TTL > 0:
+            self.result_cache = RetrievalCache(Config.RETRIEVAL_CACHE_SIZE, Config.RETRIEVAL_CACHE_TTL)
+        self._stage_pool = None
+        if self.retrieval_mode in ("dense", "hybrid"):
+            self._init_dense_index()
+        if self.retrieval_mode == "hybrid" and self.dense_index is not None:
+            self._stage_pool = ThreadPoolExecutor(max_workers=HYBRID_STAGE_THREADS, thread_name_prefix="retrieval")
+        
+        store = " (Chroma)" if isinstance(self.dense_index, ChromaVectorIndex) else ""
+        if self._stage_pool is not None:
+            print(f"🔍 Using hybrid keyword + vector search{store}")
+        elif self.dense_index is not None:
+            print(f"🔍 Using dense vector search{store}")
+        else:
+            print("🔍 Using keyword-based search")
 
     def _get_initial_knowledge(self):
-        """Get initial soybean farming knowledge base."""
+        """
+        Get initial soybean farming knowledge base.
+        
+        Yields ``(source, paragraphs)`` one source at a time, so a file's
+        paragraphs can be chunked while the next file is still extracting.
+        """
         # Built-in knowledge
         builtin_knowledge = [
             "Soybeans grow best in temperatures between 20°C and 30°C.",
@@ -50,148 +271,743 @@ class RAGRetriever:
             "Harvest when leaves turn yellow and pods are dry."
         ]
         
+        if self.owns(BUILTIN_SOURCE):
+            yield BUILTIN_SOURCE, builtin_knowledge
+        
         # Try to load knowledge from PDF/text files
         try:
-            from pathlib import Path
-            knowledge_dir = Path(__file__).parent.parent.parent / "data" / "knowledge"
-            
-            if knowledge_dir.exists():
-                file_knowledge = self._load_files_from_directory(knowledge_dir)
-                if file_knowledge:
-                    print(f"✅ Loaded {len(file_knowledge)} knowledge items from files")
-                    return builtin_knowledge + file_knowledge
+            if self.knowledge_dir.exists():
+                for path, paragraphs in self._load_files_from_directory(self.knowledge_dir):
+                    yield str(path), paragraphs
+                total = sum(entry["paragraphs"] for entry in self.ingestion_report)
+                if total:
+                    print(f"✅ Loaded {total} knowledge items from files")
         except Exception as e:
             print(f"⚠️  Could not load knowledge files: {e}")
-        
-        return builtin_knowledge
     
     def _load_files_from_directory(self, directory):
-        """Load knowledge from text, markdown, and PDF files."""
-        knowledge = []
+        """
+        Load knowledge from text, markdown, and PDF files.
+        Unchanged files are served from the parsed-knowledge cache and
+        PDFs are extracted across a process pool.
+        
+        Yields:
+            tuple: ``(file_path, paragraphs)``, see KnowledgeLoader.load
+        """
+        yield from self.loader.load(directory, include=self.owns)
+        self.ingestion_report = self.loader.report
+
+    def _init_dense_index(self):
+        """Open the dense index, rebuilding it if the corpus or model changed."""
+        if not SENTENCE_TRANSFORMERS_AVAILABLE:
+            print("⚠️  Dense retrieval needs sentence-transformers; using keyword search")
+            return
         
-        # Load text and markdown files
-        for ext in ['.txt', '.md']:
-            for file_path in directory.rglob(f'*{ext}'):
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read().strip()
-                        if content:
-                            # Split into paragraphs
-                            paragraphs = [p.strip() for p in content.split('\n\n') if p.strip()]
-                            knowledge.extend(paragraphs)
-                            print(f"   📄 Loaded: {file_path.name}")
-                except Exception as e:
-                    print(f"   ❌ Error loading {file_path.name}: {e}")
-        
-        # Try to load PDF files if pypdf2 is available
         try:
-            import PyPDF2
-            for pdf_path in directory.rglob('*.pdf'):
-                try:
-                    with open(pdf_path, 'rb') as f:
-                        pdf_reader = PyPDF2.PdfReader(f)
-                        text = ""
-                        for page in pdf_reader.pages:
-                            text += page.extract_text() + "\n"
-                        
-                        if text.strip():
-                            # Split into paragraphs
-                            paragraphs = [p.strip() for p in text.split('\n\n') if p.strip() and len(p) > 50]
-                            knowledge.extend(paragraphs)
-                            print(f"   📄 Loaded PDF: {pdf_path.name} ({len(pdf_reader.pages)} pages)")
-                except Exception as e:
-                    print(f"   ❌ Error loading PDF {pdf_path.name}: {e}")
-        except ImportError:
-            pdf_files = list(directory.rglob('*.pdf'))
-            if pdf_files:
-                print(f"   ⚠️  Found {len(pdf_files)} PDF files but PyPDF2 not installed")
-                print(f"   💡 Install with: pip install pypdf2")
-        
-        return knowledge
-
-    def add_documents(self, documents):
-        """Add documents to the vector store."""
-        if self.use_vector_store:
-            self.vector_store.add_documents(documents)
-
-    def retrieve(self, query, k=4):
+            self.embedder = SentenceEmbedder(
+                Config.EMBEDDING_MODEL,
+                cache=EmbeddingCache(Config.EMBEDDING_CACHE_PATH),
+                query_cache_size=Config.QUERY_EMBEDDING_CACHE_SIZE
+            )
+            with self._lock:
+                self.dense_index = self._open_dense_index(self.knowledge_base, self.knowledge_pack, self.metadata_index)
+            print(f"✅ Dense index ready ({len(self.dense_index)} vectors)")
+        except Exception as e:
+            print(f"⚠️  Could not build dense index: {e}")
+            print("   Continuing with keyword search")
+            self.embedder = None
+            self.dense_index = None
+
+    def _open_dense_index(self, texts, pack=None, metadata_index=None):
         """
-        Retrieve relevant documents for a query.
-        Prioritizes knowledge from PDF files.
+        Load the dense index for a corpus, or embed the corpus and build it.
+        A pack's own embeddings are used when they match the configured model and index type.
+        """
+        if Config.VECTOR_INDEX_TYPE == "chroma":
+            index = self._open_chroma_index(texts, metadata_index)
+            if index is not None:
+                return index
+        if pack is not None:
+            # Called right after the pack is opened, so every chunk is live
+            doc_ids = list(range(len(pack)))
+            corpus = f"pack:{pack.version}"
+        else:
+            doc_ids = list(texts.live_ids())
+            digest = hashlib.sha256()
+            for doc_id in doc_ids:
+                digest.update(f"{doc_id}\0{texts[doc_id]}\0".encode('utf-8'))
+            corpus = digest.hexdigest()
+        manifest = dense_manifest(corpus, len(doc_ids))
+        
+        index = None
+        if pack is not None and pack.embeddings_path is not None:
+            index = load_dense_index(pack.embeddings_path, manifest)
+        if index is None:
+            index = load_dense_index(Config.VECTOR_INDEX_PATH, manifest)
+        if index is None:
+            print(f"🧮 Embedding {len(doc_ids)} knowledge chunks...")
+            vectors = self.embedder.encode([texts[i] for i in doc_ids])
+            print(f"   📦 {self.embedder.stats['chunk_hits']} embeddings reused from cache")
+            index = build_dense_index(Config.VECTOR_INDEX_PATH, doc_ids, vectors, manifest)
+        return index
+
+    def _open_chroma_index(self, texts, metadata_index):
+        """
+        Open the Chroma collection and bring it in line with the corpus.
+        Returns None (after a warning) if Chroma is unavailable, so the built-in index is used instead.
+        """
+        def chunk(doc_id):
+            return texts[doc_id], metadata_index.metadata(doc_id)
+        
+        # Scoped by knowledge folder, so syncing this corpus never deletes another corpus's records
+        collection_name = corpus_collection_name(Config.CHROMA_COLLECTION, self.knowledge_dir.resolve())
+        try:
+            index = ChromaVectorIndex.open(
+                chunk, Config.EMBEDDING_MODEL,
+                path=self.persist_directory, host=Config.CHROMA_HOST, port=Config.CHROMA_PORT,
+                collection_name=collection_name, batch_size=Config.CHROMA_BATCH_SIZE
+            )
+            written, deleted = index.sync(texts.live_ids(), self.embedder.encode)
+        except Exception as e:
+            print(f"⚠️  Chroma store unavailable ({e}); using the built-in vector index")
+            return None
+        if written or deleted:
+            print(f"🗄️  Chroma collection updated (+{written}/-{deleted} chunks)")
+        return index
+
+    def _read_pack(self, pack):
+        """
+        Chunk state of a knowledge pack.
+        
+        Pack sources are stored relative to the knowledge folder and are
+        mapped onto this machine's folder. Deploys copy files without their
+        mtimes, so a local file whose content hash matches the pack's record
+        is treated as unchanged by the watcher; any other file keeps the
+        pack's fingerprint and is re-indexed on the first scan.
+        
+        Returns:
+            tuple: (texts, chunk sources, per-source chunk ids, lexical index,
+                metadata index, fingerprints)
         """
-        if self.use_vector_store:
+        lexical_index = pack.lexical_index()
+        if lexical_index is None:
+            raise ValueError(f"knowledge pack {pack.version} has no readable lexical index")
+        metadata_index = pack.metadata_index()
+        if metadata_index is None:
+            raise ValueError(f"knowledge pack {pack.version} has no readable chunk metadata")
+        
+        def local(name):
+            return name if name == BUILTIN_SOURCE else str(self.knowledge_dir / name)
+        
+        # Text and sources stay in the memory-mapped pack; only live changes are held per process
+        texts = pack.texts()
+        sources = pack.sources(local)
+        source_chunks = pack.source_chunks(local)
+        
+        fingerprints = {}
+        digests = pack.digests
+        for name, (size, mtime_ns) in pack.fingerprints.items():
+            path = local(name)
             try:
-                # Retrieve more results to ensure we get PDF content
-                results = self.vector_store.similarity_search(query, k=k*2)
-                return [{"page_content": doc.page_content} for doc in results[:k]]
-            except Exception as e:
-                print(f"⚠️  Vector search failed: {e}")
-        
-        # Fallback to keyword matching
-        query_lower = query.lower()
-        query_words = [w for w in query_lower.split() if len(w) > 3]  # Filter short words
-        
-        # Score each knowledge item
-        scored_items = []
-        for knowledge in self.knowledge_base:
-            knowledge_lower = knowledge.lower()
-            score = sum(1 for word in query_words if word in knowledge_lower)
-            if score > 0:
-                scored_items.append((score, knowledge))
-        
-        # Sort by relevance score
-        scored_items.sort(reverse=True, key=lambda x: x[0])
-        
-        # Return top k results
-        relevant = [{"page_content": item[1]} for item in scored_items[:k]]
+                stat = os.stat(path)
+                # The hash is only read when the size matches but the mtime does not
+                unchanged = (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns) or (
+                    stat.st_size == size and name in digests and file_digest(path) == digests[name]
+                )
+            except OSError:
+                unchanged = False
+            fingerprints[path] = (stat.st_size, stat.st_mtime_ns) if unchanged else (size, mtime_ns)
+        return texts, sources, source_chunks, lexical_index, metadata_index, fingerprints
+
+    def reload_pack(self):
+        """
+        Switch to the pack that ``pack_path`` points at now, if it changed.
         
-        # If no matches, return some default knowledge
-        if not relevant:
-            relevant = [{"page_content": self.knowledge_base[i]} for i in range(min(k, len(self.knowledge_base)))]
+        Deploys publish a new version by swapping the ``current`` symlink;
+        queries are served from the old pack until the new one is open.
         
-        return relevant
+        Returns:
+            bool: True if a new pack was loaded
+        """
+        if not self.pack_path:
+            return False
+        pack_dir = resolve_pack(self.pack_path)
+        if pack_dir is None or (self.knowledge_pack is not None and pack_dir == self.knowledge_pack.path):
+            return False
+        pack = KnowledgePack.open(pack_dir)
+        if pack is None:
+            return False
+        
+        texts, sources, source_chunks, lexical_index, metadata_index, fingerprints = self._read_pack(pack)
+        dense_index = self._open_dense_index(texts, pack, metadata_index) if self.dense_index is not None else None
+        with self._lock:
+            self.knowledge_pack = pack
+            self.knowledge_base, self.chunk_sources, self._source_chunks = texts, sources, source_chunks
+            self.lexical_index = lexical_index
+            self.metadata_index = metadata_index
+            if dense_index is not None:
+                self.dense_index = dense_index
+            self._duplicates = None
+            self._shadowed = {}
+            self.loader.fingerprints = fingerprints
+            self.knowledge_version += 1
+        print(f"📦 Switched to knowledge pack {pack.version} ({len(pack)} chunks)")
+        return True
 
-    def load_initial_knowledge(self):
-        """Load initial knowledge into vector store."""
-        if not self.use_vector_store or not self.knowledge_base:
-            return
+    @property
+    def duplicates(self):
+        """
+        Near-duplicate filter over the indexed chunks.
+        
+        A pack's chunks are only added on the first live change, so
+        serving a pack never decodes its whole text, and uploads are
+        still checked against the pack.
+        """
+        with self._lock:
+            if self._duplicates is None:
+                self._duplicates = NearDuplicateFilter(Config.DEDUP_SIMILARITY)
+                for doc_id in self.knowledge_base.live_ids():
+                    self._duplicates.add(doc_id, self.knowledge_base[doc_id])
+            return self._duplicates
+
+    @property
+    def source_fingerprints(self):
+        """``{path: (size, mtime_ns)}`` of the files currently indexed."""
+        return self.loader.fingerprints
+
+    def _prepare_chunks(self, source, paragraphs):
+        """
+        Chunk a file's paragraphs by token count and drop chunks that
+        duplicate text from other sources or earlier in the same file.
+        Built-in facts are already fact-sized and are kept as they are.
+        
+        Chunks dropped as copies of another source's chunks are kept
+        aside and indexed again if those chunks are removed (see
+        ``replace_source``), so removing a file never loses text that
+        only a copy still holds.
+        """
+        chunks = paragraphs if source == BUILTIN_SOURCE else self.chunker.chunk(paragraphs)
+        local = NearDuplicateFilter(self.duplicates.threshold)
+        unique, shadowed = [], []
+        with self._lock:
+            own = set(self._source_chunks.get(source, []))
+            for text in chunks:
+                if local.matches(text):
+                    self.duplicates_dropped += 1
+                    continue
+                # The source's current chunks are being replaced, so they don't count
+                owners = self.duplicates.matches(text) - own
+                if owners:
+                    self.duplicates_dropped += 1
+                    shadowed.append((text, owners))
+                    continue
+                local.add(len(unique), text)
+                unique.append(text)
+            if shadowed:
+                self._shadowed[source] = shadowed
+            else:
+                self._shadowed.pop(source, None)
+        return unique
+
+    def replace_source(self, source, paragraphs):
+        """
+        Make a source's chunks match ``paragraphs``.
+        
+        Chunks whose text is unchanged keep their ids and postings; only
+        removed and new chunks touch the index. Metadata is re-read for
+        every chunk, so edited metadata files apply on the next re-index.
+        Chunks of other sources that were dropped as copies of a removed
+        chunk, and are no copy of any other chunk, are indexed again.
+        
+        Returns:
+            tuple: (chunks added, chunks removed)
+        """
+        base_metadata = source_metadata(source, self.knowledge_dir, BUILTIN_SOURCE)
+        # Embed new text before taking the lock so queries are not blocked by the encoder
+        new_vectors = {}
+        if self.dense_index is not None:
+            with self._lock:
+                indexed = {self.knowledge_base[i] for i in self._source_chunks.get(source, [])}
+            new_texts = list(dict.fromkeys(text for text in paragraphs if text not in indexed))
+            new_vectors = dict(zip(new_texts, self.embedder.encode(new_texts)))
+        
+        with self._lock:
+            wanted = Counter(paragraphs)
+            kept, removed = [], []
+            for doc_id in self._source_chunks.get(source, []):
+                text = self.knowledge_base[doc_id]
+                if wanted[text] > 0:
+                    wanted[text] -= 1
+                    kept.append(doc_id)
+                else:
+                    removed.append(doc_id)
             
-        try:
-            from langchain_core.documents import Document
+            for doc_id in removed:
+                self.lexical_index.remove(doc_id, self.knowledge_base[doc_id])
+                self.metadata_index.remove(doc_id)
+                self.duplicates.discard(doc_id)
+                self.knowledge_base[doc_id] = None
             
-            # Create documents with metadata (limit to avoid memory issues)
-            docs = []
-            max_docs = min(50, len(self.knowledge_base))  # Limit to 50 documents
+            relabelled = 0
+            for doc_id in kept:
+                relabelled += self.metadata_index.add(doc_id, chunk_metadata(self.knowledge_base[doc_id], base_metadata))
             
-            for i, text in enumerate(self.knowledge_base[:max_docs]):
-                # Skip very short or very long texts
-                if len(text.strip()) < 20 or len(text) > 2000:
-                    continue
-                    
-                # Determine if this is from a file or built-in
-                source = "PDF Knowledge Base" if i >= 10 else "Built-in Knowledge"
-                doc = Document(
-                    page_content=text.strip(),
-                    metadata={"source": source, "index": i}
-                )
-                docs.append(doc)
+            added = []
+            for text in paragraphs:
+                if wanted[text] > 0:
+                    wanted[text] -= 1
+                    doc_id = len(self.knowledge_base)
+                    self.knowledge_base.append(text)
+                    self.chunk_sources.append(source)
+                    self.lexical_index.add(doc_id, text)
+                    self.metadata_index.add(doc_id, chunk_metadata(text, base_metadata))
+                    self.duplicates.add(doc_id, text)
+                    added.append(doc_id)
+            
+            if self.dense_index is not None:
+                self.dense_index.remove(removed)
+                missing = [self.knowledge_base[i] for i in added if self.knowledge_base[i] not in new_vectors]
+                new_vectors.update(zip(missing, self.embedder.encode(missing)))
+                self.dense_index.add(added, [new_vectors[self.knowledge_base[i]] for i in added])
             
-            if docs:
-                # Add documents in smaller batches to avoid memory issues
-                batch_size = 10
-                for i in range(0, len(docs), batch_size):
-                    batch = docs[i:i + batch_size]
-                    try:
-                        self.add_documents(batch)
-                    except Exception as batch_e:
-                        print(f"⚠️  Failed to add batch {i//batch_size + 1}: {batch_e}")
-                        continue
-                
-                print(f"✅ Loaded {len(docs)} knowledge items into vector database")
+            if kept or added:
+                self._source_chunks[source] = kept + added
             else:
-                print("⚠️  No suitable documents found for vector store")
-                
-        except Exception as e:
-            print(f"⚠️  Failed to load knowledge into vector store: {e}")
-            print("   Continuing with keyword search fallback")
-            self.use_vector_store = False
+                self._source_chunks.pop(source, None)
+            if removed and self._shadowed:
+                self._readmit_duplicates(removed)
+            if added or removed or relabelled:
+                self.knowledge_version += 1
+            return len(added), len(removed)
+
+    def _readmit_duplicates(self, removed):
+        """
+        Index held-back copies again once the chunks they duplicated are ``removed``,
+        unless they still copy another live chunk. Callers hold the lock.
+        """
+        removed = set(removed)
+        for source in [source for source, shadowed in self._shadowed.items()
+                       if any(owners & removed for _, owners in shadowed)]:
+            still, texts = [], []
+            current = self._source_chunks.get(source, [])
+            own = set(current)
+            for text, owners in self._shadowed[source]:
+                if owners & removed:
+                    # Copies re-admitted for an earlier source count as live chunks here
+                    owners = self.duplicates.matches(text) - own
+                if owners:
+                    still.append((text, owners))
+                else:
+                    texts.append(text)
+            if still:
+                self._shadowed[source] = still
+            else:
+                self._shadowed.pop(source)
+            if texts:
+                self.replace_source(source, [self.knowledge_base[i] for i in current] + texts)
+
+    def upsert_document(self, file_path, staged=None):
+        """
+        Index a new or changed knowledge file without a restart.
+        
+        Args:
+            file_path: Knowledge file
+            staged: Optional new copy of the file, e.g. an upload; it is
+                extracted first and only moved onto ``file_path`` if that
+                succeeds
+        
+        Returns:
+            tuple: (chunks added, chunks removed)
+        
+        Raises:
+            ValueError: If the file (or staged copy) could not be extracted
+        """
+        file_path = Path(file_path)
+        if staged is None:
+            paragraphs = self.loader.load_file(file_path)
+        else:
+            paragraphs = self.loader.replace_file(file_path, Path(staged))
+        if paragraphs is None:
+            raise ValueError(f"Could not extract knowledge from {file_path.name}")
+        return self.replace_source(str(file_path), self._prepare_chunks(str(file_path), paragraphs))
+
+    def remove_document(self, file_path):
+        """
+        Drop a knowledge file's chunks from the index.
+        
+        Returns:
+            tuple: (chunks added, chunks removed)
+        """
+        self.loader.fingerprints.pop(str(file_path), None)
+        with self._lock:
+            self._shadowed.pop(str(file_path), None)
+            return self.replace_source(str(file_path), [])
+
+    def owns(self, source):
+        """True if a knowledge source belongs to this retriever's shard (always, when unsharded)."""
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return shard_of(source, self.knowledge_dir, count) == index
+
+    def watch(self, interval=10.0):
+        """Start a background watcher that applies file changes in the knowledge directory."""
+        watcher = KnowledgeWatcher(self, interval=interval)
+        watcher.start()
+        return watcher
+
+    def retrieve(self, query, k=4, filters=None):
+        """
+        Retrieve relevant documents for a query.
+        Prioritizes knowledge from PDF files.
+        
+        Repeated queries are answered from the result cache until the
+        knowledge base changes. Stage timings of the last call are kept in
+        ``last_timings``.
+        
+        Args:
+            query: User question; words in double quotes are matched as a
+                phrase when some chunk contains it
+            k: Number of chunks to return
+            filters: Optional metadata filter, e.g. ``{"region": "zambia",
+                "crop_stage": {"$in": ["flowering", "podding"]}}``; see
+                MetadataIndex for the syntax
+        
+        Returns:
+            list: ``{"page_content", "metadata"}`` dicts, best first
+        
+        Raises:
+            ValueError: If ``filters`` is malformed
+        """
+        started = time.perf_counter()
+        if self.result_cache is not None:
+            cached = self.result_cache.get(query, k, self.knowledge_version, filters)
+            if cached is not None:
+                self.last_timings = {"cache_hit": True, "total_ms": (time.perf_counter() - started) * 1000}
+                return cached
+        
+        timings = {}
+        with self._lock:
+            version = self.knowledge_version
+            allowed = self._timed(timings, "filter_ms", self.metadata_index.evaluate, filters) if filters else None
+            # Misspelled words are searched as the closest indexed terms; the cache keeps the original
+            search_query = self._spell_corrected([query], timings)[0]
+            hits = None
+            route = self._topic_route(search_query)
+            if route is not None:
+                routed = self._timed(timings, "route_ms", self.metadata_index.evaluate,
+                                     {"$and": [filters, route]} if filters else route)
+                hits = self._search(search_query, k, timings, routed)
+                timings["topics"] = route["topic"]["$in"]
+                if len(hits) < k:
+                    # The matching partitions hold too little: search everything instead
+                    self.routing_stats["fallback"] += 1
+                    hits = None
+                elif self._timed_sum(timings, "route_ms", self._weak_route, search_query, hits):
+                    # A confidently wrong partition is worse than no routing
+                    self.routing_stats["low_score"] += 1
+                    hits = None
+                else:
+                    self.routing_stats["routed"] += 1
+            else:
+                self.routing_stats["global"] += 1
+            if hits is None:
+                hits = self._search(search_query, k, timings, allowed)
+            if not hits and phrases(search_query):
+                # No chunk holds a quoted phrase: match its words anywhere instead
+                hits = self._search(unquote(search_query), k, timings, allowed)
+            relevant = self._documents(hits, k, allowed)
+        
+        # A lexical-only answer after a dense timeout is not kept for later queries
+        if self.result_cache is not None and not timings.get("dense_timed_out"):
+            self.result_cache.put(query, k, version, relevant, filters)
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        self.last_timings = timings
+        return relevant
+
+    def retrieve_many(self, queries, k=4, filters=None):
+        """
+        Retrieve relevant documents for a batch of queries.
+        
+        Gives the same results as calling ``retrieve`` for each query, but
+        queries routed to the same topics are searched together: the dense
+        stage embeds them in one batch and scores them with one matrix
+        product, and the lexical stage scores each shared term once.
+        Cached queries are answered from the result cache.
+        
+        Args:
+            queries: User questions
+            k: Number of chunks to return per query
+            filters: Optional metadata filter applied to every query
+        
+        Returns:
+            list: One ``retrieve`` result per query
+        
+        Raises:
+            ValueError: If ``filters`` is malformed
+        """
+        started = time.perf_counter()
+        queries = list(queries)
+        results = [None] * len(queries)
+        if self.result_cache is not None:
+            for i, query in enumerate(queries):
+                results[i] = self.result_cache.get(query, k, self.knowledge_version, filters)
+        pending = [i for i, result in enumerate(results) if result is None]
+        
+        timings = {"queries": len(queries), "cache_hits": len(queries) - len(pending)}
+        with self._lock:
+            version = self.knowledge_version
+            allowed = self._timed(timings, "filter_ms", self.metadata_index.evaluate, filters) if filters else None
+            corrected = list(queries)
+            for i, search_query in zip(pending, self._spell_corrected([queries[i] for i in pending], timings)):
+                corrected[i] = search_query
+            groups = self._route_groups(corrected, pending)
+            unrouted = groups.pop(None, [])
+            self.routing_stats["global"] += len(unrouted)
+            
+            hits = {}
+            for topics, members in groups.items():
+                routed = self._route_filter(filters, topics)
+                for i, found in zip(members, self._search_many([corrected[i] for i in members], k, timings, routed)):
+                    if len(found) < k:
+                        self.routing_stats["fallback"] += 1
+                        unrouted.append(i)
+                    elif self._timed_sum(timings, "route_ms", self._weak_route, corrected[i], found):
+                        self.routing_stats["low_score"] += 1
+                        unrouted.append(i)
+                    else:
+                        self.routing_stats["routed"] += 1
+                        hits[i] = found
+            if unrouted:
+                found = self._search_many([corrected[i] for i in unrouted], k, timings, allowed)
+                hits.update(zip(unrouted, found))
+            loose = [i for i in pending if not hits[i] and phrases(corrected[i])]
+            if loose:
+                # No chunk holds a quoted phrase: match its words anywhere instead
+                found = self._search_many([unquote(corrected[i]) for i in loose], k, timings, allowed)
+                hits.update(zip(loose, found))
+            for i in pending:
+                results[i] = self._documents(hits[i], k, allowed)
+        
+        if self.result_cache is not None:
+            for i in pending:
+                self.result_cache.put(queries[i], k, version, results[i], filters)
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        self.last_timings = timings
+        return results
+
+    def search_stages(self, queries, depth, filters=None, routed=None, stats=None):
+        """
+        Rank a batch of queries without fusing or fetching, for merging across shards.
+        
+        Args:
+            queries: User questions
+            depth: Hits per query from each stage
+            filters: Optional metadata filter applied to every query
+            routed: Optional per-query flags; flagged queries only search their topic partitions
+            stats: Corpus-wide lexical ``collection_stats`` for BM25 scoring
+        
+        Returns:
+            list: ``(lexical hits, dense hits)`` per query, None for a stage this retriever does not run
+        """
+        with self._lock:
+            allowed = self.metadata_index.evaluate(filters) if filters else None
+            flagged = [i for i in range(len(queries)) if routed and routed[i]]
+            groups = self._route_groups(queries, flagged)
+            flagged = set(flagged)
+            groups.setdefault(None, []).extend(i for i in range(len(queries)) if i not in flagged)
+            
+            lexical = self.dense_index is None or self._stage_pool is not None
+            results = [None] * len(queries)
+            for topics, members in groups.items():
+                if not members:
+                    continue
+                mask = allowed if topics is None else self._route_filter(filters, topics)
+                batch = [queries[i] for i in members]
+                lexical_hits = self.lexical_index.search_many(batch, depth, allowed=mask, stats=stats) \
+                    if lexical else [None] * len(batch)
+                dense_hits = self._dense_search_many(batch, depth, mask) \
+                    if self.dense_index is not None else [None] * len(batch)
+                for i, lexical_found, dense_found in zip(members, lexical_hits, dense_hits):
+                    results[i] = (lexical_found, dense_found)
+            return results
+
+    def collection_stats(self, terms):
+        """Lexical statistics of this retriever's chunks, see BM25Index.collection_stats."""
+        with self._lock:
+            return self.lexical_index.collection_stats(terms)
+
+    def spelling_suggestions(self, terms):
+        """Spelling corrections from this retriever's vocabulary, see BM25Index.suggestions."""
+        with self._lock:
+            return self.lexical_index.suggestions(terms, Config.SPELLING_MAX_DISTANCE)
+
+    def documents(self, doc_ids):
+        """Result documents for chunk ids, e.g. the winners of a merge across shards."""
+        with self._lock:
+            return [self._document(doc_id) for doc_id in doc_ids]
+
+    def default_documents(self, k, filters=None):
+        """The first ``k`` live chunks (passing ``filters``), answered when a query matches nothing."""
+        with self._lock:
+            allowed = self.metadata_index.evaluate(filters) if filters else None
+            return self._documents([], k, allowed)
+
+    def _document(self, doc_id):
+        return {"page_content": self.knowledge_base[doc_id], "metadata": self.metadata_index.metadata(doc_id)}
+
+    def _documents(self, hits, k, allowed=None):
+        """Turn ranked chunk ids into result documents; callers hold the lock."""
+        # If no matches, return some default knowledge
+        if not hits:
+            live = (doc_id for doc_id in self.knowledge_base.live_ids()
+                    if allowed is None or (doc_id < len(allowed) and allowed[doc_id]))
+            hits = [(doc_id, 0.0) for doc_id in islice(live, k)]
+        return [self._document(doc_id) for doc_id, _ in hits]
+
+    def _route_groups(self, queries, indexes):
+        """Group query indexes by the topics they route to (None: the whole index)."""
+        groups = {}
+        for i in indexes:
+            route = self._topic_route(queries[i])
+            groups.setdefault(route and tuple(route["topic"]["$in"]), []).append(i)
+        return groups
+
+    def _weak_route(self, query, hits):
+        """
+        True if routed hits miss too much of the query for routing to be trusted.
+        Only the hits' own text and the query terms' document frequencies are
+        read; callers hold the lock.
+        """
+        if Config.TOPIC_ROUTING_MIN_SCORE <= 0:
+            return False
+        stats = self.lexical_index.collection_stats(set(tokenize(query)))
+        texts = [self.knowledge_base[doc_id] for doc_id, _ in hits]
+        return routing_score(query, texts, stats) < Config.TOPIC_ROUTING_MIN_SCORE
+
+    def _route_filter(self, filters, topics):
+        """Filter bitmap of ``filters`` restricted to the given topic partitions."""
+        route = {"topic": {"$in": list(topics)}}
+        return self.metadata_index.evaluate({"$and": [filters, route]} if filters else route)
+
+    def cache_stats(self):
+        """Retrieval and query-embedding cache counters for monitoring."""
+        stats = {"knowledge_version": self.knowledge_version}
+        if self.result_cache is not None:
+            stats["retrieval"] = self.result_cache.stats()
+        if self.embedder is not None:
+            stats["query_embeddings"] = dict(self.embedder.stats)
+        stats["topic_routing"] = dict(self.routing_stats)
+        return stats
+
+    def _spell_corrected(self, queries, timings):
+        """
+        Queries with misspelled words replaced by the closest indexed terms; callers hold the lock.
+        Corrections made are recorded in ``timings``.
+        """
+        if Config.SPELLING_MAX_DISTANCE <= 0 or not queries:
+            return queries
+        started = time.perf_counter()
+        terms = {term for query in queries for term in tokenize(query)}
+        corrections = self.lexical_index.corrections(terms, Config.SPELLING_MAX_DISTANCE)
+        corrected = [correct_query(query, corrections) for query in queries]
+        timings["spelling_ms"] = timings.get("spelling_ms", 0.0) + (time.perf_counter() - started) * 1000
+        if corrections:
+            timings.setdefault("corrections", {}).update(corrections)
+        return corrected
+
+    @staticmethod
+    def _topic_route(query):
+        """
+        Metadata filter selecting the topic partitions a query should search.
+        
+        Returns None, meaning the whole index, when routing is off or the
+        query names no specific topic or more than TOPIC_ROUTING_MAX_TOPICS
+        of them (too vague to narrow down safely).
+        """
+        topics = [topic for topic in detect_topics(query) if topic != GENERAL_TOPIC]
+        if not topics or len(topics) > Config.TOPIC_ROUTING_MAX_TOPICS:
+            return None
+        return {"topic": {"$in": topics + [GENERAL_TOPIC]}}
+
+    def _search(self, query, k, timings, allowed=None):
+        """
+        Rank chunk ids with the configured retrieval mode.
+        Callers hold the lock; per-stage milliseconds are written to ``timings``.
+        ``allowed`` is a filter bitmap over chunk ids that every stage applies
+        before taking its top results.
+        """
+        if self.dense_index is None:
+            return self._timed(timings, "lexical_ms", self.lexical_index.search, query, k, allowed=allowed)
+        if self._stage_pool is None:
+            return self._timed(timings, "dense_ms", self._dense_search, query, k, allowed)
+        
+        # Hybrid: the encoder and NumPy release the GIL, so the dense stage
+        # overlaps with BM25 scoring in this thread
+        depth = max(k * HYBRID_CANDIDATES_PER_RESULT, 20)
+        # The dense stage writes its own timings, so one that finishes late cannot touch this query's
+        dense_timings = {}
+        dense_future = self._stage_pool.submit(
+            self._timed, dense_timings, "dense_ms", self._dense_search, query, depth, allowed
+        )
+        lexical_hits = self._timed(timings, "lexical_ms", self.lexical_index.search, query, depth, allowed=allowed)
+        
+        # Past the latency budget, answer from the lexical stage alone
+        remaining = Config.HYBRID_DENSE_BUDGET_MS / 1000 - (timings["lexical_ms"] / 1000)
+        try:
+            dense_hits = dense_future.result(timeout=max(remaining, 0))
+            timings.update(dense_timings)
+        except FutureTimeoutError:
+            # Drop it if it has not started; a running one finishes on its spare thread
+            dense_future.cancel()
+            dense_hits = []
+            timings["dense_timed_out"] = True
+        
+        return self._timed(
+            timings, "fusion_ms", reciprocal_rank_fusion, [lexical_hits, dense_hits], limit=k
+        )
+
+    def _search_many(self, queries, k, timings, allowed=None):
+        """
+        Rank chunk ids for a batch of queries with the configured retrieval mode.
+        Callers hold the lock; stage milliseconds for the whole batch are
+        added to ``timings``.
+        """
+        if self.dense_index is None:
+            return self._timed_sum(timings, "lexical_ms", self.lexical_index.search_many, queries, k, allowed=allowed)
+        if self._stage_pool is None:
+            return self._timed_sum(timings, "dense_ms", self._dense_search_many, queries, k, allowed)
+        
+        # Hybrid: the dense batch runs beside the lexical batch; no latency budget applies to batches
+        depth = max(k * HYBRID_CANDIDATES_PER_RESULT, 20)
+        dense_future = self._stage_pool.submit(
+            self._timed_sum, timings, "dense_ms", self._dense_search_many, queries, depth, allowed
+        )
+        lexical_hits = self._timed_sum(timings, "lexical_ms", self.lexical_index.search_many, queries, depth,
+                                       allowed=allowed)
+        dense_hits = dense_future.result()
+        return self._timed_sum(timings, "fusion_ms", lambda: [
+            reciprocal_rank_fusion([lexical, dense], limit=k) for lexical, dense in zip(lexical_hits, dense_hits)
+        ])
+
+    def _dense_search(self, query, k, allowed=None):
+        """Embed the query and search the dense index."""
+        return self.dense_index.search(self.embedder.encode_query(query), k=k, allowed=allowed)
+
+    def _dense_search_many(self, queries, k, allowed=None):
+        """Embed a batch of queries together and search the dense index with all of them."""
+        return self.dense_index.search_many(self.embedder.encode_queries(queries), k=k, allowed=allowed)
+
+    @staticmethod
+    def _timed(timings, stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = (time.perf_counter() - started) * 1000
+        return result
+
+    @staticmethod
+    def _timed_sum(timings, stage, func, *args, **kwargs):
+        started = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings[stage] = timings.get(stage, 0.0) + (time.perf_counter() - started) * 1000
+        return result
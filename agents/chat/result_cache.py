@@ -0,0 +1,108 @@
+"""Bounded LRU/TTL cache of retrieval results."""
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from .lexical_index import phrases
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def normalize_query(query):
+    """Case- and punctuation-insensitive cache key for a query."""
+    return " ".join(WORD_PATTERN.findall(query.lower()))
+
+
+def cache_key(query, k, filters=None):
+    """
+    Cache key for a query, result count and metadata filter.
+
+    Quoted phrases are part of the key: ``"leaf spot"`` only matches the
+    phrase, so it must not share results with ``leaf spot``.
+    """
+    quoted = tuple(tuple(phrase) for phrase in phrases(query))
+    return normalize_query(query), quoted, k, json.dumps(filters, sort_keys=True, default=str) if filters else None
+
+
+class RetrievalCache:
+    """
+    Caches ``retrieve`` results by normalised query, k and filter.
+
+    Every entry belongs to one knowledge base version (an increasing
+    integer). When the retriever reports a newer version the whole cache is
+    dropped, so answers never outlive the documents they came from.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=600):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Least recently used entries are evicted beyond this
+            ttl_seconds: Age after which an entry is recomputed
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _check_version(self, version):
+        """Drop everything on a newer version; False for callers on an older one."""
+        if self._version is None or version > self._version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._version = version
+        return version == self._version
+
+    def get(self, query, k, version, filters=None):
+        """
+        Look up cached results.
+
+        Returns:
+            list: Copy of the cached results, or None on a miss
+        """
+        key = cache_key(query, k, filters)
+        with self._lock:
+            entry = self._entries.get(key) if self._check_version(version) else None
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return [dict(doc) for doc in entry[1]]
+
+    def put(self, query, k, version, results, filters=None):
+        """Store results computed against the given knowledge version."""
+        key = cache_key(query, k, filters)
+        with self._lock:
+            if not self._check_version(version):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, [dict(doc) for doc in results])
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Counters for monitoring."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "knowledge_version": self._version,
+            }
@@ -0,0 +1,444 @@
+"""Knowledge retrieval split across local shard processes."""
+import atexit
+import heapq
+import multiprocessing
+import threading
+import time
+from itertools import islice
+from pathlib import Path
+
+from config import Config
+from .fusion import reciprocal_rank_fusion
+from .lexical_index import correct_query, phrases, tokenize, unquote
+from .rag_retriever import HYBRID_CANDIDATES_PER_RESULT, RAGRetriever, routing_score, shard_of
+from .result_cache import RetrievalCache
+
+# Seconds between liveness checks while waiting on a shard
+SHARD_POLL_INTERVAL = 1.0
+# Requests a shard process answers; everything else is refused
+SHARD_METHODS = frozenset({
+    "collection_stats", "spelling_suggestions", "search_stages", "documents", "default_documents",
+    "upsert_document", "remove_document", "cache_stats", "knowledge_version", "watch", "unwatch",
+})
+
+
+def sharding_enabled():
+    """
+    True if the API should search through a ShardedRetriever.
+
+    Shards belong to the process that starts them, so N API workers would
+    hold N full copies of the corpus in shard processes, while unsharded
+    workers share one memory-mapped knowledge pack. Sharding is therefore
+    only used when RETRIEVAL_SHARDS > 1 and this is the node's only worker.
+    """
+    if Config.RETRIEVAL_SHARDS <= 1:
+        return False
+    if Config.API_WORKERS > 1:
+        print(f"⚠️  RETRIEVAL_SHARDS={Config.RETRIEVAL_SHARDS} ignored: each of the {Config.API_WORKERS} "
+              f"API workers would start its own shards; serving from the knowledge pack instead")
+        return False
+    return True
+
+
+def _shard_path(path, index):
+    """Per-shard variant of a file path, e.g. embeddings.npy -> embeddings.shard1.npy."""
+    path = Path(path)
+    return str(path.with_name(f"{path.stem}.shard{index}{path.suffix}"))
+
+
+def _serve(connection, index, count, knowledge_dir, settings):
+    """
+    Shard process: index one shard's files, then answer requests until the pipe closes.
+
+    Runs with the coordinator's settings; the dense index file and Chroma
+    collection get per-shard names so shards never overwrite each other.
+    """
+    for name, value in settings.items():
+        setattr(Config, name, value)
+    Config.VECTOR_INDEX_PATH = _shard_path(Config.VECTOR_INDEX_PATH, index)
+    Config.CHROMA_COLLECTION = f"{Config.CHROMA_COLLECTION}_shard{index}"
+    try:
+        retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack="", shard=(index, count))
+    except Exception as e:
+        connection.send(("error", RuntimeError(f"shard {index} failed to start: {e}")))
+        return
+    mode = "lexical"
+    if retriever.dense_index is not None:
+        mode = "hybrid" if retriever._stage_pool is not None else "dense"
+    chunks = sum(1 for _ in retriever.knowledge_base.live_ids())
+    connection.send(("ok", {"mode": mode, "chunks": chunks}))
+
+    watcher = None
+    while True:
+        try:
+            request = connection.recv()
+        except (EOFError, OSError):
+            break
+        if request is None:
+            break
+        method, args = request
+        try:
+            if method not in SHARD_METHODS:
+                raise ValueError(f"unknown shard request {method}")
+            if method == "knowledge_version":
+                result = retriever.knowledge_version
+            elif method == "watch":
+                watcher = watcher or retriever.watch(*args)
+                result = None
+            elif method == "unwatch":
+                if watcher is not None:
+                    watcher.stop()
+                watcher = None
+                result = None
+            else:
+                result = getattr(retriever, method)(*args)
+            connection.send(("ok", result))
+        except Exception as e:
+            connection.send(("error", e))
+    if watcher is not None:
+        watcher.stop()
+
+
+class _ShardWatchers:
+    """Handle returned by ``ShardedRetriever.watch``; each shard watches its own files."""
+
+    def __init__(self, retriever):
+        self.retriever = retriever
+
+    def stop(self):
+        """Stop the watchers in every shard."""
+        self.retriever._call("unwatch")
+
+
+class ShardedRetriever:
+    """
+    Retrieves knowledge split across N local shard processes.
+
+    Each knowledge file belongs to one shard, chosen by a hash of its path
+    (built-in facts go to shard 0), and every shard is a RAGRetriever in
+    its own process with its own lexical, metadata and dense indexes, so a
+    corpus too large for one process is spread over several and scored on
+    several cores. A query is sent to every shard at once; their per-stage
+    top lists come back sorted and are merged with a heap, then fused for
+    hybrid search, and only the winning chunks' text is fetched.
+
+    BM25 scores are made comparable across shards by first summing each
+    shard's document counts, lengths and term frequencies, so results
+    match a single retriever over the whole corpus. Near-duplicates are
+    only dropped within a shard. Results are cached here, as in
+    RAGRetriever, against the sum of the shards' knowledge versions.
+
+    The shards are private to the process that creates them: they index
+    the raw files (not the shared knowledge pack), and each ShardedRetriever
+    holds the whole corpus in its shard processes. One per node is the
+    intended use, see ``sharding_enabled``.
+
+    ``retrieve``, ``retrieve_many``, ``upsert_document``, ``remove_document``,
+    ``watch`` and ``cache_stats`` behave as on RAGRetriever. Requests are
+    serialised per retriever; the shards of one request run in parallel.
+    """
+
+    def __init__(self, shards=None, knowledge_dir=None):
+        """
+        Start the shard processes and wait until each has indexed its files.
+
+        Args:
+            shards: Number of shard processes (default: Config.RETRIEVAL_SHARDS)
+            knowledge_dir: Folder of knowledge files (default: data/knowledge)
+
+        Raises:
+            RuntimeError: If a shard fails to start
+        """
+        self.count = max(1, shards or Config.RETRIEVAL_SHARDS)
+        self.knowledge_dir = Path(knowledge_dir or Path(__file__).parent.parent.parent / "data" / "knowledge")
+        self.last_timings = {}
+        self.routing_stats = {"routed": 0, "global": 0, "fallback": 0, "low_score": 0}
+        self.result_cache = None
+        if Config.RETRIEVAL_CACHE_SIZE > 0 and Config.RETRIEVAL_CACHE_TTL > 0:
+            self.result_cache = RetrievalCache(Config.RETRIEVAL_CACHE_SIZE, Config.RETRIEVAL_CACHE_TTL)
+        self._lock = threading.RLock()
+        self._connections, self._processes = [], []
+
+        settings = {name: value for name, value in vars(Config).items() if name.isupper()}
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.count):
+            parent, child = context.Pipe()
+            process = context.Process(
+                target=_serve, args=(child, index, self.count, str(self.knowledge_dir), settings),
+                name=f"retrieval-shard-{index}"
+            )
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+        atexit.register(self.close)
+        try:
+            info = self._gather(range(self.count))
+        except Exception:
+            self.close()
+            raise
+        self.retrieval_mode = info[0]["mode"]
+        self.shard_chunks = [shard["chunks"] for shard in info]
+        print(f"🧩 Retrieval split across {self.count} shards ({sum(self.shard_chunks)} chunks, "
+              f"{self.retrieval_mode} search)")
+
+    def _receive(self, shard):
+        connection = self._connections[shard]
+        while not connection.poll(SHARD_POLL_INTERVAL):
+            if not self._processes[shard].is_alive():
+                raise RuntimeError(f"retrieval shard {shard} exited")
+        return connection.recv()
+
+    def _gather(self, shards):
+        """Collect one reply per shard; every reply is read before an error is raised."""
+        replies = [self._receive(shard) for shard in shards]
+        for status, result in replies:
+            if status == "error":
+                raise result
+        return [result for _, result in replies]
+
+    def _call(self, method, *args, shards=None):
+        """Send the same request to several shards (all by default) and wait for every reply."""
+        shards = range(self.count) if shards is None else shards
+        with self._lock:
+            for shard in shards:
+                self._connections[shard].send((method, args))
+            return self._gather(shards)
+
+    def _call_each(self, method, requests):
+        """Send each shard its own arguments, ``{shard: args}``, and wait for every reply."""
+        with self._lock:
+            for shard, args in requests.items():
+                self._connections[shard].send((method, args))
+            return dict(zip(requests, self._gather(list(requests))))
+
+    @property
+    def knowledge_version(self):
+        """Changes whenever any shard's knowledge changes."""
+        return sum(self._call("knowledge_version"))
+
+    def retrieve(self, query, k=4, filters=None):
+        """
+        Retrieve relevant documents for a query from every shard.
+
+        Args:
+            query: User question
+            k: Number of chunks to return
+            filters: Optional metadata filter, see RAGRetriever.retrieve
+
+        Returns:
+            list: ``{"page_content", "metadata"}`` dicts, best first
+
+        Raises:
+            ValueError: If ``filters`` is malformed
+        """
+        return self.retrieve_many([query], k, filters)[0]
+
+    def retrieve_many(self, queries, k=4, filters=None):
+        """
+        Retrieve relevant documents for a batch of queries, fanned out to every shard at once.
+
+        Returns:
+            list: One ``retrieve`` result per query
+        """
+        started = time.perf_counter()
+        queries = list(queries)
+        results = [None] * len(queries)
+        version = None
+        if self.result_cache is not None:
+            version = self.knowledge_version
+            for i, query in enumerate(queries):
+                results[i] = self.result_cache.get(query, k, version, filters)
+        pending = [i for i, result in enumerate(results) if result is None]
+        timings = {"queries": len(queries), "shards": self.count, "cache_hits": len(queries) - len(pending)}
+        if pending:
+            found = self._retrieve_uncached([queries[i] for i in pending], k, filters, timings)
+            for i, documents in zip(pending, found):
+                results[i] = documents
+                if self.result_cache is not None:
+                    self.result_cache.put(queries[i], k, version, documents, filters)
+        timings["total_ms"] = (time.perf_counter() - started) * 1000
+        self.last_timings = timings
+        return results
+
+    def _retrieve_uncached(self, queries, k, filters, timings):
+        """Search every shard for a batch of queries and fetch the winning chunks."""
+        with self._lock:
+            queries = self._spell_corrected(queries, timings)
+            routed = [RAGRetriever._topic_route(query) is not None for query in queries]
+            hits = self._search(queries, k, filters, routed, timings)
+            fallback = [i for i, flag in enumerate(routed) if flag and len(hits[i]) < k]
+            self.routing_stats["global"] += routed.count(False)
+            self.routing_stats["fallback"] += len(fallback)
+            if fallback:
+                # The matching partitions hold too little: search everything instead
+                again = self._search([queries[i] for i in fallback], k, filters, [False] * len(fallback), timings)
+                for i, found in zip(fallback, again):
+                    hits[i] = found
+            loose = [i for i, found in enumerate(hits) if not found and phrases(queries[i])]
+            if loose:
+                # No chunk holds a quoted phrase: match its words anywhere instead
+                again = self._search([unquote(queries[i]) for i in loose], k, filters, [False] * len(loose), timings)
+                for i, found in zip(loose, again):
+                    hits[i] = found
+            results = self._fetch(hits, k, filters, timings)
+
+            kept = [i for i, flag in enumerate(routed) if flag and i not in fallback]
+            weak = self._weak_routes(queries, kept, results, timings)
+            self.routing_stats["routed"] += len(kept) - len(weak)
+            self.routing_stats["low_score"] += len(weak)
+            if weak:
+                # A confidently wrong partition is worse than no routing
+                again = self._search([queries[i] for i in weak], k, filters, [False] * len(weak), timings)
+                for i, documents in zip(weak, self._fetch(again, k, filters, timings)):
+                    results[i] = documents
+            return results
+
+    def _weak_routes(self, queries, indexes, results, timings):
+        """Indexes of routed queries whose results miss too much of the query, see RAGRetriever._weak_route."""
+        if Config.TOPIC_ROUTING_MIN_SCORE <= 0 or not indexes:
+            return []
+        stats = self._collection_stats([queries[i] for i in indexes], timings)
+        return [
+            i for i in indexes
+            if routing_score(queries[i], [doc["page_content"] for doc in results[i]], stats)
+            < Config.TOPIC_ROUTING_MIN_SCORE
+        ]
+
+    def _spell_corrected(self, queries, timings):
+        """Queries with words missing from every shard replaced by the closest term in any shard."""
+        if Config.SPELLING_MAX_DISTANCE <= 0 or not queries:
+            return queries
+        started = time.perf_counter()
+        terms = sorted({term for query in queries for term in tokenize(query)})
+        best = {}
+        for suggestions in self._call("spelling_suggestions", terms):
+            for term, found in suggestions.items():
+                if found is None or best.get(term, found) is None:
+                    best[term] = None  # Indexed in some shard: not a typo
+                else:
+                    best[term] = min(best.get(term, found), found)
+        corrections = {term: found[-1] for term, found in best.items() if found}
+        timings["spelling_ms"] = (time.perf_counter() - started) * 1000
+        if corrections:
+            timings["corrections"] = corrections
+        return [correct_query(query, corrections) for query in queries]
+
+    def _collection_stats(self, queries, timings):
+        """Sum the shards' lexical statistics so BM25 scores the same in every shard."""
+        started = time.perf_counter()
+        terms = sorted({term for query in queries for term in tokenize(query)})
+        parts = self._call("collection_stats", terms)
+        frequencies = {term: sum(part[2][term] for part in parts) for term in terms}
+        timings["stats_ms"] = timings.get("stats_ms", 0.0) + (time.perf_counter() - started) * 1000
+        return sum(part[0] for part in parts), sum(part[1] for part in parts), frequencies
+
+    def _search(self, queries, k, filters, routed, timings):
+        """Fan a batch out to every shard and merge the shards' hits into global ids, best first."""
+        depth = max(k * HYBRID_CANDIDATES_PER_RESULT, 20) if self.retrieval_mode == "hybrid" else k
+        stats = self._collection_stats(queries, timings) if self.retrieval_mode != "dense" else None
+
+        started = time.perf_counter()
+        replies = self._call("search_stages", queries, depth, filters, routed, stats)
+        timings["search_ms"] = timings.get("search_ms", 0.0) + (time.perf_counter() - started) * 1000
+
+        merged = []
+        for i in range(len(queries)):
+            stages = []
+            for stage in (0, 1):
+                lists = [
+                    [(doc_id * self.count + shard, score) for doc_id, score in reply[i][stage]]
+                    for shard, reply in enumerate(replies) if reply[i][stage] is not None
+                ]
+                if lists:
+                    stages.append(list(islice(heapq.merge(*lists, key=lambda hit: -hit[1]), depth)))
+            if len(stages) > 1:
+                merged.append(reciprocal_rank_fusion(stages, limit=k))
+            else:
+                merged.append(stages[0][:k] if stages else [])
+        return merged
+
+    def _fetch(self, hits, k, filters, timings):
+        """Fetch the text and metadata of every winning chunk from the shard holding it."""
+        started = time.perf_counter()
+        wanted = {}
+        for found in hits:
+            for global_id, _ in found:
+                doc_id, shard = divmod(global_id, self.count)
+                wanted.setdefault(shard, set()).add(doc_id)
+        requests = {shard: (sorted(doc_ids),) for shard, doc_ids in wanted.items()}
+        fetched = {}
+        for shard, documents in self._call_each("documents", requests).items():
+            fetched.update((doc_id * self.count + shard, document)
+                           for doc_id, document in zip(requests[shard][0], documents))
+
+        defaults = None
+        results = []
+        for found in hits:
+            if not found:
+                # If no matches, return some default knowledge
+                if defaults is None:
+                    defaults = [document for documents in self._call("default_documents", k, filters)
+                                for document in documents][:k]
+                results.append(list(defaults))
+            else:
+                results.append([fetched[global_id] for global_id, _ in found])
+        timings["fetch_ms"] = timings.get("fetch_ms", 0.0) + (time.perf_counter() - started) * 1000
+        return results
+
+    def upsert_document(self, file_path, staged=None):
+        """
+        Index a new or changed knowledge file in the shard that owns it.
+
+        Args:
+            file_path: Knowledge file
+            staged: Optional new copy of the file, see RAGRetriever.upsert_document
+
+        Returns:
+            tuple: (chunks added, chunks removed)
+        """
+        shard = shard_of(file_path, self.knowledge_dir, self.count)
+        staged = None if staged is None else str(staged)
+        return tuple(self._call("upsert_document", str(file_path), staged, shards=[shard])[0])
+
+    def remove_document(self, file_path):
+        """
+        Drop a knowledge file's chunks from the shard that owns it.
+
+        Returns:
+            tuple: (chunks added, chunks removed)
+        """
+        shard = shard_of(file_path, self.knowledge_dir, self.count)
+        return tuple(self._call("remove_document", str(file_path), shards=[shard])[0])
+
+    def watch(self, interval=10.0):
+        """Start a watcher in every shard that applies changes to the files it owns."""
+        self._call("watch", interval)
+        return _ShardWatchers(self)
+
+    def cache_stats(self):
+        """Per-shard counters plus this retriever's result cache and topic routing counts, for monitoring."""
+        stats = {
+            "shards": self._call("cache_stats"),
+            "topic_routing": dict(self.routing_stats),
+        }
+        if self.result_cache is not None:
+            stats["retrieval"] = self.result_cache.stats()
+        return stats
+
+    def close(self):
+        """Stop the shard processes."""
+        with self._lock:
+            for connection in self._connections:
+                try:
+                    connection.send(None)
+                except (OSError, ValueError):
+                    pass
+            for process in self._processes:
+                process.join(timeout=10)
+                if process.is_alive():
+                    process.terminate()
+            for connection in self._connections:
+                connection.close()
+            self._connections, self._processes = [], []
+        atexit.unregister(self.close)
@@ -0,0 +1,127 @@
+"""Character trigram index for correcting misspelled query terms."""
+import heapq
+from collections import Counter
+
+# Terms shorter than this are never corrected: too many real words are one edit apart
+MIN_CORRECTION_LENGTH = 4
+# Terms up to this length are corrected by at most one edit
+SHORT_TERM_LENGTH = 5
+# Indexed terms sharing the most trigrams with a query term that are checked by edit distance
+MAX_CANDIDATES = 64
+
+
+def trigrams(term):
+    """Distinct character trigrams of a term padded with ``^`` and ``$``, so its ends count."""
+    padded = f"^{term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """
+    Edits (insert, delete, substitute, swap two neighbours) turning ``a`` into ``b``.
+
+    Only the diagonal band of ``limit`` cells either side is computed, and
+    ``limit + 1`` is returned as soon as the distance must exceed ``limit``.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    over = limit + 1
+    before, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        char = a[i - 1]
+        best = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            value = previous[j - 1] if char == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == b[j - 1] and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current[j] = value
+            if value < best:
+                best = value
+        if best > limit:
+            return over
+        before, previous = previous, current
+    return min(previous[-1], over)
+
+
+class SpellingIndex:
+    """
+    Maps misspelled terms to the closest terms of a vocabulary.
+
+    Each term is indexed under its character trigrams. A lookup counts the
+    trigrams every indexed term shares with the query term, keeps those
+    that can still be within the edit bound (each edit changes at most
+    four trigrams) and have a similar length, and computes the edit
+    distance only for the best-sharing few, so it stays well under a
+    millisecond for vocabularies of tens of thousands of terms.
+    """
+
+    def __init__(self, terms=()):
+        """
+        Build the index.
+
+        Args:
+            terms: Iterable of vocabulary terms
+        """
+        self._terms = []
+        self._ids = {}
+        self._postings = {}  # trigram -> ids of the terms containing it
+        for term in terms:
+            self.add(term)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, term):
+        return term in self._ids
+
+    def add(self, term):
+        """Add a vocabulary term; terms with digits are left out."""
+        if term in self._ids or any(char.isdigit() for char in term):
+            return
+        term_id = len(self._terms)
+        self._terms.append(term)
+        self._ids[term] = term_id
+        for gram in trigrams(term):
+            self._postings.setdefault(gram, []).append(term_id)
+
+    def candidates(self, term, max_distance=2):
+        """
+        Indexed terms within the edit bound of a term.
+
+        The bound is ``max_distance``, or one edit for terms of at most
+        SHORT_TERM_LENGTH characters; terms shorter than
+        MIN_CORRECTION_LENGTH get no candidates.
+
+        Returns:
+            list: ``(distance, term)`` pairs, closest first; at equal distance
+                terms of the same length as ``term`` come first, since typing
+                slips replace letters more often than they add or drop several
+        """
+        if len(term) < MIN_CORRECTION_LENGTH or max_distance <= 0 or any(char.isdigit() for char in term):
+            return []
+        limit = min(max_distance, 1) if len(term) <= SHORT_TERM_LENGTH else max_distance
+        grams = trigrams(term)
+        counts = Counter()
+        for gram in grams:
+            counts.update(self._postings.get(gram, ()))
+        needed = max(1, len(grams) - 4 * limit)
+        shortlist = heapq.nlargest(
+            MAX_CANDIDATES,
+            ((shared, term_id) for term_id, shared in counts.items()
+             if shared >= needed and abs(len(self._terms[term_id]) - len(term)) <= limit),
+            key=lambda item: item[0]
+        )
+        found = []
+        for _, term_id in shortlist:
+            candidate = self._terms[term_id]
+            distance = edit_distance(term, candidate, limit)
+            if 0 < distance <= limit:
+                found.append((distance, candidate))
+        return sorted(found, key=lambda item: (item[0], abs(len(item[1]) - len(term)), item[1]))
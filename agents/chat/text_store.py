@@ -0,0 +1,102 @@
+"""Chunk text kept as one UTF-8 blob plus offsets and decoded on access."""
+import mmap
+import tempfile
+from array import array
+
+import numpy as np
+
+# Appended text is buffered in memory up to this many bytes, then written to the spill file
+SPILL_FLUSH_BYTES = 1 << 20
+
+
+class TextStore:
+    """
+    List-like chunk texts stored as UTF-8 bytes, decoded only when read.
+
+    Texts from a knowledge pack stay in the pack's memory-mapped blob.
+    Texts added while serving are appended to an unlinked temporary file
+    that is memory-mapped for reading, with their offsets in a compact
+    array, so a chunk costs its UTF-8 bytes plus 8 bytes of offset instead
+    of a Python string, and its pages are only resident while they are
+    read. Supports what RAGRetriever does with its chunk list: ``len``,
+    iteration, integer indexing, ``append`` and assigning None to remove
+    a chunk.
+    """
+
+    def __init__(self, blob=None, offsets=None):
+        """
+        Initialize the store.
+
+        Args:
+            blob: Optional UTF-8 bytes of existing chunks, e.g. a pack's memory-mapped ``chunks.bin``
+            offsets: Byte offsets into ``blob``; chunk i is ``blob[offsets[i]:offsets[i + 1]]``
+        """
+        self._base_blob = blob if blob is not None else np.zeros(0, dtype=np.uint8)
+        self._base_offsets = offsets if offsets is not None else np.zeros(1, dtype=np.int64)
+        self._base_size = len(self._base_offsets) - 1
+        self._offsets = array('q', [0])  # appended chunks, into the spill data
+        self._removed = set()
+        self._pending = bytearray()  # spill data not yet written to the file
+        self._written = 0
+        self._file = None
+        self._map = None
+
+    def __len__(self):
+        return self._base_size + len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        if index in self._removed:
+            return None
+        if index < self._base_size:
+            start, end = self._base_offsets[index], self._base_offsets[index + 1]
+            return self._base_blob[start:end].tobytes().decode('utf-8')
+        index -= self._base_size
+        return self._spilled(self._offsets[index], self._offsets[index + 1]).decode('utf-8')
+
+    def __setitem__(self, index, value):
+        if value is not None:
+            raise TypeError("stored chunk text can only be removed")
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        self._removed.add(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def append(self, text):
+        """Add a chunk's text at the next id."""
+        self._pending += text.encode('utf-8')
+        self._offsets.append(self._written + len(self._pending))
+        if len(self._pending) >= SPILL_FLUSH_BYTES:
+            self._flush()
+
+    def live_ids(self):
+        """Ids of the chunks that have not been removed, without decoding any text."""
+        return (index for index in range(len(self)) if index not in self._removed)
+
+    @property
+    def nbytes(self):
+        """UTF-8 bytes of every stored chunk, removed ones included."""
+        return int(self._base_offsets[-1]) + self._offsets[-1]
+
+    def _flush(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(prefix="soya-chunks-")
+        self._file.write(self._pending)
+        self._file.flush()
+        self._written += len(self._pending)
+        self._pending = bytearray()
+
+    def _spilled(self, start, end):
+        """Bytes of the spill data, from the memory-mapped file or the unwritten tail."""
+        if start >= self._written:
+            return bytes(self._pending[start - self._written:end - self._written])
+        if self._map is None or end > len(self._map):
+            # The file grew since it was mapped
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[start:end]
@@ -0,0 +1,211 @@
+"""Dense vector index over a memory-mapped float16 embedding matrix."""
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+from .metadata import filter_mask
+
+
+def _atomic_save(path, array):
+    """Write an .npy file under a temporary name, then rename it into place."""
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+class DenseVectorIndex:
+    """
+    Exact cosine-similarity search over unit-length chunk embeddings.
+
+    The base matrix is a float16 ``.npy`` opened with ``mmap_mode='r'``, so
+    loading is near-instant and every worker on a node shares the same page
+    cache. Chunks added or removed after loading live in a small in-memory
+    overlay until the matrix is rebuilt.
+    """
+
+    # Rows converted to float32 per block, bounding scratch memory during search
+    BLOCK_ROWS = 65536
+    # Filters allowing fewer rows than this fraction score only those rows (a gather beats a full scan)
+    SPARSE_FILTER_FRACTION = 0.5
+    # Row x query scores computed at once by search_many (64 MB of float32)
+    BATCH_SCORE_CELLS = 1 << 24
+
+    def __init__(self, matrix, doc_ids):
+        """
+        Initialize the index.
+
+        Args:
+            matrix: ``(n, dim)`` float16 array (usually memory-mapped)
+            doc_ids: ``(n,)`` int64 chunk ids, one per matrix row
+        """
+        self.matrix = matrix
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        self.dimension = matrix.shape[1]
+        self._deleted = set()
+        self._deleted_mask = None
+        self._extra_ids = np.zeros(0, dtype=np.int64)
+        self._extra_vectors = np.zeros((0, self.dimension), dtype=np.float32)
+
+    def __len__(self):
+        return len(self.doc_ids) - len(self._deleted) + len(self._extra_ids)
+
+    @staticmethod
+    def _paths(path):
+        path = Path(path)
+        return path, path.with_suffix('.ids.npy'), path.with_suffix('.json')
+
+    @classmethod
+    def build(cls, path, doc_ids, vectors, manifest):
+        """
+        Write an index to disk and open it memory-mapped.
+
+        Args:
+            path: Destination ``.npy`` file for the matrix
+            doc_ids: Chunk id for each row of ``vectors``
+            vectors: ``(n, dim)`` unit-length embeddings
+            manifest: JSON-serialisable description used to validate reloads
+        """
+        matrix_path, ids_path, manifest_path = cls._paths(path)
+        matrix_path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_save(matrix_path, np.asarray(vectors, dtype=np.float16))
+        _atomic_save(ids_path, np.asarray(doc_ids, dtype=np.int64))
+        tmp_manifest = manifest_path.with_name(f".{manifest_path.name}.{os.getpid()}.tmp")
+        with open(tmp_manifest, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_manifest, manifest_path)
+        return cls.load(path, manifest)
+
+    @classmethod
+    def load(cls, path, manifest=None):
+        """
+        Open an index written by ``build``.
+
+        Returns:
+            DenseVectorIndex, or None if missing or if ``manifest`` does not match
+        """
+        matrix_path, ids_path, manifest_path = cls._paths(path)
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if manifest is not None and stored != manifest:
+                return None
+            matrix = np.load(matrix_path, mmap_mode='r')
+            doc_ids = np.load(ids_path, mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if matrix.ndim != 2 or len(matrix) != len(doc_ids):
+            return None
+        return cls(matrix, doc_ids)
+
+    def add(self, doc_ids, vectors):
+        """Add chunk embeddings to the in-memory overlay."""
+        if len(doc_ids) == 0:
+            return
+        self._extra_ids = np.concatenate([self._extra_ids, np.asarray(doc_ids, dtype=np.int64)])
+        self._extra_vectors = np.vstack([self._extra_vectors, np.asarray(vectors, dtype=np.float32)])
+
+    def remove(self, doc_ids):
+        """Hide chunks from search results."""
+        doc_ids = set(doc_ids)
+        if not doc_ids:
+            return
+        in_extra = np.isin(self._extra_ids, list(doc_ids))
+        if in_extra.any():
+            self._extra_ids = self._extra_ids[~in_extra]
+            self._extra_vectors = self._extra_vectors[~in_extra]
+        # Only rows of the base matrix are masked; overlay ids are dropped above
+        in_base = self.doc_ids[np.isin(self.doc_ids, list(doc_ids))]
+        if len(in_base):
+            self._deleted |= set(in_base.tolist())
+            self._deleted_mask = np.isin(self.doc_ids, list(self._deleted))
+
+    def _overlay(self, allowed=None):
+        """Overlay ids and vectors, restricted to a filter bitmap if given."""
+        if allowed is None or not len(self._extra_ids):
+            return self._extra_ids, self._extra_vectors
+        keep = filter_mask(allowed, self._extra_ids)
+        return self._extra_ids[keep], self._extra_vectors[keep]
+
+    def scores(self, query_vector, allowed=None):
+        """
+        Cosine similarity of the query to every live row.
+
+        Args:
+            query_vector: Unit-length query embedding, or a ``(q, dim)`` matrix of them
+            allowed: Optional filter bitmap over chunk ids; other rows score -inf
+
+        Returns:
+            tuple: (doc_ids, scores) arrays; scores are ``(n, q)`` for a query matrix
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        keep = None if allowed is None else filter_mask(allowed, self.doc_ids)
+        if keep is not None and np.count_nonzero(keep) < self.SPARSE_FILTER_FRACTION * len(keep):
+            base = np.full((len(self.matrix),) + query.shape[:-1], -np.inf, dtype=np.float32)
+            rows = np.flatnonzero(keep)
+            for start in range(0, len(rows), self.BLOCK_ROWS):
+                block_rows = rows[start:start + self.BLOCK_ROWS]
+                base[block_rows] = self.matrix[block_rows].astype(np.float32) @ query.T
+        else:
+            base = np.empty((len(self.matrix),) + query.shape[:-1], dtype=np.float32)
+            for start in range(0, len(self.matrix), self.BLOCK_ROWS):
+                block = self.matrix[start:start + self.BLOCK_ROWS]
+                base[start:start + len(block)] = block.astype(np.float32) @ query.T
+            if keep is not None:
+                base[~keep] = -np.inf
+        if self._deleted_mask is not None:
+            base[self._deleted_mask] = -np.inf
+
+        extra_ids, extra_vectors = self._overlay(allowed)
+        if len(extra_ids):
+            return (np.concatenate([self.doc_ids, extra_ids]),
+                    np.concatenate([base, extra_vectors @ query.T]))
+        return self.doc_ids, base
+
+    @staticmethod
+    def _top(doc_ids, scores, k):
+        """Best ``k`` finite scores as ``(doc_id, score)`` pairs."""
+        if len(scores) == 0 or k <= 0:
+            return []
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(doc_ids[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+
+    def search(self, query_vector, k=4, allowed=None):
+        """
+        Find the chunks most similar to a query embedding.
+
+        Args:
+            query_vector: Unit-length query embedding
+            k: Number of results
+            allowed: Optional filter bitmap over chunk ids
+
+        Returns:
+            list: ``(doc_id, score)`` pairs, best first
+        """
+        doc_ids, scores = self.scores(query_vector, allowed)
+        return self._top(doc_ids, scores, k)
+
+    def search_many(self, query_vectors, k=4, allowed=None):
+        """
+        Search a batch of query embeddings with one matrix product per block of rows.
+
+        Args:
+            query_vectors: ``(q, dim)`` unit-length query embeddings
+            k: Number of results per query
+            allowed: Optional filter bitmap over chunk ids, applied to every query
+
+        Returns:
+            list: One ``search`` result per query
+        """
+        queries = np.asarray(query_vectors, dtype=np.float32).reshape(-1, self.dimension)
+        # Bound the (rows x queries) score matrix to BATCH_SCORE_CELLS
+        step = max(1, self.BATCH_SCORE_CELLS // max(1, len(self.doc_ids) + len(self._extra_ids)))
+        results = []
+        for start in range(0, len(queries), step):
+            doc_ids, scores = self.scores(queries[start:start + step], allowed)
+            results.extend(self._top(doc_ids, column, k) for column in scores.T)
+        return results
@@ -4,10 +4,36 @@ Implements structured reasoning for better decision making and responses
 """
 
 import logging
+import re
 from typing import Dict, List, Any, Optional
 
 logger = logging.getLogger(__name__)
 
+# Farming topics and the keywords that signal them; also used to partition the knowledge index
+FARMING_TOPICS = {
+    'planting': ['plant', 'seed', 'sow', 'germination'],
+    'disease': ['disease', 'sick', 'infection', 'pest', 'problem'],
+    'weather': ['weather', 'rain', 'temperature', 'climate'],
+    'harvest': ['harvest', 'yield', 'crop', 'production'],
+    'soil': ['soil', 'fertilizer', 'nutrients', 'pH'],
+    'general': ['soybean', 'farming', 'agriculture']
+}
+
+
+# Keywords match case-folded whole words plus plural and verb endings, so "rain" is not found in
+# "grain" or "drained" and "pH" matches "PH" but not "phosphorus"
+TOPIC_REGEXES = {
+    topic: re.compile(r"\b(?:" + "|".join(re.escape(keyword.casefold()) for keyword in keywords)
+                      + r")(?:s|es|d|ed|ing)?\b")
+    for topic, keywords in FARMING_TOPICS.items()
+}
+
+
+def detect_topics(text: str) -> List[str]:
+    """Farming topics a text mentions, in FARMING_TOPICS order."""
+    folded = text.casefold()
+    return [topic for topic, regex in TOPIC_REGEXES.items() if regex.search(folded)]
+
 
 class ReACTReasoning:
     """
@@ -83,19 +109,7 @@ class ReACTReasoning:
             question_type = "general_inquiry"
         
         # Analyze farming domain
-        farming_topics = {
-            'planting': ['plant', 'seed', 'sow', 'germination'],
-            'disease': ['disease', 'sick', 'infection', 'pest', 'problem'],
-            'weather': ['weather', 'rain', 'temperature', 'climate'],
-            'harvest': ['harvest', 'yield', 'crop', 'production'],
-            'soil': ['soil', 'fertilizer', 'nutrients', 'pH'],
-            'general': ['soybean', 'farming', 'agriculture']
-        }
-        
-        detected_topics = []
-        for topic, keywords in farming_topics.items():
-            if any(keyword in message_lower for keyword in keywords):
-                detected_topics.append(topic)
+        detected_topics = detect_topics(user_message)
         
         # Consider conversation context
         has_context = bool(memory.strip())
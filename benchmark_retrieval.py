@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Retrieval benchmark for Soya Copilot.
+
+Generates synthetic agronomy corpora of increasing size, builds a fresh
+RAGRetriever over each one in a child process and measures index build
+time, memory, query latency (p50/p99), batch throughput (retrieve_many),
+the share of lexical postings skipped by MaxScore pruning and recall@k
+against a labelled query set. Results are written as JSON so runs can be
+compared.
+
+Usage:
+    python benchmark_retrieval.py
+    python benchmark_retrieval.py --sizes 1000,10000,100000,1000000 --modes lexical,hybrid
+    python benchmark_retrieval.py --modes dense --index-types exact,ivf,pq --output ivf.json
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+CROPS = [
+    "soybean", "maize", "sorghum", "groundnut", "cowpea", "sunflower",
+    "cassava", "wheat", "bean", "cotton", "rice", "millet",
+]
+STAGES = [
+    "emergence", "early vegetative", "late vegetative", "flowering",
+    "pod set", "pod fill", "maturity", "harvest",
+]
+PESTS = [
+    ("soybean rust", "tan lesions with rust-coloured pustules under the leaves"),
+    ("frogeye leaf spot", "grey spots with a purple border"),
+    ("bacterial blight", "angular water-soaked spots that turn brown"),
+    ("powdery mildew", "white powder on the upper leaf surface"),
+    ("downy mildew", "pale yellow patches with grey fuzz beneath"),
+    ("root rot", "wilting plants with dark, decayed roots"),
+    ("stem canker", "sunken reddish-brown lesions at the nodes"),
+    ("pod borer", "holes bored through pods and frass on the seeds"),
+    ("aphids", "curled leaves covered in sticky honeydew"),
+    ("whitefly", "clouds of tiny white insects when plants are shaken"),
+    ("stink bugs", "shrivelled seeds and pods that fail to fill"),
+    ("armyworm", "ragged leaves eaten from the edges inward"),
+    ("leaf miner", "winding pale tunnels inside the leaves"),
+    ("spider mites", "fine webbing and bronzed, speckled leaves"),
+    ("cutworm", "seedlings cut off at the soil line overnight"),
+    ("nematodes", "stunted patches and small galls on the roots"),
+    ("anthracnose", "dark sunken spots on stems and pods"),
+    ("charcoal rot", "grey-black specks inside the lower stem"),
+    ("mosaic virus", "mottled light and dark green leaves"),
+    ("striga", "purple-flowered parasitic weeds attached to roots"),
+]
+SOILS = ["sandy loam", "clay loam", "red laterite", "black cotton", "silty", "volcanic"]
+PRODUCTS = [
+    "a triazole fungicide", "a strobilurin fungicide", "copper oxychloride",
+    "neem seed extract", "a pyrethroid insecticide", "Bacillus thuringiensis",
+    "sulphur dust", "an imidacloprid seed dressing", "mancozeb", "a soap spray",
+]
+SYLLABLES = ["ka", "lu", "mo", "ti", "ren", "sa", "bo", "ne", "dza", "wi", "ha", "ro", "mba", "ke", "zi", "tu"]
+
+SENTENCES = [
+    "During {stage}, {crop} fields in {region} on {soil} soils are at risk from {pest}.",
+    "Scout {crop} every {days} days at {stage} and look for {symptom}.",
+    "In {region}, {pest} usually appears on {crop} around {stage}, especially after {rain} mm of rain.",
+    "If more than {threshold} percent of {crop} plants show {symptom}, treat for {pest} with {product}.",
+    "Apply {product} at {rate} per hectare and avoid spraying when rain is expected within {hours} hours.",
+    "Farmers in {region} reduce {pest} by rotating {crop} with {rotation} for at least {years} seasons.",
+    "Keep {crop} rows {spacing} cm apart so the canopy dries quickly and {pest} spreads more slowly.",
+    "On {soil} soil, add {fertilizer} kg/ha of compost before planting {crop} to strengthen plants against {pest}.",
+    "Remove and burn {crop} plants with {symptom}; do not compost them.",
+    "Extension officers in {region} report yield losses of up to {loss} percent when {pest} is left untreated.",
+    "Resistant {crop} varieties released for {region} tolerate {pest} but still need scouting at {stage}.",
+    "Irrigate {crop} early in the morning during {stage} so leaves are dry before evening.",
+]
+QUERIES = [
+    "How do I control {pest} on {crop} at {stage} in {region}?",
+    "{pest} on my {crop} in {region} during {stage}, what should I do",
+    "Treatment for {symptom} on {crop} in {region} at {stage}",
+    "What causes {symptom} in {crop} fields around {region} at {stage}?",
+]
+
+
+def region_names(count, rng):
+    """Distinct made-up district names."""
+    names = set()
+    while len(names) < count:
+        names.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize())
+    return sorted(names)
+
+
+def generate_corpus(size, seed=42):
+    """
+    Generate ``size`` synthetic extension-guide paragraphs.
+
+    Each paragraph covers one (region, crop, stage, pest) combination, so a
+    question about that combination has exactly one correct paragraph.
+
+    Returns:
+        list: ``(paragraph, facts)`` pairs, ``facts`` being the slot values
+    """
+    rng = random.Random(seed)
+    combos_per_region = len(CROPS) * len(STAGES) * len(PESTS)
+    regions = region_names(max(4, size // combos_per_region * 2 + 4), rng)
+    seen = set()
+    corpus = []
+    while len(corpus) < size:
+        combo = (rng.choice(regions), rng.choice(CROPS), rng.choice(STAGES), rng.randrange(len(PESTS)))
+        if combo in seen:
+            continue
+        seen.add(combo)
+        region, crop, stage, pest_index = combo
+        pest, symptom = PESTS[pest_index]
+        facts = {
+            "region": region, "crop": crop, "stage": stage, "pest": pest, "symptom": symptom,
+            "soil": rng.choice(SOILS), "product": rng.choice(PRODUCTS),
+            "rotation": rng.choice([c for c in CROPS if c != crop]),
+            "days": rng.randint(3, 14), "rain": rng.randint(10, 80), "threshold": rng.randint(5, 40),
+            "rate": f"{rng.randint(1, 30) / 10:.1f} l", "hours": rng.randint(2, 24),
+            "years": rng.randint(1, 4), "spacing": rng.choice([30, 45, 50, 60, 75]),
+            "fertilizer": rng.randint(2, 20) * 100, "loss": rng.randint(10, 80),
+        }
+        sentences = [SENTENCES[0]] + rng.sample(SENTENCES[1:], 6)
+        corpus.append((" ".join(s.format(**facts) for s in sentences), facts))
+    return corpus
+
+
+def labelled_queries(corpus, count, seed=7):
+    """
+    Questions paired with the paragraph that answers them.
+
+    Returns:
+        list: ``(query, answer_paragraph)`` pairs
+    """
+    rng = random.Random(seed)
+    picks = rng.sample(range(len(corpus)), min(count, len(corpus)))
+    return [(rng.choice(QUERIES).format(**corpus[i][1]), corpus[i][0]) for i in picks]
+
+
+def write_corpus(corpus, directory, paragraphs_per_file=1000):
+    """Write paragraphs as blank-line separated text files, like real knowledge files."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    for start in range(0, len(corpus), paragraphs_per_file):
+        text = "\n\n".join(paragraph for paragraph, _ in corpus[start:start + paragraphs_per_file])
+        (directory / f"guide_{start // paragraphs_per_file:05d}.txt").write_text(text, encoding='utf-8')
+
+
+def rss_mb():
+    """Current resident set size of this process in MB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _round(value, digits=1):
+    return None if value is None else round(value, digits)
+
+
+def directory_mb(path):
+    """Total size of the files below a directory in MB."""
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file()) / 2**20
+
+
+def run_benchmark(corpus_dir, queries, mode, index_type, k, work_dir):
+    """
+    Build one retriever and measure it. Runs in a fresh child process so
+    memory numbers are not polluted by earlier runs.
+
+    Returns:
+        dict: Measurements for this (corpus, mode, index type)
+    """
+    with redirect_stdout(io.StringIO()):
+        from config import Config
+        from agents.chat.rag_retriever import RAGRetriever, dense_index_report
+    Config.RETRIEVAL_MODE = mode
+    Config.VECTOR_INDEX_TYPE = index_type
+    Config.RETRIEVAL_CACHE_SIZE = 0  # Measure search, not the result cache
+    Config.KNOWLEDGE_CACHE_DIR = os.path.join(work_dir, "knowledge")
+    Config.VECTOR_INDEX_PATH = os.path.join(work_dir, "vectors", "embeddings.npy")
+    Config.EMBEDDING_CACHE_PATH = os.path.join(work_dir, "embeddings.sqlite3")
+
+    rss_before = rss_mb()
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        retriever = RAGRetriever(knowledge_dir=corpus_dir, knowledge_pack="")
+    build_seconds = time.perf_counter() - started
+    rss_after = rss_mb()
+
+    if mode != "lexical" and retriever.dense_index is None:
+        return {"skipped": "dense index unavailable (is sentence-transformers installed?)"}
+    index_report = None
+    if retriever.dense_index is not None:
+        with redirect_stdout(io.StringIO()):
+            index_report = dense_index_report(retriever.dense_index)
+
+    for query, _ in queries[:5]:
+        retriever.retrieve(query, k=k)
+
+    pruning = dict(retriever.lexical_index.pruning_stats)
+    latencies, ranks = [], []
+    for query, answer in queries:
+        started = time.perf_counter()
+        results = retriever.retrieve(query, k=k)
+        latencies.append((time.perf_counter() - started) * 1000)
+        # Chunks may hold several paragraphs: a hit is any chunk containing the answer
+        texts = [doc["page_content"] for doc in results]
+        ranks.append(next((rank for rank, text in enumerate(texts, 1) if answer in text), None))
+
+    latencies = np.array(latencies)
+    postings, read = (retriever.lexical_index.pruning_stats[key] - pruning[key] for key in ("postings", "read"))
+    started = time.perf_counter()
+    retriever.retrieve_many([query for query, _ in queries], k=k)
+    batch_seconds = time.perf_counter() - started
+    return {
+        "indexed_chunks": sum(1 for _ in retriever.knowledge_base.live_ids()),
+        "duplicates_dropped": retriever.duplicates_dropped,
+        "build_seconds": round(build_seconds, 3),
+        "rss_mb": _round(rss_after),
+        "index_rss_mb": _round(rss_after - rss_before) if rss_before is not None else None,
+        "peak_rss_mb": _round(peak_rss_mb()),
+        "index_disk_mb": round(directory_mb(work_dir), 2),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies, 50)), 3),
+            "p99": round(float(np.percentile(latencies, 99)), 3),
+            "mean": round(float(latencies.mean()), 3),
+        },
+        "throughput_qps": {
+            "single": round(len(queries) / (latencies.sum() / 1000), 1),
+            "batch": round(len(queries) / batch_seconds, 1),
+        },
+        # Postings of the query terms that single-query lexical search never read
+        "lexical_postings": {
+            "total": postings,
+            "read": read,
+            "skipped_ratio": round(1 - read / postings, 4) if postings else None,
+        },
+        f"recall@{k}": round(sum(rank is not None for rank in ranks) / len(ranks), 4),
+        "recall@1": round(sum(rank == 1 for rank in ranks) / len(ranks), 4),
+        "mrr": round(sum(1 / rank for rank in ranks if rank) / len(ranks), 4),
+        # Approximate dense index against exact search on its own vectors
+        "dense_index": index_report,
+    }
+
+
+def main():
+    """Run the benchmark matrix and write the JSON report."""
+    parser = argparse.ArgumentParser(description="Benchmark RAGRetriever on synthetic agronomy corpora")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="Comma-separated corpus sizes in paragraphs (up to 1000000)")
+    parser.add_argument("--modes", default="lexical,dense,hybrid", help="Retrieval modes to run")
+    parser.add_argument("--index-types", default="exact",
+                        help="Dense index types for dense and hybrid modes (exact, ivf, int8, pq)")
+    parser.add_argument("--queries", type=int, default=200, help="Labelled queries per corpus")
+    parser.add_argument("--k", type=int, default=5, help="Results per query (recall@k)")
+    parser.add_argument("--seed", type=int, default=42, help="Corpus random seed")
+    parser.add_argument("--output", default=f"retrieval_benchmark_{time.strftime('%Y%m%d_%H%M%S')}.json",
+                        help="JSON report path")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    modes = [mode.strip() for mode in args.modes.split(",")]
+    index_types = [index_type.strip() for index_type in args.index_types.split(",")]
+
+    print("📊 Soya Copilot Retrieval Benchmark")
+    print("=" * 40)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": vars(args),
+        "runs": [],
+    }
+    spawn = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="soya_bench_") as tmp:
+        for size in sizes:
+            print(f"\n📚 Corpus of {size:,} paragraphs")
+            corpus = generate_corpus(size, args.seed)
+            queries = labelled_queries(corpus, args.queries)
+            corpus_dir = Path(tmp) / f"corpus_{size}"
+            write_corpus(corpus, corpus_dir)
+            del corpus
+
+            for mode in modes:
+                for index_type in (index_types if mode != "lexical" else ["-"]):
+                    work_dir = tempfile.mkdtemp(dir=tmp)
+                    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                        result = pool.submit(
+                            run_benchmark, str(corpus_dir), queries, mode, index_type, args.k, work_dir
+                        ).result()
+                    run = {"paragraphs": size, "mode": mode, "index_type": index_type, **result}
+                    report["runs"].append(run)
+                    label = mode if index_type == "-" else f"{mode}/{index_type}"
+                    if "skipped" in run:
+                        print(f"   ⏭️  {label}: skipped, {run['skipped']}")
+                        continue
+                    print(f"   ✅ {label}: build {run['build_seconds']:.1f}s, "
+                          f"+{run['index_rss_mb'] or 0:.0f} MB, p50 {run['latency_ms']['p50']:.2f} ms, "
+                          f"p99 {run['latency_ms']['p99']:.2f} ms, batch {run['throughput_qps']['batch']:.0f} q/s, "
+                          f"postings skipped {run['lexical_postings']['skipped_ratio'] or 0:.0%}, "
+                          f"recall@{args.k} {run[f'recall@{args.k}']:.3f}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
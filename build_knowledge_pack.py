@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Build a versioned knowledge pack for Soya Copilot.
+
+Compiles the knowledge folder (built-in facts, text, markdown and PDFs)
+into one pack holding the chunks, the lexical index, optional embeddings
+and a manifest, then points data/packs/current at it. API workers load
+the pack memory-mapped at startup instead of re-parsing every file, and
+running workers switch to a newly activated pack on their next watcher
+scan.
+
+Usage:
+    python build_knowledge_pack.py
+    python build_knowledge_pack.py --embeddings --keep 5
+    python build_knowledge_pack.py --no-activate        # build only; activate later
+    python build_knowledge_pack.py --activate 20240601-120000-ab12cd34ef56
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from config import Config
+from agents.chat.embeddings import SENTENCE_TRANSFORMERS_AVAILABLE, EmbeddingCache, SentenceEmbedder
+from agents.chat.knowledge_cache import file_digest
+from agents.chat.knowledge_loader import KNOWLEDGE_EXTENSIONS
+from agents.chat.knowledge_pack import KnowledgePack, activate_pack, pack_version, prune_packs, resolve_pack, write_pack
+from agents.chat.metadata import FILE_METADATA_SUFFIX, FOLDER_METADATA_NAME
+from agents.chat.rag_retriever import (
+    BUILTIN_SOURCE, RAGRetriever, build_dense_index, dense_index_report, dense_manifest
+)
+from agents.reasoning.react_agent import FARMING_TOPICS
+
+
+def relative_source(source, knowledge_dir):
+    """Store file sources relative to the knowledge folder so packs can move between machines."""
+    if source == BUILTIN_SOURCE:
+        return source
+    return Path(source).resolve().relative_to(knowledge_dir.resolve()).as_posix()
+
+
+def source_digests(knowledge_dir):
+    """SHA-256 of every knowledge file and metadata sidecar, keyed by path relative to the folder."""
+    knowledge_dir = Path(knowledge_dir)
+    if not knowledge_dir.exists():
+        return {}
+    return {
+        path.relative_to(knowledge_dir).as_posix(): file_digest(path)
+        for path in sorted(knowledge_dir.rglob('*'))
+        if path.is_file() and (path.suffix.lower() in KNOWLEDGE_EXTENSIONS or path.name == FOLDER_METADATA_NAME
+                               or path.name.endswith(FILE_METADATA_SUFFIX))
+    }
+
+
+def pack_settings():
+    """Settings that change a pack's chunks or their metadata; a pack built with other values is stale."""
+    return {
+        "chunk_max_tokens": Config.CHUNK_MAX_TOKENS,
+        "chunk_overlap_tokens": Config.CHUNK_OVERLAP_TOKENS,
+        "dedup_similarity": Config.DEDUP_SIMILARITY,
+        # Word-boundary topic matching; packs tagged by the old substring match lack this key
+        "topic_keywords": FARMING_TOPICS,
+    }
+
+
+def build_pack(knowledge_dir, packs_dir, embeddings=False):
+    """
+    Compile a knowledge folder into a new pack version.
+
+    Args:
+        knowledge_dir: Folder of knowledge files
+        packs_dir: Folder holding pack versions
+        embeddings: Also embed the chunks and store the dense index
+
+    Returns:
+        Path: The new pack folder (not yet activated)
+    """
+    knowledge_dir = Path(knowledge_dir)
+    # Hashed before parsing, so a file edited mid-build makes the pack stale rather than current
+    digests = source_digests(knowledge_dir)
+    # Chunks come from the same pipeline the API uses; the dense index is built separately below
+    retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack="", retrieval_mode="lexical")
+    doc_ids = list(retriever.knowledge_base.live_ids())
+    texts = [retriever.knowledge_base[i] for i in doc_ids]
+    sources = [relative_source(retriever.chunk_sources[i], knowledge_dir) for i in doc_ids]
+    fingerprints = {relative_source(path, knowledge_dir): fp for path, fp in retriever.source_fingerprints.items()}
+    version = pack_version(texts)
+
+    write_embeddings = None
+    if embeddings:
+        def write_embeddings(pack_dir):
+            embedder = SentenceEmbedder(Config.EMBEDDING_MODEL, cache=EmbeddingCache(Config.EMBEDDING_CACHE_PATH))
+            print(f"🧮 Embedding {len(texts)} chunks with {Config.EMBEDDING_MODEL}...")
+            vectors = embedder.encode(texts)
+            manifest = dense_manifest(f"pack:{version}", len(texts))
+            index = build_dense_index(pack_dir / "embeddings.npy", list(range(len(texts))), vectors, manifest)
+            # Checked here, once per pack, rather than by every API worker that loads it
+            dense_index_report(index, vectors)
+            return {"file": "embeddings.npy", **manifest}
+
+    pack_dir = write_pack(
+        packs_dir, version, texts, sources, retriever.lexical_index, doc_ids,
+        metadata_index=retriever.metadata_index,
+        fingerprints=fingerprints,
+        digests=digests,
+        settings={**pack_settings(), "duplicates_dropped": retriever.duplicates_dropped},
+        write_embeddings=write_embeddings,
+    )
+    print(f"   📚 {len(texts)} chunks from {len(set(sources))} sources")
+    return pack_dir
+
+
+def pack_is_current(pack, knowledge_dir):
+    """
+    True if a pack was built from the knowledge files as they are now.
+
+    Files and metadata sidecars are compared by content hash, so a
+    same-size edit still counts as a change, and the pack must have been
+    built with the current chunking and dedup settings.
+    """
+    settings = pack.settings
+    if any(settings.get(name) != value for name, value in pack_settings().items()):
+        return False
+    return pack.digests == source_digests(knowledge_dir)
+
+
+def ensure_pack(knowledge_dir, packs_dir, keep=3):
+    """
+    Build and activate a pack unless the active one matches the knowledge folder.
+
+    Run once per node before the API workers start, so they all map the
+    same pack instead of each parsing the knowledge files.
+
+    Returns:
+        str: The new version, or None if the active pack was current
+    """
+    pack = KnowledgePack.open(Path(packs_dir) / "current")
+    if pack is not None and pack_is_current(pack, knowledge_dir):
+        return None
+    pack_dir = build_pack(knowledge_dir, packs_dir)
+    activate_pack(packs_dir, pack_dir.name)
+    if keep:
+        prune_packs(packs_dir, keep=keep)
+    return pack_dir.name
+
+
+def main():
+    """Build, activate and prune knowledge packs."""
+    default_packs = Path(Config.KNOWLEDGE_PACK_PATH).parent
+    parser = argparse.ArgumentParser(description="Build a versioned knowledge pack")
+    parser.add_argument("--knowledge-dir", default=str(Path(__file__).parent / "data" / "knowledge"),
+                        help="Folder of knowledge files")
+    parser.add_argument("--output", default=str(default_packs), help="Folder holding pack versions")
+    parser.add_argument("--embeddings", action="store_true",
+                        help="Embed the chunks and include the dense index (needs sentence-transformers)")
+    parser.add_argument("--no-activate", action="store_true", help="Build without switching 'current'")
+    parser.add_argument("--activate", metavar="VERSION", help="Only point 'current' at an existing version")
+    parser.add_argument("--keep", type=int, default=3, help="Pack versions to keep (0 = keep all)")
+    args = parser.parse_args()
+
+    packs_dir = Path(args.output)
+    if args.activate:
+        if resolve_pack(packs_dir / args.activate) is None:
+            print(f"❌ No pack {args.activate} in {packs_dir}")
+            return 1
+        activate_pack(packs_dir, args.activate)
+        print(f"✅ Activated knowledge pack {args.activate}")
+        return 0
+
+    print("📦 Building Soya Copilot Knowledge Pack")
+    print("=" * 40)
+    started = time.perf_counter()
+    if args.embeddings and not SENTENCE_TRANSFORMERS_AVAILABLE:
+        print("❌ --embeddings needs sentence-transformers (pip install sentence-transformers)")
+        return 1
+    pack_dir = build_pack(Path(args.knowledge_dir), packs_dir, embeddings=args.embeddings)
+    version = pack_dir.name
+    size_mb = sum(f.stat().st_size for f in pack_dir.iterdir()) / 2**20
+    print(f"✅ Built pack {version}: {size_mb:.1f} MB in {time.perf_counter() - started:.1f}s")
+
+    if not args.no_activate:
+        activate_pack(packs_dir, version)
+        print(f"🔀 {packs_dir / 'current'} -> {version}")
+    if args.keep:
+        for removed in prune_packs(packs_dir, keep=args.keep):
+            print(f"   🗑️  Removed old pack {removed}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -25,6 +25,10 @@ class Config:
     # Data Storage Paths
     CHROMADB_PATH = os.getenv("CHROMADB_PATH", "./data/chromadb")
     MODEL_PATH = os.getenv("MODEL_PATH", "./data/models/yolov8_soybean.pt")
+    KNOWLEDGE_CACHE_DIR = os.getenv("KNOWLEDGE_CACHE_DIR", "./data/cache/knowledge")
+    VECTOR_INDEX_PATH = os.getenv("VECTOR_INDEX_PATH", "./data/cache/vectors/embeddings.npy")
+    EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "./data/cache/embeddings.sqlite3")
+    KNOWLEDGE_PACK_PATH = os.getenv("KNOWLEDGE_PACK_PATH", "./data/packs/current")
     
     # Application Settings
     MAX_MEMORY = int(os.getenv("MAX_MEMORY", "4"))
@@ -32,6 +36,53 @@ class Config:
     API_PORT = int(os.getenv("API_PORT", "8000"))
     WHATSAPP_BOT_PORT = int(os.getenv("WHATSAPP_BOT_PORT", "5000"))
     
+    # Knowledge Ingestion (0 workers = one per CPU)
+    KNOWLEDGE_WORKERS = int(os.getenv("KNOWLEDGE_WORKERS", "0"))
+    KNOWLEDGE_PDF_PAGES_PER_TASK = int(os.getenv("KNOWLEDGE_PDF_PAGES_PER_TASK", "25"))
+    CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+    CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "40"))
+    DEDUP_SIMILARITY = float(os.getenv("DEDUP_SIMILARITY", "0.8"))
+    
+    # Knowledge Retrieval ("lexical", "dense" or "hybrid")
+    RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "lexical").lower()
+    HYBRID_DENSE_BUDGET_MS = float(os.getenv("HYBRID_DENSE_BUDGET_MS", "250"))
+    QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+    RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "512"))
+    RETRIEVAL_CACHE_TTL = float(os.getenv("RETRIEVAL_CACHE_TTL", "600"))
+    # Queries naming at most this many farming topics search only those topics' chunks (0 = off)
+    TOPIC_ROUTING_MAX_TOPICS = int(os.getenv("TOPIC_ROUTING_MAX_TOPICS", "2"))
+    # Routed queries are searched again over everything when their results hold less than this
+    # share of the query's idf weight (the partitions miss the query's rarer words; 0 = off)
+    TOPIC_ROUTING_MIN_SCORE = float(os.getenv("TOPIC_ROUTING_MIN_SCORE", "0.5"))
+    # Most edits between a misspelled query word and the indexed term it is searched as (0 = off)
+    SPELLING_MAX_DISTANCE = int(os.getenv("SPELLING_MAX_DISTANCE", "2"))
+    # Shard processes the knowledge is split across (1 = search in the API process). Every API
+    # worker starts its own shards, so sharding is skipped when API_WORKERS (set by gunicorn) > 1
+    RETRIEVAL_SHARDS = int(os.getenv("RETRIEVAL_SHARDS", "1"))
+    API_WORKERS = int(os.getenv("API_WORKERS", "1"))
+    
+    # Prompt Context (token budget for retrieved knowledge, 0 = no limit)
+    CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "400"))
+    
+    # Dense Index ("exact", "ivf", "int8", "pq" or "chroma"; 0 lists = about 4 * sqrt(chunks),
+    # 0 subspaces = one per 4 dimensions, rerank 0 = no full-precision reranking)
+    VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "exact").lower()
+    ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))
+    ANN_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+    PQ_SUBSPACES = int(os.getenv("PQ_SUBSPACES", "0"))
+    VECTOR_RERANK = int(os.getenv("VECTOR_RERANK", "10"))
+    
+    # Chroma Store (VECTOR_INDEX_TYPE=chroma; empty host = local store at CHROMADB_PATH)
+    # CHROMA_COLLECTION is a prefix: each knowledge folder gets its own collection
+    CHROMA_HOST = os.getenv("CHROMA_HOST", "")
+    CHROMA_PORT = int(os.getenv("CHROMA_PORT", "8000"))
+    CHROMA_COLLECTION = os.getenv("CHROMA_COLLECTION", "soybean_knowledge")
+    CHROMA_BATCH_SIZE = int(os.getenv("CHROMA_BATCH_SIZE", "5000"))
+    
+    # Live Knowledge Updates (0 seconds = watcher disabled, empty key = uploads disabled)
+    KNOWLEDGE_WATCH_INTERVAL = float(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "10"))
+    KNOWLEDGE_API_KEY = os.getenv("KNOWLEDGE_API_KEY", "")
+    
     @classmethod
     def validate(cls):
         """Validate required configuration."""
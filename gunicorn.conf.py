@@ -8,6 +8,8 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.getenv('WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# Tells the app how many workers share the node (retrieval shards are only started with one)
+os.environ.setdefault('API_WORKERS', str(workers))
 worker_class = "uvicorn.workers.UvicornWorker"
 worker_connections = 1000
 timeout = 30
@@ -44,6 +46,21 @@ preload_app = True
 graceful_timeout = 30
 timeout = 30
 
+def on_starting(server):
+    # Build the knowledge pack once in the master; every worker then maps the
+    # same read-only files instead of holding its own copy of the corpus
+    from pathlib import Path
+    from config import Config
+    if not Config.KNOWLEDGE_PACK_PATH:
+        return
+    try:
+        from build_knowledge_pack import ensure_pack
+        version = ensure_pack(Path(__file__).parent / "data" / "knowledge", Path(Config.KNOWLEDGE_PACK_PATH).parent)
+        if version:
+            server.log.info("📦 Built knowledge pack %s", version)
+    except Exception as e:
+        server.log.warning("⚠️  Could not build knowledge pack, workers will index files themselves: %s", e)
+
 def when_ready(server):
     server.log.info("🌱 Soya Copilot API server is ready")
 
@@ -1,12 +1,16 @@
 """FastAPI backend for Soya Copilot."""
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
+from pathlib import Path
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
 from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from agents.orchestrator import SoyaCopilotOrchestrator
+from agents.chat.knowledge_loader import KNOWLEDGE_EXTENSIONS
 from config import Config
 import uvicorn
+import hmac
 import logging
 import time
 import os
@@ -29,6 +33,7 @@ logger = logging.getLogger(__name__)
 
 # Global orchestrator variable
 orchestrator = None
+knowledge_watcher = None
 
 
 @asynccontextmanager
@@ -39,7 +44,7 @@ async def lifespan(app: FastAPI):
     logger.info(f"📍 API running on http://{Config.API_HOST}:{Config.API_PORT}")
     
     # Initialize orchestrator
-    global orchestrator
+    global orchestrator, knowledge_watcher
     try:
         orchestrator = SoyaCopilotOrchestrator()
         logger.info("✅ Orchestrator initialized successfully")
@@ -47,6 +52,11 @@ async def lifespan(app: FastAPI):
         logger.error(f"❌ Failed to initialize orchestrator: {str(e)}")
         orchestrator = None
     
+    # Pick up knowledge files added or changed while running
+    if orchestrator is not None and Config.KNOWLEDGE_WATCH_INTERVAL > 0:
+        knowledge_watcher = orchestrator.chat_agent.rag_retriever.watch(Config.KNOWLEDGE_WATCH_INTERVAL)
+        logger.info(f"👀 Watching knowledge folder every {Config.KNOWLEDGE_WATCH_INTERVAL:g}s")
+    
     # Configuration warnings
     if not Config.GROQ_API_KEY:
         logger.warning("⚠️  GROQ_API_KEY not configured - chat features will not work")
@@ -57,6 +67,8 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("🛑 Soya Copilot API shutting down...")
+    if knowledge_watcher is not None:
+        knowledge_watcher.stop()
 
 
 # Create FastAPI app with lifespan
@@ -106,6 +118,7 @@ async def root():
         "version": "1.0.0",
         "endpoints": {
             "chat": "/chat (POST)",
+            "knowledge": "/knowledge (POST)",
             "health": "/health (GET)",
             "docs": "/docs (GET)"
         }
@@ -167,6 +180,68 @@ async def chat_endpoint(
         }
 
 
+@app.post("/knowledge")
+async def knowledge_upload_endpoint(
+    file: UploadFile = File(...),
+    x_api_key: str = Header(None)
+):
+    """
+    Add or update a knowledge file without restarting the API.
+    
+    Accepts:
+    - file: PDF, text or markdown document
+    - X-API-Key header: must match KNOWLEDGE_API_KEY
+    
+    The file is extracted first and only then saved to data/knowledge/, so
+    a file that cannot be read never replaces the current one. Only its
+    chunks are re-indexed; other workers pick it up through their
+    knowledge folder watcher.
+    """
+    if not Config.KNOWLEDGE_API_KEY:
+        raise HTTPException(status_code=403, detail="Knowledge uploads are disabled")
+    if not x_api_key or not hmac.compare_digest(x_api_key, Config.KNOWLEDGE_API_KEY):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+    if orchestrator is None:
+        raise HTTPException(
+            status_code=503,
+            detail="Service unavailable - orchestrator not initialized"
+        )
+    
+    filename = Path(file.filename or "").name
+    if not filename or Path(filename).suffix.lower() not in KNOWLEDGE_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type. Allowed: {', '.join(KNOWLEDGE_EXTENSIONS)}"
+        )
+    
+    retriever = orchestrator.chat_agent.rag_retriever
+    target = retriever.knowledge_dir / filename
+    # Staged beside the target so it can be renamed into place once it extracts
+    tmp_path = target.with_name(f".{filename}.upload")
+    try:
+        content = await file.read()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path.write_bytes(content)
+        
+        added, removed = await run_in_threadpool(retriever.upsert_document, target, tmp_path)
+        logger.info(f"Knowledge updated from {filename}: +{added}/-{removed} chunks")
+        return {
+            "success": True,
+            "file": filename,
+            "chunks_added": added,
+            "chunks_removed": removed,
+            "knowledge_version": retriever.knowledge_version
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except OSError as e:
+        logger.error(f"Error saving knowledge file: {str(e)}")
+        raise HTTPException(status_code=500, detail="Could not save knowledge file")
+    finally:
+        # Left behind only when the upload was rejected
+        tmp_path.unlink(missing_ok=True)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint."""
@@ -189,7 +264,9 @@ async def metrics():
     return {
         "service": "soya-copilot",
         "status": "running",
-        "orchestrator_status": "ready" if orchestrator else "not_ready"
+        "orchestrator_status": "ready" if orchestrator else "not_ready",
+        "knowledge_cache": orchestrator.chat_agent.rag_retriever.cache_stats() if orchestrator else None,
+        "context_packing": dict(orchestrator.chat_agent.context_packer.stats) if orchestrator else None
     }
 
 
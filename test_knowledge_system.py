@@ -23,11 +23,8 @@ def test_simple_chromadb():
         import chromadb
         print(f"  ✅ ChromaDB: {chromadb.__version__}")
         
-        from langchain_chroma import Chroma
-        print("  ✅ LangChain Chroma")
-        
-        from langchain_huggingface import HuggingFaceEmbeddings
-        print("  ✅ HuggingFace Embeddings")
+        import sentence_transformers
+        print(f"  ✅ Sentence Transformers: {sentence_transformers.__version__}")
         
     except ImportError as e:
         print(f"  ❌ Import failed: {e}")
@@ -36,7 +33,12 @@ def test_simple_chromadb():
     # Test RAG retriever initialization
     print("\n🔍 Testing RAG Retriever:")
     try:
+        from agents.chat.chroma_index import ChromaVectorIndex
         from agents.chat.rag_retriever import RAGRetriever
+        from config import Config
+        
+        Config.RETRIEVAL_MODE = "dense"
+        Config.VECTOR_INDEX_TYPE = "chroma"
         
         # Create test directory
         test_dir = "./test_simple_chromadb"
@@ -53,8 +55,8 @@ def test_simple_chromadb():
             print(f"  📋 Sample: {results[0]['page_content'][:50]}...")
         
         # Check if vector store is actually working
-        if retriever.use_vector_store:
-            print("  ✅ Vector store is active")
+        if isinstance(retriever.dense_index, ChromaVectorIndex):
+            print(f"  ✅ Chroma store is active ({len(retriever.dense_index)} chunks)")
         else:
             print("  ⚠️  Using keyword search fallback")
         
@@ -0,0 +1,1358 @@
+#!/usr/bin/env python3
+"""
+Test script for the knowledge retrieval indexes.
+"""
+
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from benchmark_retrieval import generate_corpus, labelled_queries, write_corpus
+from build_knowledge_pack import build_pack, ensure_pack, pack_is_current
+from agents.chat.ann_index import IVFIndex, recall_report
+from agents.chat.chroma_index import CHROMADB_AVAILABLE, ChromaVectorIndex, content_id, corpus_collection_name
+from agents.chat.chunker import TokenChunker, count_tokens
+from agents.chat.context_packer import ContextPacker, split_sentences
+from agents.chat.dedup import NearDuplicateFilter
+from agents.chat.embeddings import EmbeddingCache, SentenceEmbedder
+from agents.chat.fusion import reciprocal_rank_fusion
+from agents.chat.knowledge_cache import KnowledgeCache
+from agents.chat import knowledge_loader
+from agents.chat.knowledge_loader import KnowledgeLoader, iter_paragraphs, split_paragraphs, strip_page_edges
+from agents.chat.knowledge_pack import KnowledgePack, activate_pack, prune_packs, resolve_pack
+from agents.chat.knowledge_watcher import KnowledgeWatcher
+from agents.chat.lexical_index import BM25Index, PackedBM25Index, correct_query, phrases, tokenize
+from agents.chat.metadata import GENERAL_TOPIC, MetadataIndex, detect_chunk_topics, detect_crop_stages
+from agents.chat.positions import decode_document, encode_document, min_distance
+from agents.chat.quantization import ProductQuantizedIndex, QuantizedIndex, ScalarQuantizedIndex, quantization_report
+from agents.chat.rag_retriever import RAGRetriever, dense_index_report, shard_of
+from agents.chat.result_cache import RetrievalCache
+from agents.chat.sharding import ShardedRetriever, sharding_enabled
+from agents.chat.spelling import SpellingIndex, edit_distance
+from agents.chat.text_store import SPILL_FLUSH_BYTES, TextStore
+from agents.chat.vector_index import DenseVectorIndex
+from agents.reasoning.react_agent import detect_topics
+from config import Config
+
+
+def test_bm25_index():
+    """Test BM25 tokenization and ranking."""
+
+    print("🔎 Testing BM25 Index")
+    print("=" * 40)
+
+    documents = [
+        "Soybeans grow best in temperatures between 20°C and 30°C.",
+        "Apply 200 kg/ha of NPK fertilizer at planting.",
+        "Frogeye leaf spot is a fungal disease of soybean leaves.",
+        "Harvest when leaves turn yellow and pods are dry.",
+    ]
+    index = BM25Index(documents)
+
+    tokens = tokenize("The soybeans are in the fields")
+    print(f"  Tokens: {tokens}")
+    assert tokens == ["soybean", "field"]
+
+    hits = index.search("how much fertilizer", k=2)
+    print(f"  Fertilizer hits: {hits}")
+    assert hits[0][0] == 1
+
+    hits = index.search("soybean disease", k=4)
+    print(f"  Disease hits: {hits}")
+    assert hits[0][0] == 2
+    assert {doc_id for doc_id, _ in hits} == {0, 2}
+
+    assert index.search("the and of", k=4) == []
+    print("  ✅ BM25 ranking works")
+
+
+def test_knowledge_cache():
+    """Test that cached paragraphs follow file fingerprints."""
+
+    print("\n📦 Testing Knowledge Cache")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "guide.txt")
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("Plant soybeans in warm soil.")
+
+        cache = KnowledgeCache(os.path.join(tmp, "cache"))
+        assert cache.get(source) is None
+        cache.put(source, ["Plant soybeans in warm soil."])
+        assert cache.get(source) == ["Plant soybeans in warm soil."]
+
+        # Touching the file keeps the entry because the content hash matches
+        stat = os.stat(source)
+        os.utime(source, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert cache.get(source) == ["Plant soybeans in warm soil."]
+
+        with open(source, "w", encoding="utf-8") as f:
+            f.write("Plant soybeans in cool soil.")
+        assert cache.get(source) is None
+
+        # Paragraphs are written as they stream through; a stream left unfinished leaves no entry
+        stream = cache.store(source, iter(["Plant soybeans", "in cool soil."]))
+        assert next(stream) == "Plant soybeans"
+        stream.close()
+        assert not cache.contains(source)
+        assert list(cache.store(source, iter(["Plant soybeans in cool soil."]))) == ["Plant soybeans in cool soil."]
+        assert cache.contains(source) and cache.get(source) == ["Plant soybeans in cool soil."]
+
+        # Pruning one folder leaves the entries of files elsewhere
+        os.makedirs(os.path.join(tmp, "other"))
+        elsewhere = os.path.join(tmp, "other", "notes.txt")
+        with open(elsewhere, "w", encoding="utf-8") as f:
+            f.write("Harvest at 13% moisture.")
+        cache.put(elsewhere, ["Harvest at 13% moisture."])
+        cache.prune([], os.path.join(tmp, "other"))
+        assert cache.contains(source) and not cache.contains(elsewhere)
+        cache.prune([], tmp)
+        assert not os.listdir(os.path.join(tmp, "cache"))
+    print("  ✅ Knowledge cache works")
+
+
+def test_knowledge_loader():
+    """Test deterministic ingestion order and the timing report."""
+
+    print("\n📚 Testing Knowledge Loader")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_dir = Path(tmp) / "knowledge"
+        (knowledge_dir / "diseases").mkdir(parents=True)
+        (knowledge_dir / "b.md").write_text("Second file.", encoding="utf-8")
+        (knowledge_dir / "a.txt").write_text("First file.\n\nStill first.", encoding="utf-8")
+        (knowledge_dir / "diseases" / "rust.txt").write_text("Soybean rust.", encoding="utf-8")
+
+        loader = KnowledgeLoader(KnowledgeCache(Path(tmp) / "cache"), workers=4)
+        knowledge = [p for _, paragraphs in loader.load(knowledge_dir) for p in paragraphs]
+        print(f"  Loaded: {knowledge}")
+        assert knowledge == ["First file.", "Still first.", "Second file.", "Soybean rust."]
+        assert [entry["cached"] for entry in loader.report] == [False, False, False]
+
+        loader = KnowledgeLoader(KnowledgeCache(Path(tmp) / "cache"), workers=1)
+        assert [p for _, paragraphs in loader.load(knowledge_dir) for p in paragraphs] == knowledge
+        assert all(entry["cached"] for entry in loader.report)
+    print("  ✅ Knowledge loader works")
+
+
+def test_streaming_pdf_extraction():
+    """Test page-by-page paragraph splitting and skipping of unreadable pages."""
+
+    print("\n📑 Testing Streaming PDF Extraction")
+    print("=" * 40)
+
+    rng = random.Random(3)
+    pieces = ["Soybean", " rust", "\n", "\n\n", "\n\n\n", " spreads in humid weather."]
+    for _ in range(200):
+        pages = ["".join(rng.choice(pieces) for _ in range(rng.randint(0, 8))) for _ in range(rng.randint(0, 6))]
+        joined = "".join(page + "\n" for page in pages)
+        assert list(iter_paragraphs(pages, min_length=10)) == split_paragraphs(joined, min_length=10)
+
+    # Pages without blank lines are cut at a page end once the paragraph gets too long
+    assert [len(p) for p in iter_paragraphs(["x" * 30] * 5, max_chars=50)] == [61, 61, 30]
+
+    def fake_extract(pdf_path, start=0, end=None):
+        if start == 2:
+            raise ValueError("damaged xref")
+        skipped = [4] if start == 4 else []
+        texts = [f"Page {i} explains soybean planting depth and spacing.\n"
+                 for i in range(start, end) if i not in skipped]
+        return texts, skipped, 0.01
+
+    original = knowledge_loader.extract_pdf_pages, knowledge_loader.pdf_page_count
+    knowledge_loader.extract_pdf_pages = fake_extract
+    knowledge_loader.pdf_page_count = lambda pdf_path: 6
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            pdf_path = Path(tmp) / "manual.pdf"
+            pdf_path.write_bytes(b"%PDF-1.4")
+            loader = KnowledgeLoader(KnowledgeCache(Path(tmp) / "cache"), workers=1, pages_per_task=2)
+            # Fresh PDFs are a stream, cached once read to the end
+            paragraphs = list(loader.load_file(pdf_path))
+            assert loader.cache.get(pdf_path) == paragraphs
+    finally:
+        knowledge_loader.extract_pdf_pages, knowledge_loader.pdf_page_count = original
+    print(f"  Paragraphs: {paragraphs}")
+    assert [p.split()[1] for p in paragraphs] == ["0", "1", "5"]
+    assert loader.report[0]["skipped_pages"] == 3
+    print("  ✅ Streaming PDF extraction works")
+
+
+def test_live_knowledge_updates():
+    """Test incremental add, update and remove of knowledge files."""
+
+    print("\n🔄 Testing Live Knowledge Updates")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        retriever = RAGRetriever()
+        retriever.knowledge_dir = Path(tmp) / "knowledge"
+        retriever.knowledge_dir.mkdir()
+        retriever.loader = KnowledgeLoader(KnowledgeCache(Path(tmp) / "cache"), workers=1)
+        watcher = KnowledgeWatcher(retriever, interval=60)
+
+        guide = retriever.knowledge_dir / "mildew.txt"
+        guide.write_text("Downy mildew thrives in cool humid weather.\n\nScout lower leaves.", encoding="utf-8")
+        assert watcher.scan() == (1, 0)
+        assert retriever.retrieve("downy mildew", k=1)[0]["page_content"].startswith("Downy mildew")
+        version = retriever.knowledge_version
+
+        # Only the changed paragraph is re-indexed
+        guide.write_text("Downy mildew thrives in cool humid weather.\n\nScout upper leaves.", encoding="utf-8")
+        assert retriever.upsert_document(guide) == (1, 1)
+        assert retriever.upsert_document(guide) == (0, 0)
+        assert retriever.knowledge_version == version + 1
+
+        # A copy that cannot be extracted never replaces the indexed file, and is not fingerprinted
+        staged = retriever.knowledge_dir / ".mildew.txt.upload"
+        staged.write_bytes(b"\xff\xfe broken upload")
+        try:
+            retriever.upsert_document(guide, staged)
+            assert False, "corrupt upload accepted"
+        except ValueError:
+            pass
+        assert guide.read_text(encoding="utf-8").endswith("Scout upper leaves.")
+        assert retriever.loader.load_file(staged) is None and str(staged) not in retriever.source_fingerprints
+        staged.write_text("Downy mildew thrives in cool humid weather.\n\nScout all leaves.", encoding="utf-8")
+        assert retriever.upsert_document(guide, staged) == (1, 1) and not staged.exists()
+        assert guide.read_text(encoding="utf-8").endswith("Scout all leaves.")
+
+        guide.unlink()
+        assert watcher.scan() == (0, 1)
+
+        # A file that fails to re-index is retried on the next scan
+        notes = retriever.knowledge_dir / "notes.txt"
+        notes.write_text("Powdery mildew coats leaves in white spores.", encoding="utf-8")
+        retriever.upsert_document = lambda path: (_ for _ in ()).throw(OSError("disk busy"))
+        assert watcher.scan() == (0, 0)
+        del retriever.upsert_document
+        assert watcher.scan() == (1, 0) and watcher.scan() == (0, 0)
+        notes.unlink()
+        assert watcher.scan() == (0, 1)
+        assert all("Downy" not in doc["page_content"] for doc in retriever.retrieve("downy mildew", k=4))
+
+        # A chunk dropped as a copy of another file's is indexed again when that file goes
+        text = "Frogeye leaf spot lesions have reddish brown borders and grey centres on upper leaves."
+        original, mirror, third = (retriever.knowledge_dir / name for name in ("a.txt", "b.txt", "c.txt"))
+        for path in (original, mirror, third):
+            path.write_text(text, encoding="utf-8")
+        assert [retriever.upsert_document(path) for path in (original, mirror, third)] == [(1, 0), (0, 0), (0, 0)]
+        assert retriever.remove_document(original) == (0, 1)
+        assert retriever.retrieve("frogeye leaf spot", k=1)[0]["page_content"] == text
+        assert len(retriever._source_chunks[str(mirror)]) == 1 and str(third) not in retriever._source_chunks
+        assert retriever.remove_document(mirror) == (0, 1)
+        assert len(retriever._source_chunks[str(third)]) == 1
+    print("  ✅ Live knowledge updates work")
+
+
+def _unit_vectors(count, dim, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def test_dense_vector_index():
+    """Test the memory-mapped dense index against brute-force search."""
+
+    print("\n🧮 Testing Dense Vector Index")
+    print("=" * 40)
+
+    vectors = _unit_vectors(500, 32)
+    query = vectors[7] + 0.1 * vectors[8]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "embeddings.npy"
+        manifest = {"model": "test", "corpus": "abc"}
+        index = DenseVectorIndex.build(path, np.arange(500) * 2, vectors, manifest)
+        assert isinstance(index.matrix, np.memmap)
+        assert DenseVectorIndex.load(path, {"model": "other", "corpus": "abc"}) is None
+
+        index = DenseVectorIndex.load(path, manifest)
+        expected = np.argsort(-(vectors @ query))[:5] * 2
+        hits = index.search(query, k=5)
+        print(f"  Hits: {hits}")
+        assert [doc_id for doc_id, _ in hits] == list(expected)
+
+        index.remove([14])
+        index.add([1001], [query / np.linalg.norm(query)])
+        hits = index.search(query, k=2)
+        assert hits[0][0] == 1001 and 14 not in [doc_id for doc_id, _ in hits]
+        assert len(index) == 500
+        del index
+    print("  ✅ Dense vector index works")
+
+
+def test_ivf_index():
+    """Test IVF recall against exact search, reloading and the live overlay."""
+
+    print("\n🗂️ Testing IVF Index")
+    print("=" * 40)
+
+    rng = np.random.default_rng(1)
+    centers = _unit_vectors(20, 32, seed=2)
+    vectors = centers[rng.integers(0, 20, 2000)] + 0.3 * _unit_vectors(2000, 32, seed=3)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "embeddings.npy"
+        manifest = {"model": "test", "index": "ivf"}
+        index = IVFIndex.build(path, np.arange(2000), vectors, manifest, nlist=20, nprobe=4)
+        assert index.nlist == 20 and index.offsets[-1] == 2000
+        assert IVFIndex.load(path, {"model": "other"}) is None
+
+        index = IVFIndex.load(path, manifest, nprobe=4)
+        report = recall_report(index, vectors[:50], k=10, nprobes=[1, 4, 20])
+        print(f"  Report: {report}")
+        recalls = [entry["recall"] for entry in report["nprobe"]]
+        assert recalls == sorted(recalls) and recalls[-1] == 1.0 and recalls[1] >= 0.9
+        assert index.search(vectors[5], k=1)[0][0] == 5
+        # The offline report samples the index's own rows at its configured nprobe
+        assert dense_index_report(index, samples=20)["nprobe"][0]["nprobe"] == 4
+        assert dense_index_report(DenseVectorIndex(index.matrix, index.doc_ids)) is None
+
+        index.remove([5])
+        index.add([5000], [vectors[5]])
+        hits = index.search(vectors[5], k=3)
+        assert hits[0][0] == 5000 and 5 not in [doc_id for doc_id, _ in hits]
+        # Removing overlay-only or unknown ids does not count them twice
+        assert len(index) == 2000
+        index.remove([5000, 9999])
+        index.remove([5])
+        assert len(index) == 1999
+        del index
+    print("  ✅ IVF index works")
+
+
+def test_quantized_indexes():
+    """Test int8 and product-quantized storage with full-precision reranking."""
+
+    print("\n🗜️ Testing Quantized Indexes")
+    print("=" * 40)
+
+    vectors = _unit_vectors(1000, 32, seed=4)
+    with tempfile.TemporaryDirectory() as tmp:
+        for cls, compression in ((ScalarQuantizedIndex, 4.0), (ProductQuantizedIndex, 16.0)):
+            path = Path(tmp) / f"{cls.__name__}.npy"
+            manifest = {"model": "test", "index": cls.__name__}
+            index = cls.build(path, np.arange(1000) + 10, vectors, manifest, rerank=10)
+            assert cls.load(path, {"model": "other"}) is None
+            index = cls.load(path, manifest, rerank=10)
+
+            report = quantization_report(index, vectors[:50], k=5, reranks=[0, 10])
+            print(f"  {cls.__name__}: {report}")
+            assert report["compression"] == compression
+            no_rerank, rerank = [entry["recall"] for entry in report["rerank"]]
+            assert rerank >= 0.95 and rerank >= no_rerank
+            assert dense_index_report(index, samples=20)["rerank"][0]["rerank"] == 10
+
+            index.remove([10])
+            index.add([5000], [vectors[0]])
+            hits = index.search(vectors[0], k=2)
+            assert hits[0][0] == 5000 and 10 not in [doc_id for doc_id, _ in hits]
+            del index
+        try:
+            QuantizedIndex(vectors, np.arange(1000), None, None)
+            assert False, "the abstract base should not be instantiable"
+        except TypeError:
+            pass
+    print("  ✅ Quantized indexes work")
+
+
+def test_chroma_index():
+    """Test that a persisted Chroma collection is reopened and synced instead of rebuilt."""
+
+    print("\n🗄️  Testing Chroma Index")
+    print("=" * 40)
+    # Each corpus syncs its own collection
+    name = corpus_collection_name("soybean_knowledge", "/srv/knowledge")
+    assert name.startswith("soybean_knowledge_") and name == corpus_collection_name("soybean_knowledge", "/srv/knowledge")
+    assert name != corpus_collection_name("soybean_knowledge", "/srv/knowledge-staging")
+    if not CHROMADB_AVAILABLE:
+        print("  ⚠️  chromadb not installed - skipping Chroma test")
+        return
+
+    texts = [f"Chunk {i} about soybean field practice number {i}." for i in range(30)]
+    metadata = MetadataIndex()
+    for i in range(30):
+        metadata.add(i, {"source": f"guide_{i % 3}.txt", "language": "en"})
+    encoded = []
+
+    def encode(batch):
+        encoded.extend(batch)
+        return np.stack([_unit_vectors(1, 8, seed=int(content_id(text)[:8], 16))[0] for text in batch])
+
+    def chunk(doc_id):
+        return texts[doc_id], metadata.metadata(doc_id)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = ChromaVectorIndex.open(chunk, "test-model", path=tmp, collection_name="test_chunks", batch_size=8)
+        assert index.sync(range(30), encode) == (30, 0)
+        assert len(index) == 30 and index.collection.count() == 30
+        hits = index.search(encode([texts[7]])[0], k=3)
+        print(f"  Hits: {hits}")
+        assert hits[0][0] == 7 and abs(hits[0][1] - 1.0) < 1e-4
+
+        # Reopening embeds nothing; a changed corpus only writes and deletes the difference
+        encoded.clear()
+        index = ChromaVectorIndex.open(chunk, "test-model", path=tmp, collection_name="test_chunks", batch_size=8)
+        assert index.sync(range(30), encode) == (0, 0) and encoded == []
+        texts.extend(["A new chunk on inoculation.", "A new chunk on harvest."])
+        for i in (30, 31):
+            metadata.add(i, {"source": "guide_new.txt", "language": "en"})
+        assert index.sync(list(range(25)) + [30, 31], encode) == (2, 5)
+        assert index.collection.count() == 27
+
+        # Filters keep only allowed chunks, fetching past hidden ones
+        allowed = metadata.evaluate({"source": "guide_1.txt"})
+        hits = index.search(encode([texts[0]])[0], k=5, allowed=allowed)
+        assert len(hits) == 5 and all(texts[doc_id] and doc_id % 3 == 1 for doc_id, _ in hits)
+        queries = encode([texts[0], texts[4], texts[31]])
+        assert index.search_many(queries, k=5, allowed=allowed) == \
+            [index.search(query, k=5, allowed=allowed) for query in queries]
+
+        # Live updates are upserts by content; a record goes when its last chunk does
+        texts.append(texts[30])
+        index.add([32], encode([texts[32]]))
+        assert index.collection.count() == 27
+        index.remove([30])
+        assert index.collection.count() == 27
+        index.remove([32, 31])
+        assert index.collection.count() == 25 and len(index) == 25
+
+        # Another embedding model cannot reuse the vectors
+        index = ChromaVectorIndex.open(chunk, "other-model", path=tmp, collection_name="test_chunks")
+        assert index.collection.count() == 0
+
+        # Syncing another corpus's collection leaves this one alone
+        index = ChromaVectorIndex.open(chunk, "other-model", path=tmp, collection_name="test_chunks")
+        index.sync(range(10), encode)
+        other = ChromaVectorIndex.open(chunk, "other-model", path=tmp,
+                                       collection_name=corpus_collection_name("test_chunks", "other"))
+        assert other.sync(range(10, 12), encode) == (2, 0) and index.collection.count() == 10
+
+        # The retriever falls back to the built-in index when the store cannot be opened
+        retriever = RAGRetriever(knowledge_dir=tmp, knowledge_pack="")
+        retriever.embedder = _CountingEmbedder("test-model")
+        live = sum(text is not None for text in retriever.knowledge_base)
+        retriever.persist_directory = Path(tmp) / "store"
+        index = retriever._open_chroma_index(retriever.knowledge_base, retriever.metadata_index)
+        assert isinstance(index, ChromaVectorIndex) and len(index) == live
+        blocked = Path(tmp) / "blocked"
+        blocked.write_text("not a directory", encoding="utf-8")
+        retriever.persist_directory = blocked
+        assert retriever._open_chroma_index(retriever.knowledge_base, retriever.metadata_index) is None
+    print("  ✅ Chroma index works")
+
+
+def test_reciprocal_rank_fusion():
+    """Test that documents ranked well by both stages win."""
+
+    print("\n🔀 Testing Reciprocal Rank Fusion")
+    print("=" * 40)
+
+    lexical = [(1, 12.0), (2, 9.5), (3, 1.0)]
+    dense = [(2, 0.91), (3, 0.90), (4, 0.50)]
+    fused = reciprocal_rank_fusion([lexical, dense], limit=3)
+    print(f"  Fused: {fused}")
+    assert [doc_id for doc_id, _ in fused] == [2, 3, 1]
+    assert reciprocal_rank_fusion([lexical, []], limit=2) == reciprocal_rank_fusion([lexical], limit=2)
+    print("  ✅ Rank fusion works")
+
+
+def test_context_packer():
+    """Test that the packed context keeps the answering sentence within the budget."""
+
+    print("\n✂️  Testing Context Packer")
+    print("=" * 40)
+
+    lead_in = " ".join(f"Section {i} of this guide covers field records and general crop husbandry." for i in range(8))
+    answer = "Inoculate soybean seed with Bradyrhizobium on the day of planting, in the shade."
+    chunks = [
+        lead_in + " " + answer + " Store leftover inoculant in a cool place.",
+        "Soybean needs well drained soil. Weed the field two weeks after emergence.",
+    ]
+    assert split_sentences("Plant in rows. Use 50 cm spacing, e.g. 10 seeds.\nDone!") == [
+        "Plant in rows.", "Use 50 cm spacing, e.g. 10 seeds.", "Done!"
+    ]
+    assert answer not in chunks[0][:500]
+
+    packer = ContextPacker(max_tokens=25)
+    context, report = packer.pack("When should I inoculate soybean seed?", chunks)
+    print(f"  Context: {context!r}")
+    print(f"  Report: {report}")
+    assert answer in context
+    assert report["tokens_used"] <= 25
+    assert report["tokens_saved"] == report["tokens_in"] - report["tokens_used"] > 0
+    # The answer and the sentence after it beat the lead-in; skipped sentences are marked
+    assert context == f"... {answer} Store leftover inoculant in a cool place."
+    assert packer.stats["calls"] == 1 and packer.stats["tokens_saved"] == report["tokens_saved"]
+
+    # Chunks retrieved without a query term (dense paraphrase hits) still get budget
+    paraphrase = ["Soybean leaves yellowing from the bottom up point to nitrogen shortage.",
+                  "Chlorosis between the veins of young trifoliates signals iron deficiency."]
+    context, _ = ContextPacker(max_tokens=40).pack("Why are my soybean leaves yellowing?", paraphrase)
+    assert context == "\n\n".join(paraphrase)
+    context, _ = ContextPacker(max_tokens=40).pack("Why are my soybean leaves yellowing?", paraphrase[::-1])
+    assert context == "\n\n".join(paraphrase[::-1])
+    # Without matching terms the budget fills in retrieval order
+    context, _ = ContextPacker(max_tokens=15).pack("xyz", chunks)
+    assert context.startswith("Section 0 of this guide")
+    # A budget smaller than any sentence keeps the start of the best one
+    context, report = ContextPacker(max_tokens=5).pack("inoculant storage", chunks)
+    assert context == "... Store leftover inoculant in a" and report["tokens_used"] == 5
+    # No budget keeps everything
+    context, report = ContextPacker(max_tokens=0).pack("soybean", chunks)
+    assert report["tokens_saved"] == 0 and report["sentences_kept"] == report["sentences_total"]
+    assert ContextPacker().pack("soybean", []) == ("", {
+        "tokens_in": 0, "tokens_used": 0, "tokens_saved": 0, "sentences_kept": 0, "sentences_total": 0
+    })
+    print("  ✅ Context packing works")
+
+
+def test_chunking_and_deduplication():
+    """Test token windows, boilerplate stripping and near-duplicate detection."""
+
+    print("\n✂️  Testing Chunking and Deduplication")
+    print("=" * 40)
+
+    page = " ".join(f"Sentence number {i} about soybean rust." for i in range(60))
+    chunker = TokenChunker(max_tokens=50, overlap=10)
+    windows = chunker.chunk(["Short intro.", "Another short line.", page])
+    print(f"  Chunks: {len(windows)}, sizes {[count_tokens(w) for w in windows]}")
+    assert windows[0] == "Short intro.\n\nAnother short line."
+    assert all(count_tokens(w) <= 50 for w in windows)
+    assert all(w.endswith(".") for w in windows)
+    assert all(w.startswith("Sentence") for w in windows[1:])
+    assert " ".join(windows[2].split()[:5]) in windows[1]
+
+    topics = ["Planting dates.", "Seed rates.", "Weed control.", "Rust scouting.", "Harvest timing."]
+    pages = [f"Soybean Handbook\n{topic}\nPage {i} of 5" for i, topic in enumerate(topics, 1)]
+    assert list(strip_page_edges(pages)) == [topic + "\n" for topic in topics]
+    assert list(strip_page_edges(pages[:3])) == pages[:3]
+
+    # Dosage and table lines repeated in the body of every page are content
+    crops = ["soybean", "maize", "wheat", "beans", "sorghum", "cowpea"]
+    pages = [f"Fertilizer Guide\nDose for {crop}\nNitrogen: 20/40/30/10 kg/ha\nPhosphorus: 40 kg/ha\n"
+             f"Apply before planting {crop}.\n{i}" for i, crop in enumerate(crops, 1)]
+    stripped = list(strip_page_edges(pages))
+    assert stripped[0] == ("Dose for soybean\nNitrogen: 20/40/30/10 kg/ha\nPhosphorus: 40 kg/ha\n"
+                           "Apply before planting soybean.\n")
+    assert all(page.count("kg/ha") == 2 for page in stripped)
+    assert TokenChunker().chunk(["Nitrogen: 20 kg/ha"] * 5) == ["\n\n".join(["Nitrogen: 20 kg/ha"] * 5)]
+
+    duplicates = NearDuplicateFilter(threshold=0.8)
+    text = ("Frogeye leaf spot is caused by Cercospora sojina and produces small circular "
+            "lesions with reddish brown borders on upper leaves during warm humid weather. "
+            "Scout fields weekly after flowering, rotate away from soybean for at least one "
+            "year and plant resistant varieties where the disease was severe. Page 12")
+    duplicates.add(1, text)
+    assert duplicates.matches(text.upper()) == {1}
+    assert duplicates.matches(text.replace("Page 12", "Page 13")) == {1}
+    assert duplicates.matches(text[:len(text) // 2]) == set()
+    assert duplicates.matches("Harvest when leaves turn yellow and pods are dry and rattle.") == set()
+    duplicates.discard(1)
+    assert duplicates.matches(text) == set()
+    print("  ✅ Chunking and deduplication work")
+
+
+class _CountingEmbedder(SentenceEmbedder):
+    """Embedder with a fake model that records what it was asked to encode."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.encoded = []
+
+    def _encode(self, texts, batch_size=64):
+        self.encoded.extend(texts)
+        return _unit_vectors(len(texts), 8, seed=len(self.encoded))
+
+
+def test_embedding_cache():
+    """Test that only new chunks and unseen queries reach the encoder."""
+
+    print("\n💾 Testing Embedding Cache")
+    print("=" * 40)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = EmbeddingCache(Path(tmp) / "embeddings.sqlite3")
+        embedder = _CountingEmbedder("test-model", cache=cache, query_cache_size=2)
+        first = embedder.encode(["rust", "blight", "rust"])
+        assert embedder.encoded == ["rust", "blight"]
+        assert np.array_equal(first[0], first[2])
+
+        # A fresh embedder (e.g. after a restart) reuses the stored vectors
+        embedder = _CountingEmbedder("test-model", cache=cache)
+        second = embedder.encode(["blight", "mildew"])
+        assert embedder.encoded == ["mildew"]
+        assert np.array_equal(second[0], first[1])
+        assert _CountingEmbedder("other-model", cache=cache).encode(["rust"]) is not None
+
+        embedder = _CountingEmbedder("test-model", query_cache_size=2)
+        for query in ["when to plant", "when  to plant", "fertilizer rate", "when to plant", "harvest"]:
+            embedder.encode_query(query)
+        print(f"  Stats: {embedder.stats}")
+        assert embedder.encoded == ["when to plant", "fertilizer rate", "harvest"]
+        assert embedder.stats["query_hits"] == 2
+        cache.close()
+    print("  ✅ Embedding cache works")
+
+
+def test_retrieval_cache():
+    """Test LRU eviction, TTL expiry and knowledge-version invalidation."""
+
+    print("\n⚡ Testing Retrieval Cache")
+    print("=" * 40)
+
+    results = [{"page_content": "Plant when soil reaches 15°C."}]
+    cache = RetrievalCache(max_entries=2, ttl_seconds=60)
+    assert cache.get("When to plant?", 5, version=1) is None
+    cache.put("When to plant?", 5, 1, results)
+    assert cache.get("when to PLANT", 5, version=1) == results
+    assert cache.get("when to plant", 3, version=1) is None
+
+    cache.put("fertilizer rate", 5, 1, results)
+    cache.put("harvest time", 5, 1, results)
+    assert cache.get("when to plant", 5, version=1) is None
+    assert cache.stats()["evictions"] == 1
+
+    # A newer knowledge version empties the cache; results from an older one are not stored
+    assert cache.get("harvest time", 5, version=2) is None
+    cache.put("harvest time", 5, 1, results)
+    assert cache.get("harvest time", 5, version=2) is None
+    assert cache.stats()["invalidations"] == 1
+
+    expired = RetrievalCache(ttl_seconds=-1)
+    expired.put("harvest time", 5, 1, results)
+    assert expired.get("harvest time", 5, version=1) is None
+    print(f"  Stats: {cache.stats()}")
+
+    retriever = RAGRetriever()
+    first = retriever.retrieve("soil temperature for planting", k=2)
+    assert retriever.retrieve("Soil temperature for planting?", k=2) == first
+    assert retriever.last_timings.get("cache_hit")
+
+    # A quoted phrase and the same words unquoted are different queries
+    with tempfile.TemporaryDirectory() as tmp:
+        notes = ["Frogeye leaf spot shows grey lesions with purple borders.",
+                 "Brown spot starts on the lower leaf surface after wet weather.",
+                 "Bacterial blight spreads in rain; each leaf shows a small angular spot."]
+        for i, note in enumerate(notes):
+            (Path(tmp) / f"note{i}.md").write_text(note, encoding="utf-8")
+        retriever = RAGRetriever(knowledge_dir=tmp, knowledge_pack="")
+        quoted = retriever.retrieve('"leaf spot"', k=3)
+        unquoted = retriever.retrieve("leaf spot", k=3)
+        assert not retriever.last_timings.get("cache_hit")
+        assert [doc["page_content"] for doc in quoted] == [notes[0]]
+        assert len(unquoted) == 3 and unquoted != quoted
+    print("  ✅ Retrieval cache works")
+
+
+def test_benchmark_corpus():
+    """Test that the synthetic benchmark corpus is reproducible and labelled."""
+
+    print("\n📊 Testing Benchmark Corpus")
+    print("=" * 40)
+
+    corpus = generate_corpus(300, seed=1)
+    assert corpus == generate_corpus(300, seed=1)
+    assert len({paragraph for paragraph, _ in corpus}) == 300
+    queries = labelled_queries(corpus, 20)
+    assert len(queries) == 20
+    for query, answer in queries:
+        facts = next(facts for paragraph, facts in corpus if paragraph == answer)
+        assert facts["region"] in query and facts["crop"] in query
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_corpus(corpus, tmp, paragraphs_per_file=100)
+        retriever = RAGRetriever(knowledge_dir=tmp, knowledge_pack="")
+        found = sum(
+            any(answer in doc["page_content"] for doc in retriever.retrieve(query, k=5))
+            for query, answer in queries
+        )
+    print(f"  Lexical recall@5: {found / len(queries):.2f}")
+    assert found / len(queries) >= 0.7
+    print("  ✅ Benchmark corpus works")
+
+
+def test_metadata_filters():
+    """Test chunk metadata from ingestion and filtered retrieval."""
+
+    print("\n🏷️  Testing Metadata Filters")
+    print("=" * 40)
+
+    assert detect_crop_stages("Spray at R3 when pods set; harvest at R8.") == ["podding", "maturity", "harvest"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_dir = Path(tmp)
+        for region in ("zambia", "malawi"):
+            (knowledge_dir / region).mkdir()
+            (knowledge_dir / region / "_metadata.json").write_text(f'{{"region": "{region.title()}"}}')
+        (knowledge_dir / "zambia" / "rust.md").write_text(
+            "Soybean rust spreads fast during flowering in wet seasons.", encoding="utf-8")
+        (knowledge_dir / "zambia" / "scouting.md").write_text(
+            "Scout soybean fields weekly for rust before harvest.", encoding="utf-8")
+        (knowledge_dir / "malawi" / "planting.md").write_text(
+            "Plant soybean after the first good rains; rust is rare at planting.", encoding="utf-8")
+        sidecar = knowledge_dir / "malawi" / "planting.md.meta.json"
+        sidecar.write_text('{"language": "ny"}')
+
+        retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack="")
+        docs = retriever.retrieve("soybean rust", k=10, filters={"region": "Zambia"})
+        print(f"  Zambia: {[doc['metadata'] for doc in docs]}")
+        assert len(docs) == 2 and all(doc["metadata"]["region"] == "zambia" for doc in docs)
+        stages = {doc["metadata"]["source"]: doc["metadata"]["crop_stage"] for doc in docs}
+        assert stages == {"zambia/rust.md": "flowering", "zambia/scouting.md": "harvest"}
+
+        docs = retriever.retrieve("soybean rust", k=10, filters={"language": "ny"})
+        assert [doc["metadata"]["source"] for doc in docs] == ["malawi/planting.md"]
+        docs = retriever.retrieve("soybean rust", k=10, filters={
+            "$or": [{"crop_stage": {"$in": ["harvest", "planting"]}}, {"source": "builtin"}],
+            "region": {"$ne": "malawi"},
+        })
+        assert {doc["metadata"]["crop_stage"] for doc in docs if doc["metadata"]["source"] != "builtin"} == {"harvest"}
+        assert retriever.retrieve("soybean rust", k=3, filters={"region": "kenya"}) == []
+        for bad in ({"region": {"$like": "z"}}, {"$or": []}, ["region"]):
+            try:
+                retriever.retrieve("rust", filters=bad)
+                assert False, f"accepted {bad}"
+            except ValueError:
+                pass
+
+        # Editing a metadata file relabels the chunks on the next re-index
+        sidecar.write_text('{"language": "en", "region": ["Malawi", "Zambia"]}')
+        version = retriever.knowledge_version
+        assert retriever.upsert_document(knowledge_dir / "malawi" / "planting.md") == (0, 0)
+        assert retriever.knowledge_version > version
+        assert len(retriever.retrieve("soybean rust", k=10, filters={"region": "zambia"})) == 3
+
+        # Metadata survives a pack round trip
+        doc_ids = [i for i, text in enumerate(retriever.knowledge_base) if text is not None]
+        retriever.metadata_index.save(tmp, doc_ids)
+        loaded = MetadataIndex.load(tmp)
+        assert [loaded.metadata(i) for i in range(len(doc_ids))] == \
+            [retriever.metadata_index.metadata(i) for i in doc_ids]
+
+    # Filtered search returns exactly the top hits among allowed chunks, in every index
+    rng = np.random.default_rng(4)
+    corpus = [paragraph for paragraph, _ in generate_corpus(400, seed=4)]
+    metadata = MetadataIndex()
+    lexical = BM25Index()
+    for doc_id, text in enumerate(corpus):
+        metadata.add(doc_id, {"region": f"r{doc_id % 7}", "crop_stage": detect_crop_stages(text)})
+        lexical.add(doc_id, text)
+    allowed = metadata.evaluate({"region": {"$in": ["r1", "r2"]}, "crop_stage": {"$ne": "harvest"}})
+    assert allowed.sum() == sum(1 for i, t in enumerate(corpus) if i % 7 in (1, 2) and "harvest" not in detect_crop_stages(t))
+    assert metadata.evaluate({"region": {"$in": ["r1", "r2"]}, "crop_stage": {"$ne": "harvest"}}) is allowed
+
+    def filtered(hits, k):
+        return [hit for hit in hits if allowed[hit[0]]][:k]
+
+    for query in ("soybean rust at flowering", "maize aphids harvest", "fungicide rate per hectare"):
+        assert lexical.search(query, 5, allowed) == filtered(lexical.search(query, len(corpus)), 5)
+
+    vectors = _unit_vectors(len(corpus), 16, seed=4)
+    with tempfile.TemporaryDirectory() as tmp:
+        dense = DenseVectorIndex.build(Path(tmp) / "dense.npy", np.arange(len(corpus)), vectors, {})
+        ivf = IVFIndex.build(Path(tmp) / "ivf.npy", np.arange(len(corpus)), vectors, {}, nlist=8)
+        pq = ProductQuantizedIndex.build(Path(tmp) / "pq.npy", np.arange(len(corpus)), vectors, {}, rerank=0)
+        for query in vectors[rng.choice(len(corpus), 5, replace=False)]:
+            expected = filtered(dense.search(query, len(corpus)), 5)
+            assert dense.search(query, 5, allowed=allowed) == expected
+            assert ivf.search(query, 5, nprobe=8, allowed=allowed) == expected
+            assert [d for d, _ in pq.search(query, 5, allowed=allowed)] == \
+                [d for d, _ in filtered(pq.search(query, len(corpus)), 5)]
+    print(f"  {int(allowed.sum())}/{len(corpus)} chunks pass the test filter")
+    print("  ✅ Metadata filters work")
+
+
+def test_topic_routing():
+    """Test topic tagging of chunks and routing queries to topic partitions."""
+
+    print("\n🧭 Testing Topic Routing")
+    print("=" * 40)
+
+    assert detect_topics("When should I sow soybean seed?") == ["planting", "general"]
+    assert detect_chunk_topics("Rust is a disease; scout for infection and pest damage after rain.") == ["disease"]
+    assert detect_chunk_topics("Inoculate before you sow the seed, then watch for disease.") == ["planting", "disease"]
+    assert detect_chunk_topics("Soybean is a legume.") == [GENERAL_TOPIC]
+    # Keywords match whole words, case-folded
+    assert detect_topics("Store the grain once the field has drained.") == []
+    assert detect_topics("Heavy rains after planting") == ["planting", "weather"]
+    assert detect_chunk_topics("Keep the pH near 6.5.") == ["soil"]
+    assert RAGRetriever._topic_route("Tell me about soybean") is None
+    assert RAGRetriever._topic_route("Which fertilizer suits acid soil?") == \
+        {"topic": {"$in": ["soil", GENERAL_TOPIC]}}
+    assert RAGRetriever._topic_route("Does rain at harvest spread disease in the soil?") is None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_dir = Path(tmp) / "knowledge"
+        knowledge_dir.mkdir()
+        notes = {
+            "disease": ["Frogeye leaf spot is a disease of wet seasons; remove sick plants to stop infection.",
+                        "Frogeye leaf spot disease overwinters in residue, so bury it to cut infection.",
+                        "Spray a strobilurin when frogeye leaf spot disease reaches the upper canopy.",
+                        "Resistant varieties are the cheapest control of frogeye leaf spot disease."],
+            "soil": ["Lime acid soil two months before planting and band the fertilizer.",
+                     "Sandy soil leaches nutrients quickly; split the fertilizer in two doses.",
+                     "Test soil pH every three years and correct it with dolomitic lime.",
+                     "Phosphorus fertilizer raises nodulation on depleted soil."],
+            "weather": ["Heavy rain and high temperature favour frogeye leaf spot in the north.",
+                        "A cool climate slows frogeye leaf spot; dry weather stops it spreading.",
+                        "Record rain and temperature daily to time frogeye leaf spot scouting.",
+                        "Frogeye leaf spot lesions appear a week after warm rain in a humid climate."],
+        }
+        for topic, texts in notes.items():
+            for i, text in enumerate(texts):
+                (knowledge_dir / f"{topic}{i}.md").write_text(text, encoding="utf-8")
+
+        retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack="")
+        searched = []
+        original_search = retriever.lexical_index.search
+
+        def recording_search(query, k=4, allowed=None, stats=None):
+            searched.append(allowed)
+            return original_search(query, k, allowed=allowed, stats=stats)
+
+        retriever.lexical_index.search = recording_search
+        docs = retriever.retrieve("How do I stop frogeye leaf spot disease?", k=4)
+        assert retriever.routing_stats == {"routed": 1, "global": 0, "fallback": 0, "low_score": 0}
+        # A confident route searches only its partitions, with no global probe
+        assert len(searched) == 1 and searched[0] is not None
+        del retriever.lexical_index.search
+        assert retriever.last_timings["topics"] == ["disease", GENERAL_TOPIC]
+        assert all("disease" in doc["metadata"]["topic"] for doc in docs)
+
+        # Too few chunks in the partition: search everything instead
+        docs = retriever.retrieve("How do I stop frogeye leaf spot disease?", k=8)
+        assert retriever.routing_stats["fallback"] == 1
+        assert any("weather" in doc["metadata"]["topic"] for doc in docs)
+        retriever.retrieve("frogeye leaf spot", k=4)
+        assert retriever.cache_stats()["topic_routing"] == {"routed": 1, "global": 1, "fallback": 1, "low_score": 0}
+
+        # Routed results missing the query's rarer words: search everything rather than the wrong partition
+        query = "Does dolomitic lime cure the disease?"
+        assert retriever._topic_route(query) == {"topic": {"$in": ["disease", GENERAL_TOPIC]}}
+        docs = retriever.retrieve(query, k=2)
+        assert retriever.routing_stats["low_score"] == 1 and "dolomitic" in docs[0]["page_content"]
+        retriever.result_cache = None
+        assert retriever.retrieve_many([query], k=2) == [docs] and retriever.routing_stats["low_score"] == 2
+
+        # The packed index skips out-of-partition postings with the same results as post-filtering
+        pack = KnowledgePack.open(build_pack(knowledge_dir, Path(tmp) / "packs"))
+        packed, metadata = pack.lexical_index(), pack.metadata_index()
+        allowed = metadata.evaluate({"topic": {"$in": ["weather", GENERAL_TOPIC]}})
+        assert 0 < allowed.sum() < len(allowed)
+        for query in ("frogeye leaf spot", "acid soil fertilizer", "rain temperature"):
+            expected = [hit for hit in packed.search(query, len(allowed)) if allowed[hit[0]]][:3]
+            assert packed.search(query, 3, allowed) == expected
+
+    # Disabling routing searches the whole index
+    max_topics = Config.TOPIC_ROUTING_MAX_TOPICS
+    Config.TOPIC_ROUTING_MAX_TOPICS = 0
+    try:
+        assert RAGRetriever._topic_route("Which fertilizer suits acid soil?") is None
+    finally:
+        Config.TOPIC_ROUTING_MAX_TOPICS = max_topics
+    print(f"  Routing: {retriever.routing_stats}")
+    print("  ✅ Topic routing works")
+
+
+def test_batch_retrieval():
+    """Test that retrieve_many matches retrieve in every retrieval mode."""
+
+    print("\n📦 Testing Batch Retrieval")
+    print("=" * 40)
+
+    corpus = generate_corpus(300, seed=11)
+    queries = [query for query, _ in labelled_queries(corpus, 30)]
+    queries += ["When should I sow soybean seed?", "fertilizer for acid soil", "zzz unknown words", queries[0]]
+    with tempfile.TemporaryDirectory() as tmp:
+        write_corpus(corpus, Path(tmp) / "knowledge", paragraphs_per_file=100)
+        retriever = RAGRetriever(knowledge_dir=Path(tmp) / "knowledge", knowledge_pack="")
+        retriever.result_cache = None
+
+        def check(filters=None):
+            batch = retriever.retrieve_many(queries, k=5, filters=filters)
+            assert retriever.last_timings["queries"] == len(queries)
+            for query, docs in zip(queries, batch):
+                assert [d["page_content"] for d in docs] == \
+                    [d["page_content"] for d in retriever.retrieve(query, k=5, filters=filters)]
+
+        check()
+        check({"crop_stage": "flowering"})
+        stats = dict(retriever.routing_stats)
+        assert stats["routed"] > 0 and stats["global"] > 0
+
+        # Dense and hybrid: queries are embedded in one batch and reused from the LRU afterwards
+        retriever.embedder = _CountingEmbedder("test-model", query_cache_size=1000)
+        doc_ids = [i for i, text in enumerate(retriever.knowledge_base) if text is not None]
+        vectors = retriever.embedder.encode([retriever.knowledge_base[i] for i in doc_ids])
+        retriever.dense_index = DenseVectorIndex.build(Path(tmp) / "dense.npy", doc_ids, vectors, {})
+        retriever.embedder.encoded = []
+        check()
+        assert len(retriever.embedder.encoded) == len(set(queries))
+        retriever._stage_pool = ThreadPoolExecutor(max_workers=1)
+        check({"crop_stage": {"$ne": "harvest"}})
+
+        # A dense stage past its budget gives a lexical answer that is not cached
+        retriever.result_cache = RetrievalCache(100, 60)
+        dense_search, budget = retriever._dense_search, Config.HYBRID_DENSE_BUDGET_MS
+        retriever._dense_search = lambda *args: time.sleep(0.2) or dense_search(*args)
+        Config.HYBRID_DENSE_BUDGET_MS = 20
+        try:
+            retriever.retrieve(queries[1], k=5)
+            assert retriever.last_timings["dense_timed_out"]
+            assert retriever.result_cache.stats()["entries"] == 0
+        finally:
+            retriever._dense_search, Config.HYBRID_DENSE_BUDGET_MS = dense_search, budget
+        retriever._stage_pool.shutdown()
+        retriever._stage_pool = None
+        retriever.result_cache = None
+
+        # Cached queries are served without searching
+        retriever.result_cache = RetrievalCache(100, 60)
+        first = retriever.retrieve_many(queries[:3])
+        assert retriever.retrieve_many(queries[:3]) == first
+        assert retriever.last_timings["cache_hits"] == 3
+
+    # The index batch paths agree with one-query search, including filters, removals and additions
+    texts = [paragraph for paragraph, _ in generate_corpus(400, seed=12)]
+    lexical = BM25Index(texts)
+    with tempfile.TemporaryDirectory() as tmp:
+        lexical.save(tmp, list(range(len(texts))))
+        packed = PackedBM25Index.load(tmp)
+        for index in (lexical, packed):
+            index.remove(3, texts[3])
+            index.add(len(texts) + 2, "Soybean rust spreads fast in humid weather")
+        allowed = np.random.default_rng(12).random(len(texts) + 5) < 0.4
+        batch_queries = queries + ["soybean rust humid"]
+        for index in (lexical, packed):
+            for mask in (None, allowed):
+                for query, hits in zip(batch_queries, index.search_many(batch_queries, 5, allowed=mask)):
+                    single = index.search(query, 5, allowed=mask)
+                    assert [d for d, _ in hits] == [d for d, _ in single]
+                    assert np.allclose([s for _, s in hits], [s for _, s in single])
+
+        vectors = _unit_vectors(len(texts), 16, seed=12)
+        dense = DenseVectorIndex.build(Path(tmp) / "dense.npy", np.arange(len(texts)), vectors, {})
+        dense.remove([4])
+        dense.add([len(texts) + 1], _unit_vectors(1, 16, seed=13))
+        query_vectors = _unit_vectors(20, 16, seed=14)
+        for mask in (None, allowed):
+            for query, hits in zip(query_vectors, dense.search_many(query_vectors, 5, allowed=mask)):
+                single = dense.search(query, 5, allowed=mask)
+                assert [d for d, _ in hits] == [d for d, _ in single]
+                assert np.allclose([s for _, s in hits], [s for _, s in single], atol=1e-5)
+    print(f"  {len(queries)} queries, routing {stats}")
+    print("  ✅ Batch retrieval works")
+
+
+def test_knowledge_pack():
+    """Test building, activating, loading and switching knowledge packs."""
+
+    print("\n📦 Testing Knowledge Packs")
+    print("=" * 40)
+
+    corpus = generate_corpus(300, seed=9)
+    queries = labelled_queries(corpus, 20)
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_dir, packs_dir = Path(tmp) / "knowledge", Path(tmp) / "packs"
+        write_corpus(corpus, knowledge_dir, paragraphs_per_file=100)
+        raw = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack="")
+
+        first = build_pack(knowledge_dir, packs_dir)
+        activate_pack(packs_dir, first.name)
+        assert resolve_pack(packs_dir / "current") == first.resolve()
+        retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack=packs_dir / "current")
+        assert retriever.knowledge_pack.version == first.name
+        assert retriever.source_fingerprints == raw.source_fingerprints
+        for query, _ in queries:
+            assert [d["page_content"] for d in retriever.retrieve(query, k=5)] == \
+                [d["page_content"] for d in raw.retrieve(query, k=5)]
+
+        # The packed index matches an in-memory one after live adds and removals
+        packed = KnowledgePack.open(first).lexical_index()
+        index = BM25Index()
+        for doc_id, text in enumerate(raw.knowledge_base):
+            index.add(doc_id, text)
+        for target in (packed, index):
+            target.remove(3, raw.knowledge_base[3])
+            target.add(1000, "Soybean rust spreads fast in humid weather")
+        for query, _ in queries + [("soybean rust humid", None)]:
+            assert packed.search(query, 10) == index.search(query, 10)
+
+        # A watcher scan over an unchanged folder does nothing
+        watcher = KnowledgeWatcher(retriever)
+        assert watcher.scan() == (0, 0)
+
+        # Live uploads are still checked for copies of the pack's chunks
+        assert len(retriever.duplicates) == len(retriever.knowledge_pack)
+        copy = knowledge_dir / "copy.txt"
+        copy.write_text(raw.knowledge_base[len(raw.knowledge_base) - 1], encoding="utf-8")
+        dropped = retriever.duplicates_dropped
+        assert retriever.upsert_document(copy) == (0, 0) and retriever.duplicates_dropped == dropped + 1
+        copy.unlink()
+        retriever.remove_document(copy)
+
+        # Publishing a new version is picked up by the next scan
+        (knowledge_dir / "rust.md").write_text(
+            "Soybean rust in Zambia shows tan lesions on the underside of lower leaves.", encoding="utf-8")
+        second = build_pack(knowledge_dir, packs_dir)
+        activate_pack(packs_dir, second.name)
+        version = retriever.knowledge_version
+        assert watcher.scan() == (0, 0)
+        assert retriever.knowledge_pack.version == second.name
+        assert len(retriever.duplicates) == len(retriever.knowledge_pack)
+        assert retriever.knowledge_version > version
+        assert "tan lesions" in retriever.retrieve("soybean rust tan lesions", k=1)[0]["page_content"]
+
+        assert prune_packs(packs_dir, keep=1) == [first.name]
+        assert resolve_pack(packs_dir / "current") == second.resolve()
+    print(f"  Pack {second.name}: {len(retriever.knowledge_base)} chunks")
+    print("  ✅ Knowledge packs work")
+
+
+def test_shared_pack_serving():
+    """Test serving straight from a memory-mapped pack, with live changes on top."""
+
+    print("\n🗺️  Testing Shared Pack Serving")
+    print("=" * 40)
+
+    corpus = generate_corpus(300, seed=12)
+    queries = labelled_queries(corpus, 10)
+    decoded = []
+    original_text = TextStore.__getitem__
+
+    def counting_text(store, chunk_id):
+        decoded.append(chunk_id)
+        return original_text(store, chunk_id)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge_dir, packs_dir = Path(tmp) / "knowledge", Path(tmp) / "packs"
+        write_corpus(corpus, knowledge_dir, paragraphs_per_file=100)
+        version = ensure_pack(knowledge_dir, packs_dir)
+        assert version is not None and ensure_pack(knowledge_dir, packs_dir) is None
+
+        TextStore.__getitem__ = counting_text
+        try:
+            retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack=packs_dir / "current")
+            assert not isinstance(retriever.knowledge_base, list) and not decoded
+            assert retriever._duplicates is None
+            query, answer = queries[0]
+            assert retriever.retrieve(query, k=3)[0]["page_content"] == answer
+            print(f"  Chunks decoded for one query: {len(decoded)} of {len(retriever.knowledge_base)}")
+            assert len(decoded) == 3
+        finally:
+            TextStore.__getitem__ = original_text
+        assert all(isinstance(ids, range) for ids in retriever._source_chunks.values())
+
+        # Files edited or deleted after the build are applied on top of the pack
+        files = sorted(knowledge_dir.glob("*.txt"))
+        gone = files[0].read_text(encoding="utf-8") + files[1].read_text(encoding="utf-8")
+        edited = "Soybean rust in Zambezi valley fields shows tan lesions on the underside of lower leaves."
+        files[0].write_text(edited, encoding="utf-8")
+        files[1].unlink()
+        watcher = KnowledgeWatcher(retriever)
+        assert watcher.scan() == (1, 1)
+        assert retriever.retrieve("zambezi valley", k=1)[0]["page_content"] == edited
+        for query, answer in queries:
+            contents = [doc["page_content"] for doc in retriever.retrieve(query, k=5)]
+            assert (answer in contents) != (answer in gone)
+        docs = retriever.retrieve("soybean", k=50, filters={"source": files[0].name})
+        assert [doc["page_content"] for doc in docs] == [edited]
+
+        # The next start rebuilds the pack from the changed folder
+        assert ensure_pack(knowledge_dir, packs_dir) not in (None, version)
+
+        # Same-size edits, metadata sidecars and chunk settings also make a pack stale
+        pack = KnowledgePack.open(packs_dir / "current")
+        assert pack_is_current(pack, knowledge_dir)
+        files[0].write_text(edited.replace("Zambezi", "Limpopo"), encoding="utf-8")
+        assert not pack_is_current(pack, knowledge_dir)
+        files[0].write_text(edited, encoding="utf-8")
+        (knowledge_dir / "_metadata.json").write_text('{"region": "south"}', encoding="utf-8")
+        assert not pack_is_current(pack, knowledge_dir)
+        (knowledge_dir / "_metadata.json").unlink()
+        original_tokens = Config.CHUNK_MAX_TOKENS
+        Config.CHUNK_MAX_TOKENS = original_tokens + 1
+        try:
+            assert not pack_is_current(pack, knowledge_dir)
+        finally:
+            Config.CHUNK_MAX_TOKENS = original_tokens
+        assert pack_is_current(pack, knowledge_dir)
+
+        # Workers loading the pack trust a touched file only if its content hash matches
+        retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack=packs_dir / "current")
+        assert KnowledgeWatcher(retriever).scan() == (0, 0)
+        files[0].write_text(edited.replace("Zambezi", "Limpopo"), encoding="utf-8")
+        retriever = RAGRetriever(knowledge_dir=knowledge_dir, knowledge_pack=packs_dir / "current")
+        assert KnowledgeWatcher(retriever).scan() == (1, 0)
+        assert "Limpopo" in retriever.retrieve("limpopo valley", k=1)[0]["page_content"]
+    print("  ✅ Shared pack serving works")
+
+
+def test_text_store():
+    """Test the compact chunk text store against a plain list."""
+
+    print("\n🗃️  Testing Text Store")
+    print("=" * 40)
+
+    texts = [f"Chunk {i}: soybean rust scouting notes, région {i % 7} — " + "x" * (i % 900) for i in range(3000)]
+    encoded = [text.encode("utf-8") for text in texts[:100]]
+    offsets = np.zeros(101, dtype=np.int64)
+    np.cumsum([len(blob) for blob in encoded], out=offsets[1:])
+    store = TextStore(np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets)
+    for text in texts[100:]:
+        store.append(text)
+    # Appended text beyond the flush size lives in the mapped spill file, the rest in the buffer
+    assert store.nbytes > SPILL_FLUSH_BYTES and store._written > 0 and store._pending
+    assert len(store) == len(texts) and list(store) == texts
+    assert store[2999] == texts[2999] and store[5] == texts[5]
+
+    store[5] = None
+    store[2000] = None
+    store.append("late chunk")
+    assert store[5] is None and store[2000] is None and store[3000] == "late chunk"
+    assert list(store.live_ids()) == [i for i in range(3001) if i not in (5, 2000)]
+    for bad in (lambda: store[3001], lambda: store.__setitem__(1, "edit")):
+        try:
+            bad()
+            assert False, "expected an error"
+        except (IndexError, TypeError):
+            pass
+    print(f"  ✅ {len(store)} chunks, {store.nbytes} bytes stored")
+
+
+def test_spelling_correction():
+    """Test that misspelled query words are searched as the closest indexed terms."""
+
+    print("\n🔤 Testing Spelling Correction")
+    print("=" * 40)
+
+    assert edit_distance("soyabean", "soybean", 2) == 1
+    assert edit_distance("mildue", "mildew", 2) == 2
+    assert edit_distance("rsut", "rust", 1) == 1  # Swapped neighbours are one edit
+    assert edit_distance("blight", "mildew", 2) == 3
+
+    speller = SpellingIndex(["soybean", "fertilizer", "mildew", "mild", "rust", "dust", "2023"])
+    assert speller.candidates("soyabean")[0] == (1, "soybean")
+    assert speller.candidates("fertiliser")[0] == (1, "fertilizer")
+    assert speller.candidates("mildue")[0] == (2, "mildew")
+    assert speller.candidates("soybaen") == [(1, "soybean")]
+    assert speller.candidates("rus") == [] and speller.candidates("2024") == []
+    assert speller.candidates("mildue", max_distance=1) == []
+
+    # Corrections prefer fewer edits, then the more frequent term; indexed words are left alone
+    index = BM25Index(["soybean rust", "rust on soybean rows", "dust on soybean leaves"])
+    assert index.corrections(["soybeam", "rusd", "leaf", "zzzz"]) == {"soybeam": "soybean", "rusd": "rust"}
+    index.add(3, "rusd in the field")
+    assert index.corrections(["rusd"]) == {}
+    assert correct_query("Soyabeans with MILDUE?", {"soyabean": "soybean", "mildue": "mildew"}) == \
+        "soybean with mildew?"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index.remove(3, "rusd in the field")
+        index.save(tmp, [0, 1, 2])
+        packed = PackedBM25Index.load(tmp)
+        packed.add(3, "frogeye leaf spot")
+        assert packed.corrections(["soybeam", "frogye"]) == {"soybeam": "soybean", "frogye": "frogeye"}
+
+    retriever = RAGRetriever(knowledge_dir=Path("/nonexistent"), knowledge_pack="")
+    retriever.result_cache = None
+    docs = retriever.retrieve("How do I treat powdry mildue on soyabeans?", k=1)
+    assert "mildew" in docs[0]["page_content"]
+    assert retriever.last_timings["corrections"]["mildue"] == "mildew"
+    batch = retriever.retrieve_many(["fertiliser at plantng", "powdery mildew"], k=1)
+    assert "fertilizer" in batch[0][0]["page_content"] and "mildew" in batch[1][0]["page_content"]
+    print(f"  ✅ Corrected {retriever.last_timings['corrections']} "
+          f"in {retriever.last_timings['spelling_ms']:.2f} ms")
+
+
+def test_max_score_pruning():
+    """Test that MaxScore pruning returns exact top-k while skipping postings."""
+
+    print("\n✂️  Testing MaxScore Pruning")
+    print("=" * 40)
+
+    corpus = generate_corpus(2000, seed=14)
+    texts = [paragraph for paragraph, _ in corpus]
+    queries = [query for query, _ in labelled_queries(corpus, 60)]
+    queries += ["soybean leaf spot", "soybean", "plant leaves rust soybean maize", "zzz"]
+    lexical = BM25Index(texts)
+    with tempfile.TemporaryDirectory() as tmp:
+        lexical.save(tmp, list(range(len(texts))))
+        packed = PackedBM25Index.load(tmp)
+        for index in (lexical, packed):
+            index.remove(7, texts[7])
+            index.add(len(texts) + 1, "Frogeye leaf spot on soybean: grey spots with a purple border " * 3)
+        allowed = np.random.default_rng(14).random(len(texts) + 2) < 0.5
+        for index in (lexical, packed):
+            for mask in (None, allowed):
+                # search_many scores every posting, so it is the exhaustive reference
+                for k in (1, 5, 20):
+                    for query, expected in zip(queries, index.search_many(queries, k, allowed=mask)):
+                        assert index.search(query, k, allowed=mask) == expected, (query, k)
+            stats = index.pruning_stats
+            assert stats["read"] < stats["postings"] * 0.8
+            print(f"  {type(index).__name__}: {1 - stats['read'] / stats['postings']:.0%} of postings skipped")
+        assert packed.search("frogeye leaf spot", 1)[0][0] == len(texts) + 1
+    print("  ✅ MaxScore pruning is exact")
+
+
+def test_phrase_and_proximity():
+    """Test that quoted phrases must match and close query terms rank higher."""
+
+    print("\n🔗 Testing Phrase and Proximity Matching")
+    print("=" * 40)
+
+    encoded = encode_document({3: [0, 5, 300], 900: [2]})
+    assert len(encoded) == 11  # Counts, gaps of terms and positions: one or two bytes each
+    assert decode_document(encoded, {3: "leaf", 900: "spot", 7: "rot"}) == {"leaf": [0, 5, 300], "spot": [2]}
+    assert min_distance([0, 5, 300], [2, 298]) == 2
+    assert phrases('treat "rot of the root" and "frogeye"') == [[("rot", 0), ("root", 3)]]
+
+    texts = [
+        "Frogeye leaf spot forms small grey lesions with a purple border on upper soybean leaves "
+        "in humid weather.",
+        "Leaf damage from hail was followed by weeks of drought and heat, and frogeye came late "
+        "across the whole field. Spot checks found frogeye, frogeye everywhere.",
+        "Charcoal rot of the root shows in hot dry weather.",
+        "Root rot and charcoal dust in stored soybean.",
+    ] + [f"Soybean field note {i} about leaf colour and weeds." for i in range(30)]
+    lexical = BM25Index(texts)
+    with tempfile.TemporaryDirectory() as tmp:
+        lexical.save(tmp, list(range(len(texts))))
+        packed = PackedBM25Index.load(tmp)
+        for index in (lexical, packed):
+            # Bag of words prefers the repeated words; proximity lifts the real disease name
+            assert index._ranked("frogeye leaf spot", 1, None, (index.idf, index.average_length))[0][0] == 1
+            assert index.search("frogeye leaf spot", 1)[0][0] == 0
+            assert [doc_id for doc_id, _ in index.search('"charcoal rot"', 5)] == [2]
+            assert [doc_id for doc_id, _ in index.search('"rot of the root" weather', 5)] == [2]
+            assert index.search('"root charcoal"', 5) == []
+            queries = ["frogeye leaf spot", '"charcoal rot" soybean', "leaf", "soybean leaf weeds"]
+            for k in (1, 3, 10):
+                assert index.search_many(queries, k) == [index.search(query, k) for query in queries]
+        assert packed.search("frogeye leaf spot", 4) == lexical.search("frogeye leaf spot", 4)
+
+        packed.remove(0, texts[0])
+        packed.add(len(texts), "Spot checks found frogeye leaf spot in the lower canopy.")
+        assert [doc_id for doc_id, _ in packed.search('"frogeye leaf spot"', 5)] == [len(texts)]
+
+        knowledge = Path(tmp) / "knowledge"
+        knowledge.mkdir()
+        (knowledge / "diseases.txt").write_text("\n\n".join(texts[:4]), encoding="utf-8")
+        retriever = RAGRetriever(knowledge_dir=knowledge, knowledge_pack="")
+        retriever.result_cache = None
+        assert "Charcoal rot of the root" in retriever.retrieve('"charcoal rot"', k=1)[0]["page_content"]
+        # No chunk holds the phrase, so its words are matched anywhere
+        assert retriever.retrieve('"spot frogeye"', k=1)
+        assert retriever.retrieve_many(['"spot frogeye"', '"charcoal rot"'], k=1)[1] == \
+            retriever.retrieve('"charcoal rot"', k=1)
+    print("  ✅ Phrases filter and proximity boosts ranking")
+
+
+def test_sharded_retrieval():
+    """Test that retrieval split across shard processes matches a single retriever."""
+
+    print("\n🧩 Testing Sharded Retrieval")
+    print("=" * 40)
+
+    # Each API worker would start its own shards, so several workers never shard
+    shards, workers = Config.RETRIEVAL_SHARDS, Config.API_WORKERS
+    try:
+        Config.RETRIEVAL_SHARDS, Config.API_WORKERS = 3, 1
+        assert sharding_enabled()
+        Config.API_WORKERS = 4
+        assert not sharding_enabled()
+        Config.RETRIEVAL_SHARDS, Config.API_WORKERS = 1, 1
+        assert not sharding_enabled()
+    finally:
+        Config.RETRIEVAL_SHARDS, Config.API_WORKERS = shards, workers
+
+    corpus = generate_corpus(300, seed=13)
+    queries = [query for query, _ in labelled_queries(corpus, 20)]
+    queries += ["When should I sow soybean seed?", "zzz unknown words"]
+    with tempfile.TemporaryDirectory() as tmp:
+        knowledge = Path(tmp) / "knowledge"
+        write_corpus(corpus, knowledge, paragraphs_per_file=25)
+        single = RAGRetriever(knowledge_dir=knowledge, knowledge_pack="")
+        single.result_cache = None
+        sharded = ShardedRetriever(shards=3, knowledge_dir=knowledge)
+        try:
+            assert len(sharded.shard_chunks) == 3 and all(sharded.shard_chunks)
+            assert sum(sharded.shard_chunks) == sum(text is not None for text in single.knowledge_base)
+
+            # Corpus-wide BM25 statistics make the merged ranking match the unsharded one (up to ties)
+            ids = {text: doc_id for doc_id, text in enumerate(single.knowledge_base) if text is not None}
+
+            def scores(query, docs, allowed):
+                bm25 = dict(single.lexical_index.search(query, len(single.knowledge_base), allowed=allowed))
+                return [round(bm25[ids[d["page_content"]]], 6) for d in docs]
+
+            for filters in (None, {"crop_stage": "flowering"}):
+                allowed = single.metadata_index.evaluate(filters) if filters else None
+                batch = sharded.retrieve_many(queries[:-1], k=5, filters=filters)
+                for query, docs in zip(queries, batch):
+                    assert scores(query, docs, allowed) == scores(query, single.retrieve(query, 5, filters), allowed)
+            assert sharded.retrieve(queries[0], k=5)[0] == single.retrieve(queries[0], k=5)[0]
+            assert len(sharded.retrieve(queries[-1], k=5)) == 5
+            typo = "powdry mildue on soyabeans"
+            assert sharded.retrieve(typo, k=3) == single.retrieve(typo, k=3)
+            assert sharded.last_timings["corrections"]["mildue"] == "mildew"
+            assert sharded.last_timings["shards"] == 3
+            # Repeated queries are answered from the coordinator's result cache
+            assert sharded.retrieve(typo, k=3) == single.retrieve(typo, k=3)
+            assert sharded.last_timings["cache_hits"] == 1 and sharded.cache_stats()["retrieval"]["hits"] >= 1
+
+            # A new file is indexed by the one shard that owns it
+            new_file = knowledge / "rust_alert.txt"
+            new_file.write_text("Soybean rust was confirmed in the Mkushi block this week.", encoding="utf-8")
+            version = sharded.knowledge_version
+            added, removed = sharded.upsert_document(new_file)
+            assert added == 1 and removed == 0
+            assert sharded.knowledge_version != version
+            owner = shard_of(new_file, knowledge, 3)
+            stats = sharded.cache_stats()["shards"]
+            assert stats[owner]["knowledge_version"] > 0
+            assert "Mkushi" in sharded.retrieve("rust Mkushi", k=1)[0]["page_content"]
+            sharded.remove_document(new_file)
+            assert "Mkushi" not in sharded.retrieve("rust Mkushi", k=1)[0]["page_content"]
+        finally:
+            sharded.close()
+        assert not sharded._processes
+
+    print("✅ Sharded retrieval test passed!")
+
+
+if __name__ == "__main__":
+    test_bm25_index()
+    test_knowledge_cache()
+    test_knowledge_loader()
+    test_streaming_pdf_extraction()
+    test_live_knowledge_updates()
+    test_dense_vector_index()
+    test_ivf_index()
+    test_quantized_indexes()
+    test_chroma_index()
+    test_reciprocal_rank_fusion()
+    test_context_packer()
+    test_chunking_and_deduplication()
+    test_embedding_cache()
+    test_retrieval_cache()
+    test_benchmark_corpus()
+    test_knowledge_pack()
+    test_metadata_filters()
+    test_shared_pack_serving()
+    test_text_store()
+    test_spelling_correction()
+    test_max_score_pruning()
+    test_phrase_and_proximity()
+    test_topic_routing()
+    test_batch_retrieval()
+    test_sharded_retrieval()
+    print("\n✅ Retrieval tests passed!")